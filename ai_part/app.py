@@ -1,12 +1,39 @@
 from flask import Flask, request, jsonify
-import requests
 import json
+import asyncio
+import contextvars
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
 from datetime import datetime
 from langchain.chat_models import init_chat_model
 from langchain.agents import create_tool_calling_agent, AgentExecutor
 from langchain.prompts import ChatPromptTemplate
 from config.config import OPENAI_API_KEY, OPENAI_API_BASE, OPENAI_API_MODEL
-from tools import AVAILABLE_TOOLS, is_image_file, is_archive_file
+from config.config import WEBHOOK_ASYNC_MODE, JOB_WORKER_COUNT, JOB_QUEUE_MAX_SIZE, JOB_RESULT_TTL
+from config.config import SESSION_MAX_SESSIONS, SESSION_IDLE_TTL, SESSION_MAX_MESSAGES, SESSION_PERSIST_PATH
+from config.config import FAST_PATH_ENABLED
+from config.config import TOOL_PREDISPATCH_ENABLED, TOOL_PREDISPATCH_WORKERS
+from config.config import REPLY_STREAMING_ENABLED, REPLY_SEGMENT_MAX_CHARS
+from config.config import IDEMPOTENCY_TTL, IDEMPOTENCY_MAX_ENTRIES, IDEMPOTENCY_WAIT_TIMEOUT
+from config.config import PARALLEL_TOOL_CALLS_ENABLED, TOOL_CALL_MAX_CONCURRENCY, TOOL_CALL_TIMEOUT
+from config.config import FAQ_CACHE_ENABLED, FAQ_CACHE_THRESHOLD, FAQ_CACHE_TTL, FAQ_CACHE_MAX_ENTRIES, FAQ_CACHE_MAX_MESSAGE_CHARS, FAQ_CACHE_MAX_HISTORY
+from config.config import HISTORY_TOKEN_BUDGET, HISTORY_SUMMARY_TRIGGER, HISTORY_SUMMARY_MAX_USERS, HISTORY_SUMMARY_TTL
+from tools import AVAILABLE_TOOLS, analyze_image_content, extract_and_analyze_archive, is_image_file, is_archive_file, download_cache, vision_cache, phash_index, archive_cache, workspaces, vision_scope, tool_deadline, ToolDeadlineExceeded
+from jobs import JobQueue, JobQueueFull
+from history import HistoryCompactor
+from faq_cache import FAQCache
+from catalog import PRODUCTS, render_product_names, render_product_lines, catalog_fingerprint
+from fast_path import FastPathEngine
+from tool_runner import ParallelToolAgent
+from streaming import ReplyStream, StreamMetrics, DELIVERED, PARTIAL, UNDELIVERED
+from single_flight import SingleFlight, RunSuperseded
+from idempotency import IdempotencyStore, IdempotencyPending
+from caching import make_key
+from sessions import SessionStore, SessionMismatch
+import http_client
+import offload
 
 app = Flask(__name__)
 
@@ -24,25 +51,44 @@ import os
 SERVER_BASE_URL = os.environ.get("SERVER_BASE_URL", "http://part1:3000")
 AI_WEBHOOK_TOKEN = "default-token"  # 用于验证webhook请求
 
+# 增量协议的会话存储
+session_store = SessionStore(
+    max_sessions=SESSION_MAX_SESSIONS,
+    idle_ttl=SESSION_IDLE_TTL,
+    max_messages=SESSION_MAX_MESSAGES,
+    persist_path=SESSION_PERSIST_PATH,
+)
+
+# webhook幂等处理（server.js超时重试时不重复调用大模型和发送回复）
+idempotency = IdempotencyStore(
+    ttl=IDEMPOTENCY_TTL,
+    max_entries=IDEMPOTENCY_MAX_ENTRIES,
+    wait_timeout=IDEMPOTENCY_WAIT_TIMEOUT,
+)
+
+# 后台任务队列（异步模式下webhook只负责校验和入队）
+job_queue = JobQueue(
+    worker_count=JOB_WORKER_COUNT,
+    max_queue_size=JOB_QUEUE_MAX_SIZE,
+    result_ttl=JOB_RESULT_TTL,
+)
+
 # 智能客服系统提示词
-SYSTEM_PROMPT = """你是一个专业的电商客服助手，请遵循以下指导原则：
+SYSTEM_PROMPT = f"""你是一个专业的电商客服助手，请遵循以下指导原则：
 
 1. 身份设定：你是一个友好、专业、耐心的在线客服代表。
 2. 服务态度：始终保持礼貌、热情、积极的服务态度。
 3. 回复风格：简洁明了，重点突出，易于理解，模仿淘宝商家的客服风格。
 4. 其他要求：不要让用户察觉到你是AI助手，全力模拟人类客服的交流方式。
 5. 专业领域：
-   - 商品咨询（iPhone 15 Pro、MacBook Air M2、AirPods Pro、iPad Air等）
+   - 商品咨询（{render_product_names()}等）
    - 订单查询和处理
    - 售后服务支持
    - 技术问题解答
    - 购买建议和推荐
 
 6. 商品信息：
-   - iPhone 15 Pro: ¥7999，搭载A17 Pro芯片，最新款iPhone
-   - MacBook Air M2: ¥8999，轻薄便携的笔记本电脑
-   - AirPods Pro: ¥1999，主动降噪无线耳机
-   - iPad Air: ¥4399，轻薄强大的平板电脑
+{render_product_lines()}
 
 7. 回复要求：
    - 每次回复控制在150字以内，如果内容较多可以分段回复
@@ -69,12 +115,207 @@ prompt = ChatPromptTemplate.from_messages([
     ("placeholder", "{agent_scratchpad}"),
 ])
 
-# 创建工具调用代理
-agent = create_tool_calling_agent(llm, AVAILABLE_TOOLS, prompt)
-agent_executor = AgentExecutor(agent=agent, tools=AVAILABLE_TOOLS, verbose=True)
+# 创建工具调用代理（并行模式下同一步的多个工具调用同时执行）
+if PARALLEL_TOOL_CALLS_ENABLED:
+    agent_executor = ParallelToolAgent(
+        llm,
+        AVAILABLE_TOOLS,
+        prompt,
+        max_concurrency=TOOL_CALL_MAX_CONCURRENCY,
+        tool_timeout=TOOL_CALL_TIMEOUT,
+        deadline_var=tool_deadline,
+    )
+else:
+    agent = create_tool_calling_agent(llm, AVAILABLE_TOOLS, prompt)
+    agent_executor = AgentExecutor(agent=agent, tools=AVAILABLE_TOOLS, verbose=True)
+
+# 纯文本消息用不到工具，直接调用大模型（不发送工具定义，也没有agent循环）
+direct_prompt = ChatPromptTemplate.from_messages([
+    ("system", SYSTEM_PROMPT),
+    ("placeholder", "{chat_history}"),
+    ("human", "{input}"),
+])
+direct_chain = direct_prompt | llm
+
+def select_tool(message_type, file_url):
+    """根据消息类型和文件扩展名确定需要调用的工具，不需要工具时返回None"""
+    if not file_url:
+        return None
+    if message_type == "image":
+        return analyze_image_content
+    if message_type == "file":
+        if is_archive_file(file_url):
+            return extract_and_analyze_archive
+        if is_image_file(file_url):
+            return analyze_image_content
+    return None
+
+# 流式回复指标（首段耗时、完整回复耗时）
+stream_metrics = StreamMetrics()
+
+def stream_direct_reply(chain_input, reply_stream):
+    """流式调用大模型，边生成边按句推送到server.js，返回完整回复"""
+    parts = []
+    for chunk in direct_chain.stream(chain_input):
+        if reply_stream.cancelled():
+            raise RunSuperseded("用户有更新的消息，停止生成")
+        if chunk.content:
+            parts.append(chunk.content)
+            reply_stream.push(chunk.content)
+    reply_stream.close()
+    return "".join(parts)
+
+async def astream_direct_reply(chain_input, reply_stream):
+    """stream_direct_reply 的异步版本"""
+    parts = []
+    async for chunk in direct_chain.astream(chain_input):
+        if reply_stream.cancelled():
+            raise RunSuperseded("用户有更新的消息，停止生成")
+        if chunk.content:
+            parts.append(chunk.content)
+            await reply_stream.apush(chunk.content)
+    await reply_stream.aclose()
+    return "".join(parts)
+
+def requires_tools(message_type, file_url):
+    """只有图片和压缩包消息需要走agent调用工具"""
+    return select_tool(message_type, file_url) is not None
+
+# 工具预执行：webhook到达时直接执行确定的工具，与排队、上下文构建并行，
+# 大模型只需一次调用即可基于工具结果回复，省去由大模型选择工具的一轮调用
+predispatch_executor = ThreadPoolExecutor(max_workers=TOOL_PREDISPATCH_WORKERS, thread_name_prefix="tool-predispatch")
 
-def build_conversation_context(conversation_history, current_message, message_type="text", file_url=None):
-    """构建包含历史上下文的对话"""
+def start_tool_predispatch(message_type, file_url, user_id=None):
+    """在线程池中启动工具，返回 Future；不需要工具或未开启预执行时返回None"""
+    tool = select_tool(message_type, file_url)
+    if tool is None or not TOOL_PREDISPATCH_ENABLED:
+        return None
+    print(f"预先执行工具 {tool.name}: {file_url}")
+    # 工具在线程池中执行，带上当前用户以便近似重复图片只在同一用户内复用；
+    # 截止时间从提交时开始计算，工具内部的下载、进程池和视觉模型请求据此缩短超时，超时后线程自行结束
+    deadline = time.monotonic() + TOOL_CALL_TIMEOUT
+    context = contextvars.copy_context()
+    context.run(vision_scope.set, str(user_id) if user_id else None)
+    context.run(tool_deadline.set, deadline)
+    future = predispatch_executor.submit(context.run, tool.func, file_url)
+    future.deadline = deadline
+    return future
+
+def astart_tool_predispatch(message_type, file_url, user_id=None):
+    """start_tool_predispatch 的异步版本，返回在当前事件循环中运行的 Task"""
+    tool = select_tool(message_type, file_url)
+    if tool is None or not TOOL_PREDISPATCH_ENABLED:
+        return None
+    print(f"预先执行工具 {tool.name}: {file_url}")
+    
+    async def run_tool():
+        vision_scope.set(str(user_id) if user_id else None)
+        tool_deadline.set(time.monotonic() + TOOL_CALL_TIMEOUT)
+        # 超时在任务内部计算，从创建任务时开始计时，到期后工具协程被取消
+        return await asyncio.wait_for(tool.coroutine(file_url), TOOL_CALL_TIMEOUT)
+    
+    return asyncio.get_running_loop().create_task(run_tool())
+
+def describe_tool_failure(error):
+    """工具预执行超时或出错时写入当前消息的说明，由大模型据此向用户解释"""
+    if isinstance(error, (FutureTimeoutError, asyncio.TimeoutError, ToolDeadlineExceeded)):
+        return f"文件分析超时（超过{TOOL_CALL_TIMEOUT}秒），未能获取文件内容。请向用户说明，并建议稍后重新发送或用文字描述文件内容。"
+    return f"文件分析失败（{error}），未能获取文件内容。请向用户说明，并建议重新发送文件或用文字描述文件内容。"
+
+def wait_tool_output(tool_future):
+    """等待工具预执行的结果，最多等到提交时确定的截止时间；超时或出错时返回说明文字"""
+    try:
+        return tool_future.result(timeout=max(0.0, tool_future.deadline - time.monotonic()))
+    except Exception as e:
+        # 仍在排队的工具直接取消；已在运行的工具无法从外部中断，由其内部的截止时间结束
+        tool_future.cancel()
+        print(f"工具预执行未完成: {e!r}")
+        return describe_tool_failure(e)
+
+async def await_tool_output(tool_task):
+    """wait_tool_output 的异步版本，超时由工具任务自身处理"""
+    try:
+        return await tool_task
+    except Exception as e:
+        print(f"工具预执行未完成: {e!r}")
+        return describe_tool_failure(e)
+
+SUMMARY_PROMPT = """请把下面的客服对话整理成一段摘要，供后续回复参考。
+要求：保留用户的需求、关注的商品、订单和售后信息、用户发送过的文件及分析结论、已经给出的答复和承诺；
+去掉寒暄；不超过200字；只输出摘要内容。
+
+已有摘要：
+{summary}
+
+新增对话：
+{dialogue}"""
+
+def build_summary_messages(previous_summary, turns):
+    """构建增量摘要请求：已有摘要 + 新折叠的对话"""
+    dialogue = "\n".join(f"{'用户' if role == 'human' else '客服'}：{content}" for role, content in turns)
+    return [("human", SUMMARY_PROMPT.format(summary=previous_summary or "（无）", dialogue=dialogue))]
+
+def summarize_history(previous_summary, turns):
+    return llm.invoke(build_summary_messages(previous_summary, turns)).content.strip()
+
+async def asummarize_history(previous_summary, turns):
+    response = await llm.ainvoke(build_summary_messages(previous_summary, turns))
+    return response.content.strip()
+
+# 对话历史压缩：最近的对话保留原文，较早的对话折叠为按用户缓存的摘要
+history_compactor = HistoryCompactor(
+    summarize_history,
+    asummarize_history,
+    recent_budget=HISTORY_TOKEN_BUDGET,
+    summary_trigger=HISTORY_SUMMARY_TRIGGER,
+    max_users=HISTORY_SUMMARY_MAX_USERS,
+    ttl=HISTORY_SUMMARY_TTL,
+)
+
+# 常见问题回复缓存，提示词或模型变化时整体失效
+faq_cache = FAQCache(
+    threshold=FAQ_CACHE_THRESHOLD,
+    ttl=FAQ_CACHE_TTL,
+    max_entries=FAQ_CACHE_MAX_ENTRIES,
+    max_message_chars=FAQ_CACHE_MAX_MESSAGE_CHARS,
+)
+faq_cache.set_version(make_key(SYSTEM_PROMPT, catalog_fingerprint(), OPENAI_API_MODEL))
+
+# 商品价格、规格类问题的快速回复
+fast_path_engine = FastPathEngine(PRODUCTS)
+
+def lookup_fast_path_reply(user_message, message_type, file_url):
+    """意图明确的商品价格、规格问题直接按商品目录回复"""
+    if not FAST_PATH_ENABLED or message_type != "text" or file_url:
+        return None
+    answered = fast_path_engine.answer(user_message)
+    if answered is None:
+        return None
+    reply, intent = answered
+    print(f"商品问题快速回复（意图: {intent}），跳过大模型调用")
+    return reply
+
+def is_faq_cacheable(conversation_history, message_type, file_url):
+    """只缓存纯文本、没有此前对话（回复不依赖上下文）的咨询"""
+    return (FAQ_CACHE_ENABLED and message_type == "text" and not file_url
+            and len(conversation_history or []) <= FAQ_CACHE_MAX_HISTORY)
+
+def lookup_faq_reply(user_message, conversation_history, message_type, file_url):
+    """查询常见问题缓存，命中时返回缓存的回复"""
+    if not is_faq_cacheable(conversation_history, message_type, file_url):
+        return None
+    cached = faq_cache.lookup(user_message)
+    if cached is None:
+        return None
+    reply, source, score = cached
+    print(f"常见问题缓存命中（{source}，相似度 {score}），跳过大模型调用")
+    return reply
+
+def history_to_turns(conversation_history):
+    """把server.js传来的历史消息转换为 (角色, 内容) 列表
+
+    与历史消息一一对应（空消息也保留），序号与会话存储一致；空消息由 history_compactor 跳过
+    """
     chat_history = []
     
     # 添加历史对话
@@ -86,13 +327,16 @@ def build_conversation_context(conversation_history, current_message, message_ty
             elif msg.get('type') == 'file' and msg.get('fileUrl'):
                 content += f" [发送了文件: {msg.get('fileUrl')}]"
             
-            if content.strip():
-                role = msg.get('role', 'user')
-                if role == 'user':
-                    chat_history.append(("human", content))
-                else:
-                    chat_history.append(("ai", content))
+            role = msg.get('role', 'user')
+            if role == 'user':
+                chat_history.append(("human", content))
+            else:
+                chat_history.append(("ai", content))
     
+    return chat_history
+
+def build_current_input(current_message, message_type="text", file_url=None, tool_output=None):
+    """构建当前消息（附带文件信息和工具提示；工具已预先执行时附带工具结果）"""
     # 构建当前消息
     current_content = current_message
     
@@ -112,51 +356,154 @@ def build_conversation_context(conversation_history, current_message, message_ty
         else:
             current_content += f" [用户发送了一个文件: {file_url}]"
     
-    if tool_hint:
+    if tool_output is not None:
+        current_content += f"\n\n[文件分析结果]\n{tool_output}\n\n请根据以上分析结果回复用户。"
+    elif tool_hint:
         current_content += f" {tool_hint}"
     
-    return chat_history, current_content
+    return current_content
+
+def build_conversation_context(conversation_history, current_message, message_type="text", file_url=None, user_id=None, tool_future=None, history_base=0):
+    """构建包含历史上下文的对话（超出token预算的较早对话折叠为摘要）
 
-def get_ai_response_with_context_and_tools(user_message, conversation_history=None, message_type="text", file_url=None):
-    """调用大模型获取智能回复（包含上下文和工具调用）"""
+    传入 tool_future 时在历史构建完成后等待工具结果并写入当前消息；
+    history_base 为 conversation_history[0] 在会话中的序号（会话存储裁掉历史开头后不为0）
+    """
+    chat_history = history_compactor.compact(user_id, history_to_turns(conversation_history), history_base)
+    tool_output = wait_tool_output(tool_future) if tool_future is not None else None
+    return chat_history, build_current_input(current_message, message_type, file_url, tool_output)
+
+async def abuild_conversation_context(conversation_history, current_message, message_type="text", file_url=None, user_id=None, tool_task=None, history_base=0):
+    """build_conversation_context 的异步版本"""
+    chat_history = await history_compactor.acompact(user_id, history_to_turns(conversation_history), history_base)
+    tool_output = await await_tool_output(tool_task) if tool_task is not None else None
+    return chat_history, build_current_input(current_message, message_type, file_url, tool_output)
+
+def get_ai_response_with_context_and_tools(user_message, conversation_history=None, message_type="text", file_url=None, user_id=None, tool_future=None, reply_stream=None, history_base=0):
+    """调用大模型获取智能回复（包含上下文和工具调用）
+
+    tool_future 为webhook到达时已启动的工具预执行任务，未传入时在这里启动；
+    传入 reply_stream 时直接调用大模型的回复边生成边分段推送
+    """
     try:
         print(f"开始处理用户消息: {user_message}")
         print(f"消息类型: {message_type}, 文件URL: {file_url}")
         
-        # 构建包含历史上下文的对话
+        fast_reply = lookup_fast_path_reply(user_message, message_type, file_url)
+        if fast_reply is not None:
+            return fast_reply
+        cached_reply = lookup_faq_reply(user_message, conversation_history, message_type, file_url)
+        if cached_reply is not None:
+            return cached_reply
+        
+        if tool_future is None:
+            tool_future = start_tool_predispatch(message_type, file_url, user_id)
+        
+        # 构建包含历史上下文的对话（工具在后台执行）
         chat_history, current_input = build_conversation_context(
-            conversation_history, user_message, message_type, file_url
+            conversation_history, user_message, message_type, file_url, user_id=user_id, tool_future=tool_future,
+            history_base=history_base,
         )
         
         print(f"发送给大模型的历史消息数: {len(chat_history)}")
         print(f"当前输入: {current_input}")
         
-        # 使用agent执行器调用大模型（支持工具调用）
-        result = agent_executor.invoke({
-            "input": current_input,
-            "chat_history": chat_history
-        })
+        if tool_future is None and requires_tools(message_type, file_url):
+            # 使用agent执行器调用大模型（支持工具调用）
+            result = agent_executor.invoke({
+                "input": current_input,
+                "chat_history": chat_history
+            })
+            response = result.get("output", "")
+        else:
+            print("直接调用大模型" + ("（已附带工具预执行结果）" if tool_future is not None else ""))
+            chain_input = {
+                "input": current_input,
+                "chat_history": chat_history
+            }
+            if reply_stream is not None:
+                response = stream_direct_reply(chain_input, reply_stream)
+            else:
+                response = direct_chain.invoke(chain_input).content
+        print(f"AI回复: {response}")
+        
+        if not response:
+            return "抱歉，我没能理解您的问题，请您再详细描述一下。"
+        if is_faq_cacheable(conversation_history, message_type, file_url):
+            faq_cache.store(user_message, response.strip())
+        return response.strip()
+        
+    except Exception as e:
+        print(f"大模型调用失败: {e}")
+        return "我也不太清楚这个问题呢。"
+
+async def aget_ai_response_with_context_and_tools(user_message, conversation_history=None, message_type="text", file_url=None, user_id=None, tool_task=None, reply_stream=None, history_base=0):
+    """调用大模型获取智能回复（异步版本，使用agent的ainvoke）"""
+    try:
+        print(f"开始处理用户消息: {user_message}")
+        print(f"消息类型: {message_type}, 文件URL: {file_url}")
+        
+        fast_reply = lookup_fast_path_reply(user_message, message_type, file_url)
+        if fast_reply is not None:
+            return fast_reply
+        cached_reply = lookup_faq_reply(user_message, conversation_history, message_type, file_url)
+        if cached_reply is not None:
+            return cached_reply
+        
+        if tool_task is None:
+            tool_task = astart_tool_predispatch(message_type, file_url, user_id)
+        
+        chat_history, current_input = await abuild_conversation_context(
+            conversation_history, user_message, message_type, file_url, user_id=user_id, tool_task=tool_task,
+            history_base=history_base,
+        )
+        
+        print(f"发送给大模型的历史消息数: {len(chat_history)}")
+        print(f"当前输入: {current_input}")
         
-        response = result.get("output", "")
+        if tool_task is None and requires_tools(message_type, file_url):
+            result = await agent_executor.ainvoke({
+                "input": current_input,
+                "chat_history": chat_history
+            })
+            response = result.get("output", "")
+        else:
+            print("直接调用大模型" + ("（已附带工具预执行结果）" if tool_task is not None else ""))
+            chain_input = {
+                "input": current_input,
+                "chat_history": chat_history
+            }
+            if reply_stream is not None:
+                response = await astream_direct_reply(chain_input, reply_stream)
+            else:
+                response = (await direct_chain.ainvoke(chain_input)).content
         print(f"AI回复: {response}")
         
-        return response.strip() if response else "抱歉，我没能理解您的问题，请您再详细描述一下。"
+        if not response:
+            return "抱歉，我没能理解您的问题，请您再详细描述一下。"
+        if is_faq_cacheable(conversation_history, message_type, file_url):
+            faq_cache.store(user_message, response.strip())
+        return response.strip()
         
     except Exception as e:
         print(f"大模型调用失败: {e}")
         return "我也不太清楚这个问题呢。"
 
+def build_reply_payload(user_id, reply_message):
+    """构建发送给server.js的AI回复数据"""
+    return {
+        "userId": user_id,
+        "message": reply_message,
+        "type": "text"
+    }
+
 def send_ai_reply_to_server(user_id, reply_message):
     """将AI回复发送回server.js（使用新的AI回复接口）"""
     try:
         url = f"{SERVER_BASE_URL}/api/ai/reply"
-        data = {
-            "userId": user_id,
-            "message": reply_message,
-            "type": "text"
-        }
+        data = build_reply_payload(user_id, reply_message)
         
-        response = requests.post(url, json=data, timeout=5)
+        response = http_client.request("POST", url, json=data)
         if response.status_code == 200:
             result = response.json()
             message_count = result.get('messageCount', 1)
@@ -170,13 +517,369 @@ def send_ai_reply_to_server(user_id, reply_message):
         print(f"发送AI回复到服务器失败: {e}")
         return False
 
+async def asend_ai_reply_to_server(user_id, reply_message):
+    """将AI回复发送回server.js（异步版本）"""
+    try:
+        url = f"{SERVER_BASE_URL}/api/ai/reply"
+        data = build_reply_payload(user_id, reply_message)
+        
+        response = await http_client.arequest("POST", url, json=data)
+        if response.status_code == 200:
+            result = response.json()
+            message_count = result.get('messageCount', 1)
+            print(f"成功发送AI回复到用户 {user_id}, 分段数: {message_count}")
+            return True
+        else:
+            print(f"发送AI回复失败，状态码: {response.status_code}")
+            return False
+            
+    except Exception as e:
+        print(f"发送AI回复到服务器失败: {e}")
+        return False
+
+def build_failure_payload(user_id):
+    """后台处理失败时通知server.js结束该用户的处理状态（不包含回复内容）"""
+    return {
+        "userId": user_id,
+        "failed": True
+    }
+
+def send_reply_failure(user_id):
+    """通知server.js本次消息处理失败"""
+    try:
+        url = f"{SERVER_BASE_URL}/api/ai/reply"
+        response = http_client.request("POST", url, json=build_failure_payload(user_id))
+        if response.status_code == 200:
+            print(f"已通知服务器用户 {user_id} 的消息处理失败")
+            return True
+        print(f"发送处理失败通知失败，状态码: {response.status_code}")
+        return False
+    except Exception as e:
+        print(f"发送处理失败通知到服务器失败: {e}")
+        return False
+
+async def asend_reply_failure(user_id):
+    """send_reply_failure 的异步版本"""
+    try:
+        url = f"{SERVER_BASE_URL}/api/ai/reply"
+        response = await http_client.arequest("POST", url, json=build_failure_payload(user_id))
+        if response.status_code == 200:
+            print(f"已通知服务器用户 {user_id} 的消息处理失败")
+            return True
+        print(f"发送处理失败通知失败，状态码: {response.status_code}")
+        return False
+    except Exception as e:
+        print(f"发送处理失败通知到服务器失败: {e}")
+        return False
+
+def build_segment_payload(user_id, segment, final, reply_id, seq, cancelled=False):
+    """构建流式回复的分段数据，final 表示回复结束，cancelled 表示回复被放弃；server.js 按 (replyId, seq) 丢弃重复的分段"""
+    return {
+        "userId": user_id,
+        "message": segment,
+        "type": "text",
+        "stream": True,
+        "final": final,
+        "cancelled": cancelled,
+        "replyId": reply_id,
+        "seq": seq
+    }
+
+def send_reply_segment(user_id, segment, final, reply_id, seq, cancelled=False):
+    """将一段流式回复发送到server.js（带序号，读超时后可以安全重试）"""
+    try:
+        url = f"{SERVER_BASE_URL}/api/ai/reply"
+        response = http_client.request("POST", url, idempotent=True,
+                                       json=build_segment_payload(user_id, segment, final, reply_id, seq, cancelled))
+        if response.status_code == 200:
+            return True
+        print(f"发送分段回复失败，状态码: {response.status_code}")
+        return False
+    except Exception as e:
+        print(f"发送分段回复到服务器失败: {e}")
+        return False
+
+async def asend_reply_segment(user_id, segment, final, reply_id, seq, cancelled=False):
+    """send_reply_segment 的异步版本"""
+    try:
+        url = f"{SERVER_BASE_URL}/api/ai/reply"
+        response = await http_client.arequest("POST", url, idempotent=True,
+                                              json=build_segment_payload(user_id, segment, final, reply_id, seq, cancelled))
+        if response.status_code == 200:
+            return True
+        print(f"发送分段回复失败，状态码: {response.status_code}")
+        return False
+    except Exception as e:
+        print(f"发送分段回复到服务器失败: {e}")
+        return False
+
+def new_reply_stream(user_id, run):
+    """创建一次回复的流式发送状态，未开启流式回复时返回None"""
+    if not REPLY_STREAMING_ENABLED:
+        return None
+    reply_id = uuid.uuid4().hex
+    return ReplyStream(
+        stream_metrics,
+        max_chars=REPLY_SEGMENT_MAX_CHARS,
+        send=lambda segment, final, seq, cancelled: send_reply_segment(user_id, segment, final, reply_id, seq, cancelled),
+        asend=lambda segment, final, seq, cancelled: asend_reply_segment(user_id, segment, final, reply_id, seq, cancelled),
+        cancelled=lambda: run.superseded,
+    )
+
+# 同一用户同时只处理一条消息，新消息到达时较早的处理作废
+user_runs = SingleFlight()
+
+def build_superseded_result(conversation_history, message_type):
+    """较早的消息被更新的消息取代时的处理结果（不发送回复）"""
+    return {
+        "success": True,
+        "superseded": True,
+        "reply": "",
+        "contextLength": len(conversation_history),
+        "toolsUsed": message_type in ['image', 'file'],
+    }
+
+def build_process_result(delivery, ai_reply, conversation_history, message_type):
+    """回复处理结果：部分送达时用户已看到部分回复，按成功处理，避免重复投递时重新生成另一份回复"""
+    return {
+        "success": delivery != UNDELIVERED,
+        "delivery": delivery,
+        "reply": ai_reply,
+        "contextLength": len(conversation_history),
+        "toolsUsed": message_type in ['image', 'file'],
+    }
+
+@contextmanager
+def scoped_vision(user_id):
+    """处理期间由agent调用的工具按当前用户隔离近似重复图片的复用"""
+    token = vision_scope.set(str(user_id))
+    try:
+        yield
+    finally:
+        vision_scope.reset(token)
+
+def process_webhook_message(user_id, user_message, conversation_history, message_type, file_url, tool_future=None, history_base=0):
+    """执行一次完整的客服回复流程：调用大模型并把回复发送回server.js
+
+    同一用户的消息串行处理；处理期间收到更新的消息时放弃本次回复，由更新的消息结合完整上下文统一回复
+    """
+    with user_runs.run(str(user_id)) as run, scoped_vision(user_id):
+        if run.superseded:
+            print(f"用户 {user_id} 有更新的消息，跳过本条消息")
+            user_runs.skipped()
+            if tool_future is not None:
+                tool_future.cancel()
+            return build_superseded_result(conversation_history, message_type)
+        
+        reply_stream = new_reply_stream(user_id, run)
+        # 获取AI回复（包含历史上下文和工具调用）
+        ai_reply = get_ai_response_with_context_and_tools(
+            user_message, 
+            conversation_history, 
+            message_type, 
+            file_url,
+            user_id=user_id,
+            tool_future=tool_future,
+            reply_stream=reply_stream,
+            history_base=history_base,
+        )
+        
+        if run.superseded:
+            print(f"用户 {user_id} 有更新的消息，丢弃本次回复")
+            user_runs.dropped()
+            # 已推送部分分段时发送取消标记结束这次回复（在让出给更新的消息之前，不影响其处理状态）
+            if reply_stream is not None and reply_stream.segments:
+                reply_stream.abort()
+            return build_superseded_result(conversation_history, message_type)
+        print(f"最终AI回复: {ai_reply}")
+        
+        # 发送回复到server.js（已流式推送的回复只需发送结束标记，推送中途出错时附带兜底回复）
+        if reply_stream is not None and reply_stream.segments:
+            delivery = reply_stream.finish("" if reply_stream.completed else ai_reply)
+        else:
+            delivery = DELIVERED if send_ai_reply_to_server(user_id, ai_reply) else UNDELIVERED
+    return build_process_result(delivery, ai_reply, conversation_history, message_type)
+
+async def aprocess_webhook_message(user_id, user_message, conversation_history, message_type, file_url, tool_task=None, history_base=0):
+    """process_webhook_message 的异步版本，供ASGI入口使用（有更新的消息时直接取消本次处理）"""
+    try:
+        with scoped_vision(user_id):
+            async with user_runs.arun(str(user_id)) as run:
+                reply_stream = new_reply_stream(user_id, run)
+                try:
+                    ai_reply = await aget_ai_response_with_context_and_tools(
+                        user_message, 
+                        conversation_history, 
+                        message_type, 
+                        file_url,
+                        user_id=user_id,
+                        tool_task=tool_task,
+                        reply_stream=reply_stream,
+                        history_base=history_base,
+                    )
+                except asyncio.CancelledError:
+                    # 推送中途被更新的消息取消：发送取消标记结束已开始的回复，再让出给更新的消息
+                    if run.superseded and reply_stream is not None and reply_stream.segments:
+                        await reply_stream.aabort()
+                    raise
+                
+                if run.superseded:
+                    print(f"用户 {user_id} 有更新的消息，丢弃本次回复")
+                    user_runs.dropped()
+                    if reply_stream is not None and reply_stream.segments:
+                        await reply_stream.aabort()
+                    return build_superseded_result(conversation_history, message_type)
+                print(f"最终AI回复: {ai_reply}")
+                
+                if reply_stream is not None and reply_stream.segments:
+                    delivery = await reply_stream.afinish("" if reply_stream.completed else ai_reply)
+                else:
+                    delivery = DELIVERED if await asend_ai_reply_to_server(user_id, ai_reply) else UNDELIVERED
+    except RunSuperseded:
+        print(f"用户 {user_id} 有更新的消息，已取消本条消息的处理")
+        if tool_task is not None:
+            tool_task.cancel()
+        return build_superseded_result(conversation_history, message_type)
+    return build_process_result(delivery, ai_reply, conversation_history, message_type)
+
+def needs_failure_notice(result):
+    """回复没有完整送达：结束标记可能丢失，需要通知server.js结束处理状态（部分送达的任务仍记为成功）"""
+    return not result["success"] or result.get("delivery") == PARTIAL
+
+def run_webhook_job(user_id, *args, **kwargs):
+    """后台任务入口：处理出错或回复未完整送达时通知server.js，避免该用户一直停留在处理中状态"""
+    try:
+        result = process_webhook_message(user_id, *args, **kwargs)
+    except Exception:
+        send_reply_failure(user_id)
+        raise
+    if needs_failure_notice(result):
+        send_reply_failure(user_id)
+    return result
+
+async def arun_webhook_job(user_id, *args, **kwargs):
+    """run_webhook_job 的异步版本"""
+    try:
+        result = await aprocess_webhook_message(user_id, *args, **kwargs)
+    except Exception:
+        await asend_reply_failure(user_id)
+        raise
+    if needs_failure_notice(result):
+        await asend_reply_failure(user_id)
+    return result
+
+def is_authorized_webhook(auth_header):
+    """校验webhook请求的Bearer令牌"""
+    return auth_header.startswith('Bearer ') and auth_header.split(' ')[1] == AI_WEBHOOK_TOKEN
+
+def parse_webhook_payload(data):
+    """提取webhook请求中的消息信息并打印日志"""
+    payload = {
+        "user_message": data.get('message', ''),
+        "user_id": data.get('userId', ''),
+        "message_type": data.get('type', 'text'),
+        "file_url": data.get('fileUrl'),
+        "timestamp": data.get('timestamp', ''),
+        "conversation_history": data.get('conversationHistory', []),
+        # 增量协议：会话ID + 起始序号 + 新增消息
+        "conversation_id": data.get('conversationId'),
+        "base_index": data.get('baseIndex', 0),
+        "messages": data.get('messages', []),
+        "resync": bool(data.get('resync', False)),
+    }
+    
+    print(f"收到用户消息webhook:")
+    print(f"时间: {payload['timestamp']}")
+    print(f"用户ID: {payload['user_id']}")
+    print(f"消息内容: {payload['user_message']}")
+    print(f"消息类型: {payload['message_type']}")
+    print(f"文件URL: {payload['file_url']}")
+    if payload['conversation_id']:
+        print(f"会话: {payload['conversation_id']}, 起始序号: {payload['base_index']}, "
+              f"新增消息数: {len(payload['messages'])}, 完整同步: {payload['resync']}")
+    else:
+        print(f"历史消息数: {len(payload['conversation_history'])}")
+    return payload
+
+def is_valid_delta(payload):
+    """校验增量协议字段"""
+    base_index = payload["base_index"]
+    return (isinstance(base_index, int) and not isinstance(base_index, bool) and base_index >= 0
+            and isinstance(payload["messages"], list))
+
+def resolve_conversation_history(payload):
+    """增量协议下合并新增消息，返回 (完整历史, 已确认序号)；未使用增量协议时序号为None
+
+    序号或会话对不上时抛出 SessionMismatch
+    """
+    if not payload["conversation_id"]:
+        return payload["conversation_history"], None
+    return session_store.apply(
+        str(payload["user_id"]),
+        str(payload["conversation_id"]),
+        payload["base_index"],
+        payload["messages"],
+        resync=payload["resync"],
+    )
+
+def history_base_index(conversation_history, ack_index):
+    """历史第一条消息在会话中的序号（会话存储裁掉较早的消息后不为0）"""
+    return 0 if ack_index is None else ack_index - len(conversation_history)
+
+def webhook_idempotency_key(data, header_key=None):
+    """幂等键：优先使用调用方提供的键或消息ID，否则由用户ID、最新消息、时间戳和文件生成"""
+    client_key = header_key or data.get('idempotencyKey') or data.get('messageId')
+    if client_key:
+        return make_key("client", data.get('userId', ''), client_key)
+    return make_key("derived", data.get('userId', ''), data.get('message', ''),
+                    data.get('timestamp', ''), data.get('fileUrl') or '')
+
+def build_queued_payload(queued, ack_index, job=None, duplicate=False):
+    """异步模式的入队响应；重复的请求返回原任务及其当前状态（已完成时附带回复）"""
+    payload = {
+        "success": True,
+        "message": "重复的请求，返回已有任务" if duplicate else "消息已进入处理队列",
+        "jobId": queued["jobId"],
+        "status": job["status"] if job else "queued",
+        "contextLength": queued["contextLength"],
+        "ackIndex": ack_index,
+        "duplicate": duplicate,
+        "timestamp": datetime.now().isoformat()
+    }
+    if job and job["status"] == "succeeded" and job["result"]:
+        payload["reply"] = job["result"]["reply"]
+    return payload
+
+def is_failed_job(job):
+    """入队记录对应的任务已失败：重复投递时重新入队处理，而不是返回失败的任务"""
+    return job is not None and job["status"] == "failed"
+
+def build_pending_payload():
+    """原请求仍在处理中，重复请求等待超时"""
+    return {
+        "success": False,
+        "error": "相同的请求正在处理中，请稍后再试",
+        "duplicate": True,
+        "timestamp": datetime.now().isoformat()
+    }
+
+def build_resync_payload(error):
+    """构建要求server.js完整重新同步的响应"""
+    return {
+        "success": False,
+        "error": "会话需要重新同步",
+        "resync": True,
+        "conversationId": error.conversation_id,
+        "expectedIndex": error.expected_index,
+        "timestamp": datetime.now().isoformat()
+    }
+
 @app.route('/ai-webhook', methods=['POST'])
 def webhook_handler():
     """处理来自server.js的webhook请求（支持历史上下文和工具调用）"""
     try:
         # 验证请求头
-        auth_header = request.headers.get('Authorization', '')
-        if not auth_header.startswith('Bearer ') or auth_header.split(' ')[1] != AI_WEBHOOK_TOKEN:
+        if not is_authorized_webhook(request.headers.get('Authorization', '')):
             return jsonify({"error": "未授权的请求"}), 401
         
         # 获取请求数据
@@ -185,51 +888,107 @@ def webhook_handler():
             return jsonify({"error": "无效的JSON数据"}), 400
         
         # 提取消息信息
-        user_message = data.get('message', '')
-        user_id = data.get('userId', '')
-        message_type = data.get('type', 'text')
-        file_url = data.get('fileUrl')
-        timestamp = data.get('timestamp', '')
-        conversation_history = data.get('conversationHistory', [])
-        
-        print(f"收到用户消息webhook:")
-        print(f"时间: {timestamp}")
-        print(f"用户ID: {user_id}")
-        print(f"消息内容: {user_message}")
-        print(f"消息类型: {message_type}")
-        print(f"文件URL: {file_url}")
-        print(f"历史消息数: {len(conversation_history)}")
+        payload = parse_webhook_payload(data)
+        user_message = payload["user_message"]
+        user_id = payload["user_id"]
+        message_type = payload["message_type"]
+        file_url = payload["file_url"]
         
         # 验证必要参数
         if not user_message or not user_id:
             return jsonify({"error": "缺少必要参数"}), 400
+        if payload["conversation_id"] and not is_valid_delta(payload):
+            return jsonify({"error": "无效的增量消息"}), 400
         
-        # 获取AI回复（包含历史上下文和工具调用）
-        ai_reply = get_ai_response_with_context_and_tools(
-            user_message, 
-            conversation_history, 
-            message_type, 
-            file_url
-        )
-        print(f"最终AI回复: {ai_reply}")
+        try:
+            conversation_history, ack_index = resolve_conversation_history(payload)
+            history_base = history_base_index(conversation_history, ack_index)
+        except SessionMismatch as e:
+            print(f"会话需要重新同步: {e}")
+            return jsonify(build_resync_payload(e)), 409
+        
+        idempotency_key = webhook_idempotency_key(data, request.headers.get('Idempotency-Key'))
+        
+        # 异步模式：入队后立即确认，由后台线程调用大模型并回复
+        if WEBHOOK_ASYNC_MODE:
+            def enqueue():
+                # 图片、压缩包消息立即开始下载和分析，与排队等待并行
+                tool_future = start_tool_predispatch(message_type, file_url, user_id)
+                try:
+                    job_id = job_queue.submit(
+                        run_webhook_job,
+                        user_id,
+                        user_message,
+                        conversation_history,
+                        message_type,
+                        file_url,
+                        tool_future=tool_future,
+                        history_base=history_base,
+                        meta={"userId": user_id},
+                    )
+                except JobQueueFull:
+                    if tool_future is not None:
+                        tool_future.cancel()
+                    raise
+                return {"jobId": job_id, "contextLength": len(conversation_history)}
+            
+            try:
+                queued, duplicate = idempotency.run(
+                    idempotency_key, enqueue,
+                    discard=lambda queued: is_failed_job(job_queue.get(queued["jobId"])),
+                )
+            except JobQueueFull as e:
+                print(f"任务入队失败: {e}")
+                return jsonify({
+                    "success": False,
+                    "error": "服务繁忙，请稍后重试",
+                    "timestamp": datetime.now().isoformat()
+                }), 503
+            
+            if duplicate:
+                print(f"重复的webhook请求，返回已有任务: {queued['jobId']}")
+                return jsonify(build_queued_payload(queued, ack_index, job_queue.get(queued["jobId"]), True)), 202
+            print(f"消息已入队，任务ID: {queued['jobId']}")
+            return jsonify(build_queued_payload(queued, ack_index)), 202
+        
+        def run_now():
+            return process_webhook_message(
+                user_id,
+                user_message,
+                conversation_history,
+                message_type,
+                file_url,
+                tool_future=start_tool_predispatch(message_type, file_url, user_id),
+                history_base=history_base,
+            )
         
-        # 发送回复到server.js
-        success = send_ai_reply_to_server(user_id, ai_reply)
+        # 发送失败的结果不保存，server.js重试时重新处理
+        try:
+            result, duplicate = idempotency.run(idempotency_key, run_now, keep=lambda result: result["success"])
+        except IdempotencyPending as e:
+            print(f"重复的webhook请求: {e}")
+            return jsonify(build_pending_payload()), 409
+        if duplicate:
+            print("重复的webhook请求，返回已保存的回复")
         
-        if success:
+        if result["success"]:
             return jsonify({
                 "success": True,
                 "message": "AI回复发送成功",
-                "reply": ai_reply,
-                "contextLength": len(conversation_history),
-                "toolsUsed": message_type in ['image', 'file'],
+                "reply": result["reply"],
+                "contextLength": result["contextLength"],
+                "toolsUsed": result["toolsUsed"],
+                "superseded": result.get("superseded", False),
+                "delivery": result.get("delivery"),
+                "duplicate": duplicate,
+                "ackIndex": ack_index,
                 "timestamp": datetime.now().isoformat()
             }), 200
         else:
             return jsonify({
                 "success": False,
                 "message": "AI回复发送失败",
-                "reply": ai_reply,
+                "reply": result["reply"],
                 "timestamp": datetime.now().isoformat()
             }), 500
             
@@ -241,10 +1000,22 @@ def webhook_handler():
             "timestamp": datetime.now().isoformat()
         }), 500
 
+@app.route('/ai-webhook/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """查询异步任务的处理状态"""
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({"error": "任务不存在或已过期"}), 404
+    return jsonify(job)
+
 @app.route('/status', methods=['GET'])
 def status_check():
     """健康检查端点"""
-    return jsonify({
+    return jsonify(build_status_payload(job_queue))
+
+def build_status_payload(queue):
+    """构建状态检查返回数据（Flask与ASGI入口共用）"""
+    return {
         "status": "running",
         "service": "AI智能客服Webhook服务",
         "model": OPENAI_API_MODEL,
@@ -254,11 +1025,28 @@ def status_check():
             "智能分段回复",
             "文件消息处理",
             "图片内容识别",
-            "压缩包解压分析"
+            "压缩包解压分析",
+            "异步任务队列"
         ],
         "available_tools": [tool.name for tool in AVAILABLE_TOOLS],
+        "async_mode": WEBHOOK_ASYNC_MODE,
+        "job_queue": queue.stats(),
+        "http_pool": http_client.pool_stats(),
+        "download_cache": download_cache.stats(),
+        "vision_cache": vision_cache.stats(),
+        "phash_index": phash_index.stats(),
+        "archive_cache": archive_cache.stats(),
+        "offload_pool": offload.stats(),
+        "workspaces": workspaces.stats(),
+        "history_compactor": history_compactor.stats(),
+        "faq_cache": faq_cache.stats(),
+        "fast_path": fast_path_engine.stats(),
+        "reply_streaming": stream_metrics.stats(),
+        "user_runs": user_runs.stats(),
+        "idempotency": idempotency.stats(),
+        "sessions": session_store.stats(),
         "timestamp": datetime.now().isoformat()
-    })
+    }
 
 @app.route('/test', methods=['GET'])
 def test_ai():
@@ -334,14 +1122,17 @@ def test_tools():
             "timestamp": datetime.now().isoformat()
         }), 500
 
-if __name__ == '__main__':
+def main():
+    """启动Flask服务（由 main.py 调用，进程池的工作进程不会重复导入本模块）"""
     print("🤖 AI智能客服Webhook服务启动中...")
     print(f"📡 Webhook端点: http://localhost:3001/ai-webhook")
+    print(f"📬 任务查询: http://localhost:3001/ai-webhook/jobs/<job_id>")
     print(f"🔍 状态检查: http://localhost:3001/status")
     print(f"🧪 AI测试: http://localhost:3001/test")
     print(f"📋 上下文测试: http://localhost:3001/test-context")
     print(f"🛠️ 工具测试: http://localhost:3001/test-tools")
     print(f"🎯 使用模型: {OPENAI_API_MODEL}")
+    print("⚡ 异步入口: uvicorn asgi:app --host 0.0.0.0 --port 3001")
     print("✨ 新功能:")
     print("  - 支持对话历史上下文")
     print("  - 防抖动机制处理连续消息")
@@ -352,4 +1143,7 @@ if __name__ == '__main__':
     print(f"🛠️ 可用工具: {[tool.name for tool in AVAILABLE_TOOLS]}")
     print("等待接收用户消息...")
     
-    app.run(host='0.0.0.0', port=3001, debug=True)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=3001, debug=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,555 @@
+"""压缩包内存检查：直接读取中央目录/文件头列出成员，按需读取成员的前缀字节
+
+所有读取器提供相同接口，分析逻辑不需要关心压缩包格式，也不需要把整个压缩包解压到磁盘。
+DirectoryReader 以同样接口包装已解压的目录，供传统的整体解压流程复用分析逻辑。
+读取器可附带 ArchiveBudget：打开后先按元数据检查，读取时再按实际解压的字节数和耗时检查。
+"""
+import io
+from abc import ABC, abstractmethod
+import os
+import subprocess
+import time
+import zipfile
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import py7zr
+from py7zr.io import Py7zIO, WriterFactory
+import rarfile
+from PIL import Image
+
+from filetypes import (
+    SUPPORTED_IMAGE_FORMATS,
+    TEXT_FILE_EXTENSIONS,
+    decode_text_preview,
+    is_executable_header,
+    is_text_content,
+    sniff_extension,
+)
+from config.config import (
+    ARCHIVE_INSPECT_IN_MEMORY,
+    ARCHIVE_MAX_TOTAL_BYTES,
+    ARCHIVE_MAX_MEMBERS,
+    ARCHIVE_MAX_MEMBER_BYTES,
+    ARCHIVE_MAX_RATIO,
+    ARCHIVE_ANALYSIS_TIMEOUT,
+    ARCHIVE_EXEC_TIMEOUT,
+)
+
+
+# 流式读取时每次读取的字节数
+READ_CHUNK_SIZE = 64 * 1024
+
+# 只对解压后超过该大小的成员检查压缩比，避免高度重复的小文本文件被误判
+RATIO_CHECK_MIN_BYTES = 1024 * 1024
+
+
+class ArchiveLimitExceeded(Exception):
+    """压缩包超出解压资源限制"""
+
+
+class ArchiveLimits(NamedTuple):
+    max_total_bytes: int
+    max_members: int
+    max_member_bytes: int
+    max_ratio: float
+    timeout: float
+
+
+class ArchiveBudget:
+    """单次分析的解压预算，超出任一限制时抛出 ArchiveLimitExceeded"""
+
+    def __init__(self, limits: ArchiveLimits):
+        self.limits = limits
+        self.deadline = time.monotonic() + limits.timeout
+        self.total_bytes = 0
+
+    def check_members(self, members: List["ArchiveMember"]):
+        """解压前按元数据检查成员数量、大小和压缩比"""
+        limits = self.limits
+        if len(members) > limits.max_members:
+            raise ArchiveLimitExceeded(f"文件数量 {len(members)} 超过上限 {limits.max_members}")
+        total = 0
+        for member in members:
+            self._check_member(member.basename, member.size, member.compressed_size)
+            total += member.size
+        if total > limits.max_total_bytes:
+            raise ArchiveLimitExceeded(f"解压后总大小 {total} 字节超过上限 {limits.max_total_bytes} 字节")
+
+    def consume(self, name: str, member_bytes: int, nbytes: int, compressed_size: int = 0):
+        """记录新解压出的 nbytes 字节，member_bytes 为该成员已解压的累计字节数"""
+        self.total_bytes += nbytes
+        self._check_member(Path(name).name, member_bytes, compressed_size)
+        if self.total_bytes > self.limits.max_total_bytes:
+            raise ArchiveLimitExceeded(f"解压数据量超过上限 {self.limits.max_total_bytes} 字节")
+        self.check_time()
+
+    def check_time(self):
+        if time.monotonic() > self.deadline:
+            raise ArchiveLimitExceeded(f"处理时间超过 {self.limits.timeout} 秒")
+
+    def _check_member(self, name: str, size: int, compressed_size: int):
+        limits = self.limits
+        if size > limits.max_member_bytes:
+            raise ArchiveLimitExceeded(f"文件 {name} 解压后超过单个文件上限 {limits.max_member_bytes} 字节")
+        if compressed_size and size >= RATIO_CHECK_MIN_BYTES and size > compressed_size * limits.max_ratio:
+            raise ArchiveLimitExceeded(f"文件 {name} 压缩比超过 {limits.max_ratio}:1")
+
+
+class ArchiveMember(NamedTuple):
+    """压缩包成员（不含目录）"""
+    name: str
+    size: int
+    compressed_size: int
+
+    @property
+    def basename(self) -> str:
+        return Path(self.name).name
+
+    @property
+    def suffix(self) -> str:
+        return Path(self.name).suffix.lower()
+
+
+def safe_member_path(root: Path, name: str) -> Path:
+    """成员在 root 下的路径，去掉绝对路径和 .. 等会跳出 root 的部分"""
+    parts = [part for part in Path(name.replace("\\", "/")).parts if part not in ("/", "..")]
+    if not parts:
+        raise ValueError(f"无效的文件路径: {name}")
+    return Path(root).joinpath(*parts)
+
+
+class ArchiveReader(ABC):
+    """压缩包只读接口"""
+
+    budget: Optional[ArchiveBudget] = None
+
+    @abstractmethod
+    def members(self) -> List[ArchiveMember]:
+        """列出成员（不含目录）"""
+
+    @abstractmethod
+    def read_prefixes(self, names: Iterable[str], limit: Optional[int]) -> Dict[str, bytes]:
+        """读取多个成员的前 limit 字节（limit 为 None 时读取全部内容）"""
+
+    @abstractmethod
+    def materialize(self, name: str, dest_dir: Path, filename: Optional[str] = None) -> Path:
+        """将单个成员写到 dest_dir 下并返回路径，filename 默认为成员的文件名"""
+
+    def extract_all(self, dest_dir: Path):
+        """将全部成员按原目录结构写到 dest_dir 下，与 materialize 一样逐块计入预算"""
+        for member in self.members():
+            target = safe_member_path(dest_dir, member.name)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            self.materialize(member.name, target.parent, target.name)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ZipLikeReader(ArchiveReader):
+    """zipfile 与 rarfile 的接口一致，共用同一实现"""
+
+    def __init__(self, archive, budget: Optional[ArchiveBudget] = None):
+        self._archive = archive
+        self.budget = budget
+
+    def members(self) -> List[ArchiveMember]:
+        return [
+            ArchiveMember(info.filename, info.file_size, info.compress_size)
+            for info in self._archive.infolist()
+            if not info.is_dir()
+        ]
+
+    def read_prefixes(self, names: Iterable[str], limit: Optional[int]) -> Dict[str, bytes]:
+        data = {}
+        for name in names:
+            buffer = io.BytesIO()
+            self._copy(name, buffer, limit)
+            data[name] = buffer.getvalue()
+        return data
+
+    def materialize(self, name: str, dest_dir: Path, filename: Optional[str] = None) -> Path:
+        # 只使用文件名，避免成员路径跳出工作目录
+        target = Path(dest_dir) / Path(filename or name).name
+        with open(target, "wb") as out:
+            self._copy(name, out, None)
+        return target
+
+    def _copy(self, name: str, out, limit: Optional[int]):
+        """分块解压成员写入 out，每块都计入预算"""
+        info = self._archive.getinfo(name)
+        copied = 0
+        with self._archive.open(info) as f:
+            while limit is None or copied < limit:
+                size = READ_CHUNK_SIZE if limit is None else min(READ_CHUNK_SIZE, limit - copied)
+                chunk = f.read(size)
+                if not chunk:
+                    break
+                copied += len(chunk)
+                out.write(chunk)
+                if self.budget is not None:
+                    self.budget.consume(name, copied, len(chunk), info.compress_size)
+
+    def close(self):
+        self._archive.close()
+
+
+class SevenZipReader(ArchiveReader):
+    """7z 读取器：同一次调用中读取多个成员，固实压缩块只需解压一遍"""
+
+    def __init__(self, archive: py7zr.SevenZipFile, budget: Optional[ArchiveBudget] = None):
+        self._archive = archive
+        self.budget = budget
+
+    def members(self) -> List[ArchiveMember]:
+        return [
+            ArchiveMember(info.filename, info.uncompressed or 0, info.compressed or 0)
+            for info in self._archive.list()
+            if not info.is_directory
+        ]
+
+    def read_prefixes(self, names: Iterable[str], limit: Optional[int]) -> Dict[str, bytes]:
+        names = list(names)
+        if not names:
+            return {}
+        self._archive.reset()
+        # 解压出的数据逐块写入 _BudgetedWriter：只保留前 limit 字节，每块都计入预算
+        factory = _BudgetedWriterFactory(limit, self.budget)
+        self._archive.extract(targets=names, factory=factory)
+        return {name: product.getvalue() for name, product in factory.products.items()}
+
+    def materialize(self, name: str, dest_dir: Path, filename: Optional[str] = None) -> Path:
+        # 只使用文件名，避免成员路径跳出工作目录
+        target = Path(dest_dir) / Path(filename or name).name
+        target.write_bytes(self.read_prefixes([name], None)[name])
+        return target
+
+    def extract_all(self, dest_dir: Path):
+        # 一次解压全部成员（固实压缩块只解压一遍），逐块写入文件并计入预算
+        self._archive.reset()
+        factory = _BudgetedFileWriterFactory(Path(dest_dir), self.budget)
+        try:
+            self._archive.extractall(factory=factory)
+        finally:
+            for product in factory.products.values():
+                product.close()
+
+    def close(self):
+        self._archive.close()
+
+
+class DirectoryReader(ArchiveReader):
+    """以压缩包接口读取已解压的目录"""
+
+    def __init__(self, root: Path, budget: Optional[ArchiveBudget] = None):
+        self.root = Path(root)
+        self.budget = budget
+
+    def members(self) -> List[ArchiveMember]:
+        members = []
+        for current, _, files in os.walk(self.root):
+            for file in files:
+                path = Path(current) / file
+                size = path.stat().st_size
+                members.append(ArchiveMember(str(path.relative_to(self.root)), size, size))
+        return members
+
+    def read_prefixes(self, names: Iterable[str], limit: Optional[int]) -> Dict[str, bytes]:
+        data = {}
+        for name in names:
+            with open(self.root / name, "rb") as f:
+                data[name] = f.read(limit) if limit is not None else f.read()
+        return data
+
+    def materialize(self, name: str, dest_dir: Path, filename: Optional[str] = None) -> Path:
+        return self.root / name
+
+
+class _BudgetedWriter(Py7zIO):
+    """只保留前 limit 字节（默认保留在内存中，也可写入 out），全部解压出的字节都计入预算"""
+
+    def __init__(self, filename: str, limit: Optional[int], budget: Optional[ArchiveBudget], out=None):
+        self.filename = filename
+        self.limit = limit
+        self.budget = budget
+        self.written = 0
+        self._buffer = out if out is not None else io.BytesIO()
+
+    def write(self, s) -> int:
+        self.written += len(s)
+        if self.budget is not None:
+            self.budget.consume(self.filename, self.written, len(s))
+        room = len(s) if self.limit is None else self.limit - self._buffer.tell()
+        if room > 0:
+            self._buffer.write(s[:room])
+        return len(s)
+
+    def read(self, size: Optional[int] = None) -> bytes:
+        return self._buffer.read(size)
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self._buffer.seek(offset, whence)
+
+    def flush(self) -> None:
+        pass
+
+    def size(self) -> int:
+        return self.written
+
+    def getvalue(self) -> bytes:
+        return self._buffer.getvalue()
+
+    def close(self) -> None:
+        # 成员解压完成时由 py7zr 调用；内存缓冲保留给 getvalue，文件则关闭
+        if not isinstance(self._buffer, io.BytesIO):
+            self._buffer.close()
+
+class _BudgetedWriterFactory(WriterFactory):
+    def __init__(self, limit: Optional[int], budget: Optional[ArchiveBudget]):
+        self.limit = limit
+        self.budget = budget
+        self.products: Dict[str, _BudgetedWriter] = {}
+
+    def create(self, filename: str) -> Py7zIO:
+        product = _BudgetedWriter(filename, self.limit, self.budget)
+        self.products[filename] = product
+        return product
+
+
+class _BudgetedFileWriterFactory(_BudgetedWriterFactory):
+    """把成员按原目录结构写到 dest_dir 下的文件"""
+
+    def __init__(self, dest_dir: Path, budget: Optional[ArchiveBudget]):
+        super().__init__(None, budget)
+        self.dest_dir = dest_dir
+
+    def create(self, filename: str) -> Py7zIO:
+        target = safe_member_path(self.dest_dir, filename)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        product = _BudgetedWriter(filename, None, self.budget, open(target, "w+b"))
+        self.products[filename] = product
+        return product
+
+
+def open_archive(file_path: str, file_ext: str, budget: Optional[ArchiveBudget] = None) -> ArchiveReader:
+    """按格式打开压缩包，不支持的格式抛出 ValueError"""
+    if file_ext == '.zip':
+        return ZipLikeReader(zipfile.ZipFile(file_path, 'r'), budget)
+    if file_ext == '.rar':
+        return ZipLikeReader(rarfile.RarFile(file_path, 'r'), budget)
+    if file_ext == '.7z':
+        return SevenZipReader(py7zr.SevenZipFile(file_path, 'r'), budget)
+    raise ValueError(f"不支持的压缩包格式: {file_ext}")
+
+
+TEXT_PREVIEW_CHARS = 1000
+
+# 前缀不足以读取图片尺寸时（如JPEG带较大的EXIF），最多读取的头部字节数
+IMAGE_HEADER_BYTES = 64 * 1024
+
+# 单个压缩包的解压资源限制
+ARCHIVE_LIMITS = ArchiveLimits(
+    max_total_bytes=ARCHIVE_MAX_TOTAL_BYTES,
+    max_members=ARCHIVE_MAX_MEMBERS,
+    max_member_bytes=ARCHIVE_MAX_MEMBER_BYTES,
+    max_ratio=ARCHIVE_MAX_RATIO,
+    timeout=ARCHIVE_ANALYSIS_TIMEOUT,
+)
+
+
+class ArchiveInspection(NamedTuple):
+    """检查阶段的结果（可在进程间传递），视觉分析由调用方根据 vision_images 完成"""
+    file_count: int
+    text_files_content: List[str]
+    image_files_info: List[Optional[str]]
+    other_files_info: List[str]
+    vision_images: List[Tuple[int, str, str]]
+    # 报告中包含成员的执行输出（取决于执行时的时间、环境和网络，不能按压缩包内容缓存）
+    executed: bool = False
+
+
+def safe_read_prefixes(reader: ArchiveReader, names: List[str], limit: Optional[int]) -> Dict[str, bytes]:
+    """批量读取成员前缀，批量失败时逐个重试，读取失败的成员不出现在结果中"""
+    try:
+        return reader.read_prefixes(names, limit)
+    except ArchiveLimitExceeded:
+        raise
+    except Exception as e:
+        print(f"批量读取压缩包成员失败，改为逐个读取: {e}")
+    data = {}
+    for name in names:
+        try:
+            data.update(reader.read_prefixes([name], limit))
+        except ArchiveLimitExceeded:
+            raise
+        except Exception as e:
+            print(f"读取压缩包成员 {name} 失败: {e}")
+    return data
+
+
+def classify_member(member: ArchiveMember, head: bytes) -> str:
+    """根据头部字节判断成员类型，空文件等无法判断时参考扩展名"""
+    # 判断文件是否为可执行的二进制文件,不要通过后缀名判断
+    if is_executable_header(head[:4]):
+        return "executable"
+    if sniff_extension(head) in SUPPORTED_IMAGE_FORMATS:
+        return "image"
+    if head and is_text_content(head, member.suffix):
+        return "text"
+    if not head and member.suffix in TEXT_FILE_EXTENSIONS:
+        return "text"
+    return "other"
+
+
+class ArchiveAnalysis:
+    """单个压缩包分析过程中的共享状态，各类型处理函数向其中追加结果"""
+
+    def __init__(self, reader: ArchiveReader, work_dir: Path, image_count: int):
+        self.reader = reader
+        self.work_dir = work_dir
+        self.text_files_content: List[str] = []
+        # 图片按成员顺序占位，视觉分析结果稍后按位置填入
+        self.image_files_info: List[Optional[str]] = [None] * image_count
+        self.image_slots: Dict[str, int] = {}
+        # 送视觉模型分析的图片：(在image_files_info中的位置, 文件名, 写到工作目录的路径)
+        self.vision_images: List[Tuple[int, str, str]] = []
+        self.vision_names: set = set()
+        self.other_files_info: List[str] = []
+        self.executed = False
+        self.materialized = 0
+
+    def materialize(self, member: ArchiveMember) -> Path:
+        """将成员写到工作目录，文件名加序号前缀，不同目录下的同名成员不会互相覆盖"""
+        self.work_dir.mkdir(exist_ok=True)
+        self.materialized += 1
+        return self.reader.materialize(member.name, self.work_dir, f"{self.materialized}_{member.basename}")
+
+
+def handle_text_member(analysis: ArchiveAnalysis, member: ArchiveMember, head: bytes):
+    """文本文件：只解码读取到的前缀作为预览"""
+    truncated = member.size > len(head)
+    content = decode_text_preview(head, truncated)
+    if content is None:
+        analysis.other_files_info.append(f"📄 {member.basename} ({member.size} 字节) - 无法读取文本内容")
+        return
+    if len(content) > TEXT_PREVIEW_CHARS or truncated:
+        content = content[:TEXT_PREVIEW_CHARS] + f"...(内容过长，已截取前{TEXT_PREVIEW_CHARS}字符)"
+    analysis.text_files_content.append(f"📄 {member.basename}:\n{content}")
+
+
+def handle_image_member(analysis: ArchiveAnalysis, member: ArchiveMember, head: bytes):
+    """未送视觉模型的图片：从头部读取尺寸和格式，头部不够时再多读一些"""
+    if member.name in analysis.vision_names:
+        return
+    index = analysis.image_slots[member.name]
+    try:
+        try:
+            img = Image.open(io.BytesIO(head))
+        except Exception:
+            if member.size <= len(head):
+                raise
+            head = analysis.reader.read_prefixes([member.name], IMAGE_HEADER_BYTES)[member.name]
+            img = Image.open(io.BytesIO(head))
+        with img:
+            width, height = img.size
+            format_name = img.format
+        analysis.image_files_info[index] = f"🖼️ {member.basename}: {width}x{height}像素, {format_name}格式 ({member.size} 字节)"
+    except Exception:
+        analysis.image_files_info[index] = f"🖼️ {member.basename} ({member.size} 字节) - 图片信息读取失败"
+
+
+def handle_executable_member(analysis: ArchiveAnalysis, member: ArchiveMember, head: bytes):
+    """可执行文件：只将该文件写到工作目录并执行"""
+    file_path = analysis.materialize(member)
+    os.chmod(file_path, 0o755)  # 设置为可执行
+    analysis.executed = True
+    try:
+        result = subprocess.run([str(file_path)], cwd=analysis.work_dir, stdin=subprocess.DEVNULL,
+                                capture_output=True, timeout=ARCHIVE_EXEC_TIMEOUT)
+        output = result.stdout.decode("utf-8", errors="replace")
+        preview = f"{output[:100]}..." if len(output) > 100 else output
+        analysis.other_files_info.append(f"💻 {member.basename} ({member.size} 字节) - 执行输出: {preview}")
+    except subprocess.TimeoutExpired:
+        analysis.other_files_info.append(f"💻 {member.basename} ({member.size} 字节) - 执行超时（{ARCHIVE_EXEC_TIMEOUT}秒）")
+    except Exception as e:
+        analysis.other_files_info.append(f"💻 {member.basename} ({member.size} 字节) - 执行失败: {str(e)}")
+
+
+def handle_other_member(analysis: ArchiveAnalysis, member: ArchiveMember, head: bytes):
+    """其他文件类型：只记录大小和格式"""
+    analysis.other_files_info.append(f"📎 {member.basename} ({member.size} 字节, {member.suffix}格式)")
+
+
+# 成员类型 -> 处理函数，类型由 classify_member 根据头部字节判断
+ARCHIVE_MEMBER_HANDLERS = {
+    "text": handle_text_member,
+    "image": handle_image_member,
+    "executable": handle_executable_member,
+    "other": handle_other_member,
+}
+
+
+def inspect_members(reader: ArchiveReader, work_dir: Path, vision_limit: int) -> ArchiveInspection:
+    """根据成员列表和按需读取的前缀字节检查压缩包内容，前 vision_limit 张图片写到工作目录供视觉分析"""
+    members = reader.members()
+    for member in members:
+        print(f"处理文件: {member.basename} ({member.size} 字节)")
+
+    # 每个成员只读取一小段前缀，用于识别类型、文本预览和读取图片尺寸
+    heads = safe_read_prefixes(reader, [m.name for m in members], TEXT_PREVIEW_CHARS * 4)
+    kinds = {m.name: classify_member(m, heads[m.name]) for m in members if m.name in heads}
+    image_members = [m for m in members if kinds.get(m.name) == "image"]
+
+    analysis = ArchiveAnalysis(reader, work_dir, len(image_members))
+    analysis.image_slots = {m.name: index for index, m in enumerate(image_members)}
+
+    # 图片文件 - 前几张完整写到工作目录，由调用方并发提交视觉模型
+    for index, member in enumerate(image_members[:vision_limit]):
+        analysis.vision_names.add(member.name)
+        try:
+            image_path = analysis.materialize(member)
+            analysis.vision_images.append((index, member.basename, str(image_path)))
+        except ArchiveLimitExceeded:
+            raise
+        except Exception as e:
+            print(f"读取图片 {member.name} 失败: {e}")
+            analysis.image_files_info[index] = f"🖼️ {member.basename} ({member.size} 字节) - 图片信息读取失败"
+
+    for member in members:
+        if reader.budget is not None:
+            reader.budget.check_time()
+        try:
+            if member.name not in heads:
+                raise ValueError("无法读取文件内容")
+            ARCHIVE_MEMBER_HANDLERS[kinds[member.name]](analysis, member, heads[member.name])
+        except ArchiveLimitExceeded:
+            raise
+        except Exception as e:
+            analysis.other_files_info.append(f"❌ {member.basename} - 处理失败: {str(e)}")
+
+    return ArchiveInspection(len(members), analysis.text_files_content, analysis.image_files_info,
+                             analysis.other_files_info, analysis.vision_images, analysis.executed)
+
+
+def inspect_archive(file_path: str, file_ext: str, work_dir: str, vision_limit: int) -> ArchiveInspection:
+    """检查压缩包（在进程池中执行），超出解压限制时抛出 ArchiveLimitExceeded"""
+    work_dir = Path(work_dir)
+    budget = ArchiveBudget(ARCHIVE_LIMITS)
+    with open_archive(file_path, file_ext, budget) as reader:
+        # 先按元数据检查，超限的压缩包不做任何解压
+        budget.check_members(reader.members())
+        if ARCHIVE_INSPECT_IN_MEMORY:
+            return inspect_members(reader, work_dir, vision_limit)
+
+        # 传统模式：整体解压到工作目录后按目录检查，解压时同样逐块计入预算
+        work_dir.mkdir(exist_ok=True)
+        reader.extract_all(work_dir)
+    print(f"压缩包解压到: {work_dir}")
+    return inspect_members(DirectoryReader(work_dir, budget), work_dir, vision_limit)
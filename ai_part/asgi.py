@@ -0,0 +1,281 @@
+"""ASGI入口：所有路由均为协程，大模型、视觉模型与HTTP调用都使用异步接口
+
+启动方式: uvicorn asgi:app --host 0.0.0.0 --port 3001
+"""
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from config.config import OPENAI_API_MODEL
+from config.config import WEBHOOK_ASYNC_MODE, JOB_WORKER_COUNT, JOB_QUEUE_MAX_SIZE, JOB_RESULT_TTL
+from jobs import AsyncJobQueue, JobQueueFull
+from sessions import SessionMismatch
+from idempotency import IdempotencyPending
+import http_client
+from app import (
+    llm,
+    aget_ai_response_with_context_and_tools,
+    aprocess_webhook_message,
+    arun_webhook_job,
+    astart_tool_predispatch,
+    build_pending_payload,
+    build_queued_payload,
+    build_resync_payload,
+    build_status_payload,
+    history_base_index,
+    is_failed_job,
+    is_authorized_webhook,
+    is_valid_delta,
+    parse_webhook_payload,
+    resolve_conversation_history,
+    webhook_idempotency_key,
+    idempotency,
+)
+
+# 协程任务队列（异步模式下webhook只负责校验和入队）
+async_job_queue = AsyncJobQueue(
+    worker_count=JOB_WORKER_COUNT,
+    max_queue_size=JOB_QUEUE_MAX_SIZE,
+    result_ttl=JOB_RESULT_TTL,
+)
+
+
+async def read_json(request: Request):
+    """读取JSON请求体，格式错误时返回None"""
+    try:
+        return await request.json()
+    except Exception:
+        return None
+
+
+async def webhook_handler(request: Request):
+    """处理来自server.js的webhook请求（异步版本）"""
+    try:
+        if not is_authorized_webhook(request.headers.get('Authorization', '')):
+            return JSONResponse({"error": "未授权的请求"}, status_code=401)
+
+        data = await read_json(request)
+        if not data:
+            return JSONResponse({"error": "无效的JSON数据"}, status_code=400)
+
+        payload = parse_webhook_payload(data)
+        user_message = payload["user_message"]
+        user_id = payload["user_id"]
+        message_type = payload["message_type"]
+        file_url = payload["file_url"]
+
+        if not user_message or not user_id:
+            return JSONResponse({"error": "缺少必要参数"}, status_code=400)
+        if payload["conversation_id"] and not is_valid_delta(payload):
+            return JSONResponse({"error": "无效的增量消息"}, status_code=400)
+
+        try:
+            conversation_history, ack_index = resolve_conversation_history(payload)
+            history_base = history_base_index(conversation_history, ack_index)
+        except SessionMismatch as e:
+            print(f"会话需要重新同步: {e}")
+            return JSONResponse(build_resync_payload(e), status_code=409)
+
+        idempotency_key = webhook_idempotency_key(data, request.headers.get('Idempotency-Key'))
+
+        if WEBHOOK_ASYNC_MODE:
+            async def enqueue():
+                tool_task = astart_tool_predispatch(message_type, file_url, user_id)
+                try:
+                    job_id = async_job_queue.submit(
+                        arun_webhook_job,
+                        user_id,
+                        user_message,
+                        conversation_history,
+                        message_type,
+                        file_url,
+                        tool_task=tool_task,
+                        history_base=history_base,
+                        meta={"userId": user_id},
+                    )
+                except JobQueueFull:
+                    if tool_task is not None:
+                        tool_task.cancel()
+                    raise
+                return {"jobId": job_id, "contextLength": len(conversation_history)}
+
+            try:
+                queued, duplicate = await idempotency.arun(
+                    idempotency_key, enqueue,
+                    discard=lambda queued: is_failed_job(async_job_queue.get(queued["jobId"])),
+                )
+            except JobQueueFull as e:
+                print(f"任务入队失败: {e}")
+                return JSONResponse({
+                    "success": False,
+                    "error": "服务繁忙，请稍后重试",
+                    "timestamp": datetime.now().isoformat()
+                }, status_code=503)
+
+            if duplicate:
+                print(f"重复的webhook请求，返回已有任务: {queued['jobId']}")
+                job = async_job_queue.get(queued["jobId"])
+                return JSONResponse(build_queued_payload(queued, ack_index, job, True), status_code=202)
+            print(f"消息已入队，任务ID: {queued['jobId']}")
+            return JSONResponse(build_queued_payload(queued, ack_index), status_code=202)
+
+        async def run_now():
+            return await aprocess_webhook_message(
+                user_id,
+                user_message,
+                conversation_history,
+                message_type,
+                file_url,
+                tool_task=astart_tool_predispatch(message_type, file_url, user_id),
+                history_base=history_base,
+            )
+
+        try:
+            result, duplicate = await idempotency.arun(idempotency_key, run_now, keep=lambda result: result["success"])
+        except IdempotencyPending as e:
+            print(f"重复的webhook请求: {e}")
+            return JSONResponse(build_pending_payload(), status_code=409)
+        if duplicate:
+            print("重复的webhook请求，返回已保存的回复")
+
+        if result["success"]:
+            return JSONResponse({
+                "success": True,
+                "message": "AI回复发送成功",
+                "reply": result["reply"],
+                "contextLength": result["contextLength"],
+                "toolsUsed": result["toolsUsed"],
+                "superseded": result.get("superseded", False),
+                "delivery": result.get("delivery"),
+                "duplicate": duplicate,
+                "ackIndex": ack_index,
+                "timestamp": datetime.now().isoformat()
+            })
+        return JSONResponse({
+            "success": False,
+            "message": "AI回复发送失败",
+            "reply": result["reply"],
+            "timestamp": datetime.now().isoformat()
+        }, status_code=500)
+
+    except Exception as e:
+        print(f"Webhook处理错误: {e}")
+        return JSONResponse({
+            "success": False,
+            "error": str(e),
+            "timestamp": datetime.now().isoformat()
+        }, status_code=500)
+
+
+async def job_status(request: Request):
+    """查询异步任务的处理状态"""
+    job = async_job_queue.get(request.path_params["job_id"])
+    if not job:
+        return JSONResponse({"error": "任务不存在或已过期"}, status_code=404)
+    return JSONResponse(job)
+
+
+async def status_check(request: Request):
+    """健康检查端点"""
+    return JSONResponse(build_status_payload(async_job_queue))
+
+
+async def test_ai(request: Request):
+    """测试AI模型连接"""
+    try:
+        test_response = await llm.ainvoke("你好，请简单介绍一下自己，控制在50字以内")
+        return JSONResponse({
+            "success": True,
+            "test_response": test_response.content,
+            "model": OPENAI_API_MODEL,
+            "timestamp": datetime.now().isoformat()
+        })
+    except Exception as e:
+        return JSONResponse({
+            "success": False,
+            "error": str(e),
+            "timestamp": datetime.now().isoformat()
+        }, status_code=500)
+
+
+async def test_context(request: Request):
+    """测试上下文功能"""
+    try:
+        data = await read_json(request) or {}
+        user_message = data.get('message', '你好')
+        conversation_history = data.get('conversationHistory', [])
+
+        ai_reply = await aget_ai_response_with_context_and_tools(user_message, conversation_history)
+
+        return JSONResponse({
+            "success": True,
+            "reply": ai_reply,
+            "contextLength": len(conversation_history),
+            "timestamp": datetime.now().isoformat()
+        })
+    except Exception as e:
+        return JSONResponse({
+            "success": False,
+            "error": str(e),
+            "timestamp": datetime.now().isoformat()
+        }, status_code=500)
+
+
+async def test_tools(request: Request):
+    """测试工具调用功能"""
+    try:
+        data = await read_json(request) or {}
+        message = data.get('message', '请帮我分析一下')
+        file_url = data.get('fileUrl', '')
+        message_type = data.get('type', 'text')
+
+        if not file_url:
+            return JSONResponse({
+                "success": False,
+                "error": "需要提供file_url参数"
+            }, status_code=400)
+
+        ai_reply = await aget_ai_response_with_context_and_tools(
+            message, [], message_type, file_url
+        )
+
+        return JSONResponse({
+            "success": True,
+            "reply": ai_reply,
+            "fileUrl": file_url,
+            "messageType": message_type,
+            "timestamp": datetime.now().isoformat()
+        })
+    except Exception as e:
+        return JSONResponse({
+            "success": False,
+            "error": str(e),
+            "timestamp": datetime.now().isoformat()
+        }, status_code=500)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await http_client.aclose_async_client()
+
+
+app = Starlette(routes=[
+    Route('/ai-webhook', webhook_handler, methods=['POST']),
+    Route('/ai-webhook/jobs/{job_id}', job_status, methods=['GET']),
+    Route('/status', status_check, methods=['GET']),
+    Route('/test', test_ai, methods=['GET']),
+    Route('/test-context', test_context, methods=['POST']),
+    Route('/test-tools', test_tools, methods=['POST']),
+], lifespan=lifespan)
+
+
+if __name__ == '__main__':
+    print("🤖 AI智能客服Webhook服务（ASGI）启动中...")
+    print(f"🎯 使用模型: {OPENAI_API_MODEL}")
+    uvicorn.run(app, host='0.0.0.0', port=3001)
@@ -0,0 +1,144 @@
+"""通用缓存组件：带TTL与LRU淘汰的内存缓存，可选SQLite持久化"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+
+def file_sha256(file_path, chunk_size: int = 1024 * 1024) -> str:
+    """分块计算文件内容的sha256"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_key(*parts: Any) -> str:
+    """将多个字段组合为定长缓存键"""
+    return hashlib.sha256("\x00".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+
+class TTLCache:
+    """线程安全的 TTL + LRU 缓存
+
+    max_entries 限制条目数，max_bytes（配合 sizeof）限制值的总大小；
+    指定 persist_path 时条目同步写入SQLite，重启后自动加载未过期的条目。
+    值需要可以JSON序列化。
+    """
+
+    def __init__(self, name: str, max_entries: int = 1000, ttl: float = 3600,
+                 max_bytes: Optional[int] = None, sizeof: Optional[Callable[[Any], int]] = None,
+                 persist_path: Optional[str] = None):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda value: len(json.dumps(value, ensure_ascii=False)))
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (value, expires_at, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+        self._db = None
+        if persist_path:
+            self._open_db(persist_path)
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self._stats["misses"] += 1
+                return None
+            value, expires_at, _ = item
+            if expires_at < time.time():
+                self._remove(key)
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._data.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        size = self.sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, expires_at, size)
+            self._bytes += size
+            self._persist(key, value, expires_at)
+            self._evict()
+
+    def delete(self, key: str):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._data):
+                self._remove(key)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+            stats["entries"] = len(self._data)
+            stats["bytes"] = self._bytes
+        lookups = stats["hits"] + stats["misses"]
+        stats["hitRate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["persistent"] = self._db is not None
+        return stats
+
+    def _remove(self, key: str):
+        """删除条目（调用方持有锁）"""
+        _, _, size = self._data.pop(key)
+        self._bytes -= size
+        if self._db is not None:
+            self._db.execute("DELETE FROM cache WHERE key = ?", (key,))
+            self._db.commit()
+
+    def _evict(self):
+        """超出条目数或字节预算时按LRU淘汰（调用方持有锁）"""
+        while self._data and (len(self._data) > self.max_entries
+                              or (self.max_bytes is not None and self._bytes > self.max_bytes)):
+            key = next(iter(self._data))
+            self._remove(key)
+            self._stats["evictions"] += 1
+
+    def _persist(self, key: str, value: Any, expires_at: float):
+        if self._db is None:
+            return
+        self._db.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), expires_at),
+        )
+        self._db.commit()
+
+    def _open_db(self, persist_path: str):
+        try:
+            self._db = sqlite3.connect(persist_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)"
+            )
+            self._db.execute("DELETE FROM cache WHERE expires_at < ?", (time.time(),))
+            self._db.commit()
+            rows = self._db.execute(
+                "SELECT key, value, expires_at FROM cache ORDER BY rowid"
+            ).fetchall()
+        except sqlite3.Error as e:
+            print(f"缓存 {self.name} 持久化文件打开失败，仅使用内存缓存: {e}")
+            self._db = None
+            return
+        for key, raw, expires_at in rows:
+            value = json.loads(raw)
+            size = self.sizeof(value)
+            self._data[key] = (value, expires_at, size)
+            self._bytes += size
+        self._evict()
+        print(f"缓存 {self.name} 已从 {persist_path} 加载 {len(self._data)} 条记录")
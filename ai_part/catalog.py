@@ -0,0 +1,55 @@
+"""商品目录：系统提示词中的商品信息和快速回复引擎共用的结构化数据
+
+商品ID与 part1/server.js 的 products 保持一致。
+"""
+import json
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from caching import make_key
+
+
+class Product(NamedTuple):
+    id: int
+    name: str
+    price: int
+    description: str  # 写入系统提示词的简介
+    aliases: Tuple[str, ...] = ()  # 归一化（小写、去空白）后的其他叫法
+    specs: Dict[str, str] = {}  # 规格项 -> 取值，如 {"芯片": "A17 Pro"}
+
+
+PRODUCTS: List[Product] = [
+    Product(1, "iPhone 15 Pro", 7999, "搭载A17 Pro芯片，最新款iPhone",
+            aliases=("iphone15pro", "苹果15pro"), specs={"芯片": "A17 Pro"}),
+    Product(2, "MacBook Air M2", 8999, "轻薄便携的笔记本电脑",
+            aliases=("macbookairm2", "macbookair", "mba m2"), specs={"芯片": "M2"}),
+    Product(3, "AirPods Pro", 1999, "主动降噪无线耳机",
+            aliases=("airpodspro",)),
+    Product(4, "iPad Air", 4399, "轻薄强大的平板电脑",
+            aliases=("ipadair",)),
+]
+
+
+def product_keys(product: Product) -> Tuple[str, ...]:
+    """商品名和别名的匹配键（小写、去空白）"""
+    keys = {product.name.lower().replace(" ", "")}
+    keys.update(alias.replace(" ", "") for alias in product.aliases)
+    return tuple(sorted(keys, key=len, reverse=True))
+
+
+def find_product(product_id: int) -> Optional[Product]:
+    return next((product for product in PRODUCTS if product.id == product_id), None)
+
+
+def render_product_names() -> str:
+    """系统提示词“专业领域”中的商品列表"""
+    return "、".join(product.name for product in PRODUCTS)
+
+
+def render_product_lines(indent: str = "   ") -> str:
+    """系统提示词“商品信息”中每个商品一行"""
+    return "\n".join(f"{indent}- {product.name}: ¥{product.price}，{product.description}" for product in PRODUCTS)
+
+
+def catalog_fingerprint() -> str:
+    """商品目录的指纹，目录变化时依赖它的缓存随之失效"""
+    return make_key(json.dumps([product._asdict() for product in PRODUCTS], ensure_ascii=False, sort_keys=True))
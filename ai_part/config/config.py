@@ -6,3 +6,121 @@ OPENAI_API_MODEL = "deepseek-chat"
 VISION_API_KEY = ""
 VISION_API_BASE = "https://ark.cn-beijing.volces.com/api/v3"
 VISION_API_MODEL = "doubao-seed-1-6-250615"
+VISION_REQUEST_TIMEOUT = 30  # 单次视觉模型请求超时（秒），避免超时放弃的调用长时间占用线程
+
+# 异步任务队列配置（开启后 webhook 入队后立即返回 202 和任务ID，由后台线程执行）
+# 默认关闭：/ai-webhook 保持同步返回 200 和回复内容的原有约定
+WEBHOOK_ASYNC_MODE = False
+JOB_WORKER_COUNT = 4
+JOB_QUEUE_MAX_SIZE = 100
+JOB_RESULT_TTL = 3600  # 已完成任务保留时间（秒）
+
+# part1 HTTP 客户端配置（回复接口与文件下载共用连接池）
+HTTP_POOL_CONNECTIONS = 10  # 缓存的主机连接池数量
+HTTP_POOL_MAXSIZE = 20  # 每个主机保持的最大连接数
+HTTP_CONNECT_TIMEOUT = 3  # 连接超时（秒）
+HTTP_READ_TIMEOUT = 10  # 读取超时（秒）
+HTTP_MAX_RETRIES = 2  # 连接错误或临时性5xx的最大重试次数
+HTTP_RETRY_BACKOFF = 0.5  # 退避基准时间（秒）
+HTTP_RETRY_BACKOFF_MAX = 4  # 单次退避上限（秒）
+HTTP_RETRY_STATUSES = {502, 503, 504}
+
+# 下载缓存配置（按URL缓存，文件内容按sha256寻址）
+DOWNLOAD_CACHE_MAX_BYTES = 200 * 1024 * 1024  # 缓存总字节预算，超出后按LRU淘汰
+DOWNLOAD_CACHE_FRESH_SECONDS = 600  # 新鲜期内直接使用缓存，不发起网络请求
+DOWNLOAD_CACHE_ORPHAN_GRACE = 3600  # 启动时只清理超过该时间（秒）未使用的索引外文件（其他进程可能仍在使用）
+
+# 文件下载配置
+MAX_DOWNLOAD_BYTES = 10 * 1024 * 1024  # 单个文件大小上限（与part1上传限制一致）
+DOWNLOAD_CHUNK_SIZE = 64 * 1024  # 流式下载分块大小
+
+# 视觉模型图片预处理配置
+VISION_IMAGE_MAX_EDGE = 1280  # 缩放后最长边像素
+VISION_IMAGE_FORMAT = "JPEG"  # 重新编码格式（JPEG/WEBP）
+VISION_IMAGE_QUALITY = 85
+VISION_IMAGE_PASSTHROUGH_BYTES = 256 * 1024  # 未超过最长边且小于该大小的图片原样发送
+
+# 视觉分析结果缓存配置
+VISION_CACHE_MAX_ENTRIES = 5000
+VISION_CACHE_TTL = 7 * 24 * 3600  # 缓存有效期（秒）
+VISION_CACHE_PERSIST_PATH = None  # 设置为SQLite文件路径可在重启后保留缓存
+
+# 近似重复图片识别配置（64位dHash + 多索引哈希）
+PHASH_ENABLED = True
+PHASH_MAX_DISTANCE = 3  # 汉明距离不超过该值视为同一张图片
+PHASH_MIN_BITS = 8  # 哈希中0或1的位数少于该值（纯色、大面积留白的图片）时不做近似匹配
+PHASH_MAX_ASPECT_DIFF = 0.01  # 宽高比的相对差异超过该值时不视为同一张图片
+PHASH_INDEX_MAX_ENTRIES = 100000  # 索引容量上限，超出后按LRU淘汰
+
+# 压缩包内图片的并发视觉分析配置
+ARCHIVE_VISION_MAX_IMAGES = 3  # 每个压缩包最多调用视觉模型分析的图片数
+ARCHIVE_VISION_CONCURRENCY = 3  # 同时进行的视觉模型调用数
+ARCHIVE_VISION_TIMEOUT = 30  # 单次视觉模型调用超时（秒）
+
+# 压缩包检查方式：True 时直接读取压缩包目录和成员前缀，不整体解压到磁盘
+ARCHIVE_INSPECT_IN_MEMORY = True
+
+# 压缩包分析报告缓存配置
+ARCHIVE_CACHE_MAX_ENTRIES = 2000
+ARCHIVE_CACHE_MAX_BYTES = 20 * 1024 * 1024  # 报告总大小上限
+ARCHIVE_CACHE_TTL = 24 * 3600  # 缓存有效期（秒）
+ARCHIVE_CACHE_PERSIST_PATH = None  # 设置为SQLite文件路径可在重启后保留缓存
+
+# 压缩包解压资源限制（先按元数据检查，解压时按实际字节数和耗时再次检查）
+ARCHIVE_MAX_TOTAL_BYTES = 200 * 1024 * 1024  # 解压后总大小上限
+ARCHIVE_MAX_MEMBERS = 1000  # 文件数量上限
+ARCHIVE_MAX_MEMBER_BYTES = 50 * 1024 * 1024  # 单个文件解压后大小上限
+ARCHIVE_MAX_RATIO = 100  # 单个文件压缩比上限
+ARCHIVE_ANALYSIS_TIMEOUT = 60  # 单个压缩包处理时间上限（秒）
+ARCHIVE_EXEC_TIMEOUT = 10  # 压缩包中可执行文件的运行时间上限（秒）
+
+# CPU密集型任务进程池配置（解压、图片解码缩放、base64编码）
+OFFLOAD_PROCESSES = 2  # 工作进程数，设置为0时在Web进程中直接执行
+OFFLOAD_TASK_TIMEOUT = 30  # 单个任务等待结果的超时（秒）
+
+# 工具调用临时工作目录配置
+WORKSPACE_ROOT = None  # 工作目录根路径，可设置为tmpfs路径（如 "/dev/shm/ai_customer_service"），默认使用系统临时目录
+WORKSPACE_MAX_AGE = 600  # 超过该时间（秒）的遗留目录由后台线程删除
+WORKSPACE_QUOTA_BYTES = 500 * 1024 * 1024  # 所有工作目录的总占用上限，超出时拒绝新的压缩包分析
+WORKSPACE_JANITOR_INTERVAL = 60  # 后台清理间隔（秒）
+
+# 对话历史压缩配置（token为估算值）
+HISTORY_TOKEN_BUDGET = 1500  # 最近对话保留原文的token预算
+HISTORY_SUMMARY_TRIGGER = 2500  # 未折叠的对话超过该值时，把较早的部分合并进摘要
+HISTORY_SUMMARY_MAX_USERS = 10000  # 缓存摘要的用户数上限
+HISTORY_SUMMARY_TTL = 24 * 3600  # 摘要缓存有效期（秒）
+
+# 增量协议会话存储配置
+SESSION_MAX_SESSIONS = 1000  # 内存中保留的会话数，超出时按LRU移出
+SESSION_IDLE_TTL = 1800  # 空闲超过该时间（秒）的会话移出内存
+SESSION_MAX_MESSAGES = 200  # 每个会话保留的消息数上限
+SESSION_PERSIST_PATH = None  # 设置为SQLite文件路径后，移出内存的会话写入该文件
+
+# 常见问题回复缓存配置
+FAQ_CACHE_ENABLED = True
+FAQ_CACHE_THRESHOLD = 0.8  # 问题词元的Jaccard相似度达到该值视为同一问题
+FAQ_CACHE_TTL = 3600  # 缓存回复的有效期（秒）
+FAQ_CACHE_MAX_ENTRIES = 2000
+FAQ_CACHE_MAX_MESSAGE_CHARS = 60  # 只缓存不超过该长度的问题
+FAQ_CACHE_MAX_HISTORY = 1  # 历史消息数（含当前消息）不超过该值时才使用缓存；有此前对话时回复可能依赖上下文（如“是的”）
+
+# 商品问题快速回复配置（意图明确的价格、规格问题按商品目录直接回复）
+FAST_PATH_ENABLED = True
+
+# 工具预执行配置（图片、压缩包消息到达时直接执行对应工具，大模型只调用一次）
+TOOL_PREDISPATCH_ENABLED = True
+TOOL_PREDISPATCH_WORKERS = 4
+
+# 并行工具调用配置（大模型一步返回多个工具调用时同时执行）
+PARALLEL_TOOL_CALLS_ENABLED = True
+TOOL_CALL_MAX_CONCURRENCY = 3  # 每轮同时执行的工具调用数上限
+TOOL_CALL_TIMEOUT = 90  # 单个工具调用的超时时间（秒）
+
+# 流式回复配置（大模型边生成边按句推送到server.js）
+REPLY_STREAMING_ENABLED = True
+REPLY_SEGMENT_MAX_CHARS = 150  # 单段回复的最大长度
+
+# webhook幂等配置（server.js重试时返回已保存的结果）
+IDEMPOTENCY_TTL = 600  # 已完成结果的保留时间（秒）
+IDEMPOTENCY_MAX_ENTRIES = 10000
+IDEMPOTENCY_WAIT_TIMEOUT = 60  # 重复请求等待原请求结果的最长时间（秒）
@@ -0,0 +1,256 @@
+"""下载缓存：按URL索引、按内容sha256寻址的磁盘缓存，支持ETag/Last-Modified重新验证与LRU淘汰"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Set
+
+from filetypes import SNIFF_BYTES, sniff_extension
+
+
+class DownloadTooLarge(Exception):
+    """下载内容超过大小上限"""
+
+
+class CacheWriter:
+    """流式写入一个缓存文件：边写边计算sha256并检查大小上限"""
+
+    def __init__(self, cache: "DownloadCache", url: str, max_bytes: int):
+        self.cache = cache
+        self.url = url
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.head = b""
+        self._hash = hashlib.sha256()
+        self._tmp_path = cache.cache_dir / f".download.{os.getpid()}.{threading.get_ident()}.{id(self)}.tmp"
+        self._file = open(self._tmp_path, "wb")
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise DownloadTooLarge(f"文件超过大小上限 {self.max_bytes} 字节")
+        if len(self.head) < SNIFF_BYTES:
+            self.head += chunk[:SNIFF_BYTES - len(self.head)]
+        self._hash.update(chunk)
+        self._file.write(chunk)
+
+    def commit(self, headers) -> str:
+        """写入完成，移入缓存并返回缓存文件路径（已加引用，用完后调用 DownloadCache.release）"""
+        self._file.close()
+        digest = self._hash.hexdigest()
+        # 优先使用文件头识别出的扩展名，避免依赖URL中的后缀
+        suffix = sniff_extension(self.head) or Path(self.url.split("?", 1)[0]).suffix.lower()[:10]
+        return self.cache._add_entry(self.url, self._tmp_path, {
+            "digest": digest,
+            "file": f"{digest}{suffix}",
+            "size": self.size,
+            "etag": headers.get("ETag"),
+            "lastModified": headers.get("Last-Modified"),
+            "fetchedAt": time.time(),
+        })
+
+    def abort(self):
+        """放弃写入并删除临时文件"""
+        self._file.close()
+        try:
+            self._tmp_path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class DownloadCache:
+    """URL -> 本地文件 的磁盘缓存
+
+    同一内容只保存一份（文件名为内容sha256），索引记录URL对应的内容摘要与验证头。
+    新鲜期内直接返回本地路径，过期后由调用方带上 If-None-Match/If-Modified-Since 重新验证。
+    返回给调用方的文件会加引用，调用方用完后必须调用 release；有引用的文件被淘汰时延迟到释放后再删除。
+    """
+
+    INDEX_FILE = "index.json"
+
+    def __init__(self, cache_dir: Path, max_bytes: int, fresh_seconds: int, orphan_grace: int = 3600):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.fresh_seconds = fresh_seconds
+        self.orphan_grace = orphan_grace
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._pins: Dict[str, int] = {}  # 文件名 -> 使用中的引用数
+        self._doomed: Set[str] = set()  # 已淘汰、等待引用释放后删除的文件
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "revalidated": 0, "misses": 0, "evictions": 0}
+        self._load_index()
+
+    def lookup(self, url: str) -> Optional[Dict[str, Any]]:
+        """返回URL对应的缓存条目（文件已丢失时视为未命中）"""
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                return None
+            if not self._blob_path(entry).exists():
+                self._entries.pop(url, None)
+                return None
+            return dict(entry)
+
+    def get_fresh(self, url: str) -> Optional[str]:
+        """新鲜期内的缓存直接返回本地路径（已加引用），不发起网络请求"""
+        return self._checkout(url, hit_key="hits", max_age=self.fresh_seconds)
+
+    def validation_headers(self, url: str) -> Dict[str, str]:
+        """构建条件请求头"""
+        entry = self.lookup(url)
+        headers = {}
+        if entry:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("lastModified"):
+                headers["If-Modified-Since"] = entry["lastModified"]
+        return headers
+
+    def revalidated(self, url: str) -> Optional[str]:
+        """服务端返回304时刷新新鲜期并返回本地路径（已加引用）"""
+        return self._checkout(url, hit_key="revalidated", refresh=True)
+
+    def release(self, path: Optional[str]):
+        """释放 get_fresh / revalidated / CacheWriter.commit 返回的文件引用"""
+        if not path:
+            return
+        file_name = Path(path).name
+        with self._lock:
+            count = self._pins.get(file_name, 0) - 1
+            if count > 0:
+                self._pins[file_name] = count
+                return
+            self._pins.pop(file_name, None)
+            if file_name in self._doomed:
+                self._doomed.discard(file_name)
+                self._release_blob(file_name)
+
+    def open_writer(self, url: str, max_bytes: int) -> CacheWriter:
+        """开始流式写入URL对应的内容"""
+        return CacheWriter(self, url, max_bytes)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._total_bytes()
+            stats["pinned"] = len(self._pins)
+        stats["maxBytes"] = self.max_bytes
+        return stats
+
+    def _blob_path(self, entry: Dict[str, Any]) -> Path:
+        return self.cache_dir / entry["file"]
+
+    def _checkout(self, url: str, hit_key: str, refresh: bool = False, max_age: Optional[float] = None) -> Optional[str]:
+        """在锁内确认文件存在并加引用，避免返回路径后文件被其他线程淘汰删除"""
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                return None
+            blob_path = self._blob_path(entry)
+            if not blob_path.exists():
+                self._entries.pop(url, None)
+                return None
+            if max_age is not None and time.time() - entry["fetchedAt"] > max_age:
+                return None
+            self._entries.move_to_end(url)
+            if refresh:
+                entry["fetchedAt"] = time.time()
+            self._stats[hit_key] += 1
+            self._pin(entry["file"])
+        self._mark_used(blob_path)
+        if refresh:
+            self._save_index()
+        return str(blob_path)
+
+    def _add_entry(self, url: str, tmp_path: Path, entry: Dict[str, Any]) -> str:
+        blob_path = self.cache_dir / entry["file"]
+        with self._lock:
+            if blob_path.exists():
+                tmp_path.unlink()
+            else:
+                os.replace(tmp_path, blob_path)
+            old = self._entries.pop(url, None)
+            self._entries[url] = entry
+            self._stats["misses"] += 1
+            self._pin(entry["file"])
+            if old and old["file"] != entry["file"]:
+                self._release_blob(old["file"])
+            self._evict()
+        self._mark_used(blob_path)
+        self._save_index()
+        return str(blob_path)
+
+    def _pin(self, file_name: str):
+        """加引用（调用方持有锁）"""
+        self._pins[file_name] = self._pins.get(file_name, 0) + 1
+        self._doomed.discard(file_name)
+
+    @staticmethod
+    def _mark_used(blob_path: Path):
+        """更新文件修改时间，启动清理时据此判断文件是否仍在被使用"""
+        try:
+            os.utime(blob_path)
+        except OSError:
+            pass
+
+    def _total_bytes(self) -> int:
+        # 相同内容的多个URL共享一个文件，只计一次
+        return sum({entry["file"]: entry["size"] for entry in self._entries.values()}.values())
+
+    def _evict(self):
+        """超出字节预算时按LRU淘汰（调用方持有锁）"""
+        while len(self._entries) > 1 and self._total_bytes() > self.max_bytes:
+            _, entry = self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+            self._release_blob(entry["file"])
+
+    def _release_blob(self, file_name: str):
+        """没有任何URL引用时删除内容文件，仍在使用中的文件等引用释放后再删除（调用方持有锁）"""
+        if any(entry["file"] == file_name for entry in self._entries.values()):
+            return
+        if self._pins.get(file_name):
+            self._doomed.add(file_name)
+            return
+        try:
+            (self.cache_dir / file_name).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _load_index(self):
+        index_path = self.cache_dir / self.INDEX_FILE
+        try:
+            with open(index_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (FileNotFoundError, ValueError):
+            entries = []
+        for url, entry in entries:
+            if (self.cache_dir / entry["file"]).exists():
+                self._entries[url] = entry
+        # 清理索引之外的残留文件；共享缓存目录的其他进程可能刚写入或正在使用，只清理超过宽限期未使用的文件
+        referenced = {entry["file"] for entry in self._entries.values()}
+        deadline = time.time() - self.orphan_grace
+        for path in self.cache_dir.iterdir():
+            if path.name.startswith(".") or path.name == self.INDEX_FILE or path.name in referenced:
+                continue
+            try:
+                if path.stat().st_mtime < deadline:
+                    path.unlink()
+            except OSError:
+                pass
+
+    def _save_index(self):
+        with self._lock:
+            entries = [[url, entry] for url, entry in self._entries.items()]
+        index_path = self.cache_dir / self.INDEX_FILE
+        tmp_path = index_path.with_name(f".{self.INDEX_FILE}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, index_path)
+        except OSError as e:
+            print(f"保存下载缓存索引失败: {e}")
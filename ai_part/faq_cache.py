@@ -0,0 +1,160 @@
+"""常见问题回复缓存：重复的纯文本咨询直接返回缓存的回复，不再调用大模型
+
+问题先归一化（NFKC全半角折叠、转小写、去掉标点和空白），再切分为词元：
+英文单词和数字各为一个词元，连续的中文按相邻两字切分（bigram）。
+查询时先按归一化文本精确匹配，再通过词元倒排表找出候选，按Jaccard相似度取最相近的一条，
+相似度达到阈值且英文单词和数字词元完全一致（避免 iPhone 15 Pro 命中 iPhone 15 Pro Max
+或 iPhone 14 的回复，型号差异只体现在这些词元上）时视为命中，相似度只用于容忍中文表述的差异。
+缓存按版本号整体失效：提示词或商品目录变化后版本号改变，旧回复全部丢弃。
+"""
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, Optional, Set, Tuple
+
+# 英文单词/数字，或连续的中文字符（兼容区汉字经NFKC后已映射到统一区）
+TOKEN_PATTERN = re.compile("[a-z]+|[0-9]+(?:\\.[0-9]+)?|[\u3400-\u9fff]+")
+
+
+def normalize_text(text: str) -> str:
+    """全半角折叠、转小写，标点、符号和空白统一为单个空格"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    chars = [" " if unicodedata.category(ch)[0] in "PSZC" else ch for ch in text]
+    return " ".join("".join(chars).split())
+
+
+def tokenize(normalized: str) -> FrozenSet[str]:
+    """把归一化后的文本切分为词元集合（中文按bigram切分）"""
+    tokens: Set[str] = set()
+    for match in TOKEN_PATTERN.findall(normalized):
+        if not "\u3400" <= match[0] <= "\u9fff":
+            tokens.add(match)
+        elif len(match) == 1:
+            tokens.add(match)
+        else:
+            tokens.update(match[i:i + 2] for i in range(len(match) - 1))
+    return frozenset(tokens)
+
+
+def _exact_tokens(tokens: FrozenSet[str]) -> FrozenSet[str]:
+    """必须完全一致的词元：英文单词和数字（中文bigram以外的词元）"""
+    return frozenset(token for token in tokens if not "\u3400" <= token[0] <= "\u9fff")
+
+
+class FAQCache:
+    """按问题相似度查找的回复缓存：归一化文本 -> (词元, 回复, 过期时间)，超出容量时按LRU淘汰"""
+
+    def __init__(self, threshold: float = 0.8, ttl: float = 3600, max_entries: int = 2000,
+                 max_message_chars: int = 60):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_message_chars = max_message_chars
+        self.version = ""
+        self._entries: "OrderedDict[str, Tuple[FrozenSet[str], str, float]]" = OrderedDict()
+        self._index: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+        self._stats = {"lookups": 0, "exactHits": 0, "similarHits": 0, "stores": 0,
+                       "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def set_version(self, version: str):
+        """设置缓存版本（提示词和商品目录的指纹），版本变化时清空缓存"""
+        with self._lock:
+            if version == self.version:
+                return
+            if self._entries:
+                self._stats["invalidations"] += 1
+            self.version = version
+            self._entries.clear()
+            self._index.clear()
+
+    def cacheable(self, message: str) -> bool:
+        return bool(message) and len(message) <= self.max_message_chars
+
+    def lookup(self, message: str) -> Optional[Tuple[str, str, float]]:
+        """返回 (回复, 命中方式 exact/similar, 相似度)，未命中返回None"""
+        if not self.cacheable(message):
+            return None
+        normalized = normalize_text(message)
+        tokens = tokenize(normalized)
+        if not tokens:
+            return None
+        with self._lock:
+            self._stats["lookups"] += 1
+            now = time.time()
+            entry = self._entries.get(normalized)
+            if entry is not None and entry[2] >= now:
+                self._entries.move_to_end(normalized)
+                self._stats["exactHits"] += 1
+                return entry[1], "exact", 1.0
+
+            # 倒排表统计每个候选与当前问题共有的词元数
+            overlaps: Dict[str, int] = {}
+            for token in tokens:
+                for key in self._index.get(token, ()):
+                    overlaps[key] = overlaps.get(key, 0) + 1
+
+            best_key, best_score = None, 0.0
+            exact = _exact_tokens(tokens)
+            for key, overlap in overlaps.items():
+                candidate_tokens, _, expires_at = self._entries[key]
+                if expires_at < now:
+                    continue
+                score = overlap / (len(tokens) + len(candidate_tokens) - overlap)
+                if score > best_score and _exact_tokens(candidate_tokens) == exact:
+                    best_key, best_score = key, score
+            if best_key is None or best_score < self.threshold:
+                return None
+            self._entries.move_to_end(best_key)
+            self._stats["similarHits"] += 1
+            return self._entries[best_key][1], "similar", round(best_score, 4)
+
+    def store(self, message: str, reply: str):
+        if not self.cacheable(message) or not reply:
+            return
+        normalized = normalize_text(message)
+        tokens = tokenize(normalized)
+        if not tokens:
+            return
+        with self._lock:
+            if normalized in self._entries:
+                self._remove(normalized)
+            self._entries[normalized] = (tokens, reply, time.time() + self.ttl)
+            for token in tokens:
+                self._index.setdefault(token, set()).add(normalized)
+            self._stats["stores"] += 1
+            self._evict()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        hits = stats["exactHits"] + stats["similarHits"]
+        stats["hitRate"] = round(hits / stats["lookups"], 4) if stats["lookups"] else 0.0
+        stats["threshold"] = self.threshold
+        stats["version"] = self.version[:12]
+        return stats
+
+    def _remove(self, key: str):
+        """删除条目及其倒排记录（调用方持有锁）"""
+        tokens, _, _ = self._entries.pop(key)
+        for token in tokens:
+            bucket = self._index.get(token)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._index[token]
+
+    def _evict(self):
+        """先清理过期条目，仍超出容量时按LRU淘汰（调用方持有锁）"""
+        if len(self._entries) <= self.max_entries:
+            return
+        now = time.time()
+        for key in [key for key, entry in self._entries.items() if entry[2] < now]:
+            self._remove(key)
+            self._stats["expirations"] += 1
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self._stats["evictions"] += 1
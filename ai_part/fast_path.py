@@ -0,0 +1,111 @@
+"""商品价格、规格类问题的快速回复：意图明确时按商品目录套用模板回复，不调用大模型
+
+匹配规则刻意从严：问题中只能出现一个商品，只能有一种意图，
+去掉商品名、意图关键词和常见语气词后不能剩下其他内容。
+提到多个商品、带型号后缀（如 Pro Max、256G）或附带其他诉求（如砍价）的问题都交给大模型处理。
+"""
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from catalog import Product, product_keys
+from faq_cache import normalize_text
+
+PRICE_KEYWORDS = ("多少钱", "什么价", "几块钱", "价格", "价钱", "售价", "多钱")
+# 规格项 -> 提问方式
+SPEC_KEYWORDS = {"芯片": ("什么芯片", "芯片", "处理器")}
+# 不影响意图判断的客套话和语气词（按长度从长到短去除）
+FILLER_WORDS = sorted((
+    "请问", "你好", "您好", "想问一下", "想问下", "问一下", "问下", "一下", "现在", "目前", "这款", "一台", "一个",
+    "多少", "的", "是", "卖", "要", "用", "呀", "啊", "呢", "吗", "嘛", "哈", "啦", "了",
+), key=len, reverse=True)
+
+PRICE_TEMPLATE = "亲，{name}目前售价¥{price}哦～{description}，喜欢的话可以直接下单呢😊"
+SPEC_TEMPLATE = "亲，{name}用的是{value}{field}哦～还有其他想了解的随时问我😊"
+
+
+class Intent(NamedTuple):
+    kind: str  # price / spec
+    product: Product
+    field: Optional[str] = None  # 规格项，仅 spec 意图使用
+
+
+class FastPathEngine:
+    """意图匹配 + 模板回复，统计匹配率和快速回复耗时"""
+
+    def __init__(self, products: List[Product]):
+        self.products = list(products)
+        self._keys = [(key, product) for product in self.products for key in product_keys(product)]
+        self._keys.sort(key=lambda item: len(item[0]), reverse=True)
+        self._lock = threading.Lock()
+        self._stats = {"lookups": 0, "matched": 0, "price": 0, "spec": 0}
+        self._latency = {"totalMs": 0.0, "maxMs": 0.0}
+
+    def match(self, message: str) -> Optional[Intent]:
+        """识别问题意图，不够明确时返回None"""
+        text = normalize_text(message).replace(" ", "")
+        product = None
+        for key, candidate in self._keys:
+            if key in text:
+                if product is not None and candidate is not product:
+                    return None
+                product = candidate
+                text = text.replace(key, "")
+        if product is None:
+            return None
+
+        intents: List[Tuple[Intent, str]] = []
+        for keyword in PRICE_KEYWORDS:
+            if keyword in text:
+                intents.append((Intent("price", product), keyword))
+                break
+        for field, keywords in SPEC_KEYWORDS.items():
+            for keyword in keywords:
+                if keyword in text:
+                    intents.append((Intent("spec", product, field), keyword))
+                    break
+        if len(intents) != 1:
+            return None
+        intent, keyword = intents[0]
+        if intent.kind == "spec" and intent.field not in product.specs:
+            return None
+
+        rest = text.replace(keyword, "")
+        for word in FILLER_WORDS:
+            rest = rest.replace(word, "")
+        return intent if not rest else None
+
+    def answer(self, message: str) -> Optional[Tuple[str, str]]:
+        """返回 (回复, 意图)，没有明确意图时返回None"""
+        start = time.perf_counter()
+        intent = self.match(message)
+        reply = None
+        if intent is not None:
+            product = intent.product
+            if intent.kind == "price":
+                reply = PRICE_TEMPLATE.format(name=product.name, price=product.price, description=product.description)
+            else:
+                reply = SPEC_TEMPLATE.format(name=product.name, value=product.specs[intent.field], field=intent.field)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        with self._lock:
+            self._stats["lookups"] += 1
+            if reply is not None:
+                self._stats["matched"] += 1
+                self._stats[intent.kind] += 1
+                self._latency["totalMs"] += elapsed_ms
+                self._latency["maxMs"] = max(self._latency["maxMs"], elapsed_ms)
+        if reply is None:
+            return None
+        return reply, intent.kind
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+            latency = dict(self._latency)
+        stats["matchRate"] = round(stats["matched"] / stats["lookups"], 4) if stats["lookups"] else 0.0
+        stats["latency"] = {
+            "avgMs": round(latency["totalMs"] / stats["matched"], 4) if stats["matched"] else 0.0,
+            "maxMs": round(latency["maxMs"], 4),
+        }
+        return stats
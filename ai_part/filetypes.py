@@ -0,0 +1,123 @@
+"""根据文件头部字节识别文件类型（不依赖扩展名）"""
+import codecs
+from typing import Optional
+
+try:
+    import magic
+except ImportError:  # libmagic 不可用时退回内置的魔数表
+    magic = None
+
+# 识别类型所需读取的头部字节数
+SNIFF_BYTES = 32
+
+# 支持的图片格式
+SUPPORTED_IMAGE_FORMATS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tiff'}
+
+# 支持的压缩包格式
+SUPPORTED_ARCHIVE_FORMATS = {'.zip', '.rar', '.7z'}
+
+# BMP 的 DIB 头大小（BITMAPCOREHEADER / INFOHEADER / V2 / V3 / V4 / V5）
+BMP_DIB_HEADER_SIZES = {12, 40, 52, 56, 108, 124}
+
+# (偏移, 魔数, 对应扩展名)
+SIGNATURES = [
+    (0, b'\x89PNG\r\n\x1a\n', '.png'),
+    (0, b'\xff\xd8\xff', '.jpg'),
+    (0, b'GIF87a', '.gif'),
+    (0, b'GIF89a', '.gif'),
+    (0, b'II*\x00', '.tiff'),
+    (0, b'MM\x00*', '.tiff'),
+    (0, b'PK\x03\x04', '.zip'),
+    (0, b'PK\x05\x06', '.zip'),
+    (0, b'Rar!\x1a\x07', '.rar'),
+    (0, b"7z\xbc\xaf'\x1c", '.7z'),
+]
+
+
+def sniff_extension(head: bytes) -> Optional[str]:
+    """根据头部字节返回文件类型对应的扩展名，无法识别时返回None"""
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return '.webp'
+    # "BM" 只有两个字节，文本开头也很常见，需要同时校验偏移14处的DIB头大小
+    if head[:2] == b'BM' and int.from_bytes(head[14:18], 'little') in BMP_DIB_HEADER_SIZES:
+        return '.bmp'
+    for offset, signature, ext in SIGNATURES:
+        if head[offset:offset + len(signature)] == signature:
+            return ext
+    return None
+
+
+def is_executable_header(header: bytes) -> bool:
+    """根据文件头判断是否为可执行的二进制文件"""
+    # 检查常见的可执行文件头
+    return header in {b'\x7fELF', b'MZ\x90\x00', b'PK\x03\x04',b'\xca\xfe\xba\xbe',b'\xcf\xfa\xed\xfe'}
+
+
+def sniff_file_extension(file_path) -> Optional[str]:
+    """读取本地文件头部并识别类型"""
+    try:
+        with open(file_path, 'rb') as f:
+            return sniff_extension(f.read(SNIFF_BYTES))
+    except OSError:
+        return None
+
+
+# 内容过短等 libmagic 无法判断类型时，按文本处理的扩展名
+TEXT_FILE_EXTENSIONS = {'.txt', '.md', '.py', '.js', '.html', '.css', '.json', '.xml', '.csv'}
+
+# 按文本处理的非 text/* MIME 类型
+TEXT_MIME_TYPES = {'application/json', 'application/xml', 'application/javascript', 'application/x-ndjson'}
+
+# 字节序标记 -> 编码
+BOMS = [
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+
+def sniff_mime(head: bytes) -> Optional[str]:
+    """用 libmagic 识别头部字节的MIME类型，不可用或识别失败时返回None"""
+    if magic is None or not head:
+        return None
+    try:
+        return magic.from_buffer(head, mime=True)
+    except Exception:
+        return None
+
+
+def detect_text_encoding(head: bytes) -> Optional[str]:
+    """根据头部字节判断文本编码（BOM、UTF-8、GBK），判断为二进制时返回None"""
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding
+    if b'\x00' in head:
+        return None
+    for encoding in ('utf-8', 'gbk'):
+        try:
+            # 头部可能在多字节字符中间截断，不要求末尾完整
+            codecs.getincrementaldecoder(encoding)().decode(head, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return None
+
+
+def is_text_content(head: bytes, suffix: str = "") -> bool:
+    """判断头部字节是否为文本内容，libmagic 只能给出 application/octet-stream 时（如一两个字节的文件）参考扩展名"""
+    if detect_text_encoding(head) is None:
+        return False
+    mime = sniff_mime(head)
+    if mime == 'application/octet-stream':
+        return suffix.lower() in TEXT_FILE_EXTENSIONS
+    return mime is None or mime.startswith('text/') or mime in TEXT_MIME_TYPES
+
+
+def decode_text_preview(prefix: bytes, truncated: bool) -> Optional[str]:
+    """按头部检测到的编码增量解码文本前缀，无法识别编码时返回None"""
+    encoding = detect_text_encoding(prefix)
+    if encoding is None:
+        return None
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    # 前缀可能在多字节字符中间截断，截断时不输出末尾不完整的字符
+    return decoder.decode(prefix, final=not truncated)
@@ -0,0 +1,154 @@
+"""对话历史压缩：按token预算保留最近的对话原文，较早的对话折叠为按用户缓存的滚动摘要
+
+摘要状态记录已折叠到的位置（会话中的绝对序号）和这些消息的指纹。新消息到来时只有
+未折叠部分超过 summary_trigger 才调用一次大模型，把新增的较早消息合并进已有摘要（增量更新）；
+会话存储裁掉历史开头时摘要继续有效，历史与缓存的状态对不上时（如会话被清空）丢弃旧摘要重新开始。
+"""
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from caching import TTLCache, make_key
+
+Turn = Tuple[str, str]  # (角色, 内容)，角色为 human / ai
+
+# 每条消息的格式开销（角色标记等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算token数：中日韩字符约1个token，其他字符约4个字符1个token"""
+    cjk = sum(1 for ch in text if '\u3000' <= ch <= '\u9fff' or '\uac00' <= ch <= '\ud7af' or '\uff00' <= ch <= '\uffef')
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def turns_tokens(turns: List[Turn]) -> int:
+    return sum(estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS for _, content in turns)
+
+
+def visible_turns(turns: List[Turn]) -> List[Turn]:
+    """去掉内容为空的消息（它们只用于保持与会话存储一致的序号）"""
+    return [(role, content) for role, content in turns if content.strip()]
+
+
+def turns_fingerprint(turns: List[Turn]) -> str:
+    return make_key(*(f"{role}:{content}" for role, content in turns))
+
+
+class HistoryCompactor:
+    """按用户维护滚动摘要的上下文构建器"""
+
+    def __init__(self, summarize: Callable[[str, List[Turn]], str],
+                 asummarize: Callable[[str, List[Turn]], Awaitable[str]],
+                 recent_budget: int = 1500, summary_trigger: int = 2500,
+                 max_users: int = 10000, ttl: float = 24 * 3600):
+        self.summarize = summarize
+        self.asummarize = asummarize
+        self.recent_budget = recent_budget
+        self.summary_trigger = max(summary_trigger, recent_budget)
+        self._states = TTLCache("history_summary", max_entries=max_users, ttl=ttl)
+        self._lock = threading.Lock()
+        self._stats = {"compactions": 0, "summaryFailures": 0, "truncations": 0}
+
+    def compact(self, user_id: Optional[str], turns: List[Turn], base_index: int = 0) -> List[Turn]:
+        """返回发送给大模型的历史消息（摘要 + 最近的原文），base_index 为 turns[0] 在会话中的序号"""
+        state, start, fold_end = self._plan(user_id, turns, base_index)
+        if fold_end is not None and user_id is not None:
+            try:
+                summary = self.summarize(state["summary"], visible_turns(turns[start:fold_end]))
+                state, start = self._save(user_id, turns, base_index, fold_end, summary), fold_end
+            except Exception as e:
+                self._summary_failed(e)
+        return self._render(state, turns, start, fold_end)
+
+    async def acompact(self, user_id: Optional[str], turns: List[Turn], base_index: int = 0) -> List[Turn]:
+        """compact 的异步版本"""
+        state, start, fold_end = self._plan(user_id, turns, base_index)
+        if fold_end is not None and user_id is not None:
+            try:
+                summary = await self.asummarize(state["summary"], visible_turns(turns[start:fold_end]))
+                state, start = self._save(user_id, turns, base_index, fold_end, summary), fold_end
+            except Exception as e:
+                self._summary_failed(e)
+        return self._render(state, turns, start, fold_end)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+        stats["states"] = self._states.stats()
+        stats["recentBudget"] = self.recent_budget
+        stats["summaryTrigger"] = self.summary_trigger
+        return stats
+
+    def _plan(self, user_id: Optional[str], turns: List[Turn],
+              base_index: int) -> Tuple[Dict[str, Any], int, Optional[int]]:
+        """返回 (当前摘要状态, 未折叠部分在 turns 中的起点, 需要折叠到的位置)，未折叠部分没有超过阈值时位置为None"""
+        state = self._load(user_id, turns, base_index)
+        start = max(state["covered"] - base_index, 0)
+        pending = turns[start:]
+        if turns_tokens(pending) <= self.summary_trigger:
+            return state, start, None
+
+        # 从最新的消息往前保留 recent_budget 以内的原文，其余折叠
+        used = 0
+        fold_end = len(turns)
+        while fold_end > start:
+            cost = turns_tokens(turns[fold_end - 1:fold_end])
+            if used + cost > self.recent_budget:
+                break
+            used += cost
+            fold_end -= 1
+        return state, start, fold_end
+
+    def _load(self, user_id: Optional[str], turns: List[Turn], base_index: int) -> Dict[str, Any]:
+        empty = {"summary": "", "base": base_index, "covered": base_index, "fingerprint": "", "last": ""}
+        if user_id is None:
+            return empty
+        state = self._states.get(str(user_id))
+        if state is None:
+            return empty
+        if not self._matches(state, turns, base_index):
+            # 历史已变化（会话被清空或切换），旧摘要不再适用
+            self._states.delete(str(user_id))
+            return empty
+        return state
+
+    @staticmethod
+    def _matches(state: Dict[str, Any], turns: List[Turn], base_index: int) -> bool:
+        """摘要状态是否仍与当前历史对应"""
+        covered = state["covered"] - base_index
+        if base_index < state["base"] or covered > len(turns):
+            return False
+        if base_index == state["base"]:
+            return turns_fingerprint(turns[:covered]) == state["fingerprint"]
+        # 会话存储裁掉了历史开头：已折叠的最后一条仍保留时核对这一条，已被裁掉时摘要照常使用
+        return covered <= 0 or turns_fingerprint(turns[covered - 1:covered]) == state["last"]
+
+    def _save(self, user_id: str, turns: List[Turn], base_index: int, fold_end: int, summary: str) -> Dict[str, Any]:
+        state = {
+            "summary": summary,
+            "base": base_index,
+            "covered": base_index + fold_end,
+            "fingerprint": turns_fingerprint(turns[:fold_end]),
+            "last": turns_fingerprint(turns[fold_end - 1:fold_end]),
+        }
+        self._states.set(str(user_id), state)
+        with self._lock:
+            self._stats["compactions"] += 1
+        return state
+
+    def _summary_failed(self, error: Exception):
+        print(f"对话摘要生成失败，仅保留最近的对话: {error}")
+        with self._lock:
+            self._stats["summaryFailures"] += 1
+
+    def _render(self, state: Dict[str, Any], turns: List[Turn], start: int, fold_end: Optional[int]) -> List[Turn]:
+        # 摘要未能覆盖到 fold_end 时（无用户ID或摘要失败）直接丢弃中间的较早消息
+        if fold_end is not None and fold_end > start:
+            start = fold_end
+            with self._lock:
+                self._stats["truncations"] += 1
+        rendered: List[Turn] = []
+        if state["summary"]:
+            rendered.append(("system", f"以下是与该用户此前对话的摘要：\n{state['summary']}"))
+        rendered.extend(visible_turns(turns[start:]))
+        return rendered
@@ -0,0 +1,246 @@
+"""part1 HTTP 客户端：进程内共享的连接池、超时配置与带抖动退避的重试"""
+import asyncio
+import random
+import socket
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from config.config import (
+    HTTP_POOL_CONNECTIONS,
+    HTTP_POOL_MAXSIZE,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_READ_TIMEOUT,
+    HTTP_MAX_RETRIES,
+    HTTP_RETRY_BACKOFF,
+    HTTP_RETRY_BACKOFF_MAX,
+    HTTP_RETRY_STATUSES,
+)
+
+# 读取超时或5xx时可以安全重试的方法
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+_async_client: Optional[httpx.AsyncClient] = None
+_async_client_loop = None
+
+_stats_lock = threading.Lock()
+_stats = {
+    "requests": 0,
+    "retries": 0,
+    "failures": 0,
+}
+
+
+def _count(key: str, amount: int = 1):
+    with _stats_lock:
+        _stats[key] += amount
+
+
+def _backoff_delay(attempt: int) -> float:
+    """计算第 attempt 次重试前的等待时间（full jitter）"""
+    return random.uniform(0, min(HTTP_RETRY_BACKOFF_MAX, HTTP_RETRY_BACKOFF * (2 ** attempt)))
+
+
+def get_session() -> requests.Session:
+    """获取共享的 requests.Session（启用 keep-alive 连接池）"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=HTTP_POOL_CONNECTIONS,
+                    pool_maxsize=HTTP_POOL_MAXSIZE,
+                    max_retries=0,
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """获取当前事件循环共享的 httpx.AsyncClient"""
+    global _async_client, _async_client_loop
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_client_loop is not loop or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=HTTP_POOL_MAXSIZE,
+                max_keepalive_connections=HTTP_POOL_MAXSIZE,
+            ),
+            timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        )
+        _async_client_loop = loop
+    return _async_client
+
+
+async def aclose_async_client():
+    """关闭异步客户端（ASGI 应用退出时调用）"""
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+def _is_idempotent(method: str, idempotent: Optional[bool]) -> bool:
+    return idempotent if idempotent is not None else method.upper() in IDEMPOTENT_METHODS
+
+
+def _is_connect_error(error: requests.RequestException) -> bool:
+    """请求是否在建立连接阶段失败（请求尚未发出，重试不会重复执行）"""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.ConnectionError) or isinstance(error, requests.ReadTimeout):
+        return False
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def _clamp_timeout(timeout, limit: float):
+    """把 requests 的超时（秒数或 (连接, 读取) 元组）限制在 limit 秒以内"""
+    if isinstance(timeout, tuple):
+        return tuple(limit if t is None else min(t, limit) for t in timeout)
+    return limit if timeout is None else min(timeout, limit)
+
+
+def request(method: str, url: str, idempotent: Optional[bool] = None,
+            deadline: Optional[float] = None, **kwargs) -> requests.Response:
+    """发送请求，遇到连接错误或临时性5xx时按抖动退避重试
+
+    非幂等请求（默认按方法判断，POST 等为非幂等）只在连接阶段失败时重试：
+    读取超时或网关错误时对方可能已经处理了请求，重试会导致重复执行（如重复发送回复）。
+    指定 deadline（time.monotonic() 时间）时每次请求的超时不超过剩余时间，到期后不再重试。
+    """
+    timeout = kwargs.pop("timeout", (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    retry_all = _is_idempotent(method, idempotent)
+    session = get_session()
+    attempt = 0
+    while True:
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            _count("failures")
+            raise requests.Timeout(f"请求 {url} 超过截止时间")
+        _count("requests")
+        try:
+            response = session.request(method, url, timeout=timeout if remaining is None
+                                       else _clamp_timeout(timeout, remaining), **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt >= HTTP_MAX_RETRIES or not (retry_all or _is_connect_error(e)):
+                _count("failures")
+                raise
+            print(f"请求 {url} 失败，准备重试: {e}")
+        else:
+            if response.status_code not in HTTP_RETRY_STATUSES or attempt >= HTTP_MAX_RETRIES or not retry_all:
+                return response
+            if deadline is not None and time.monotonic() >= deadline:
+                return response
+            print(f"请求 {url} 返回 {response.status_code}，准备重试")
+            response.close()
+        attempt += 1
+        _count("retries")
+        delay = _backoff_delay(attempt)
+        if deadline is not None:
+            delay = min(delay, max(0.0, deadline - time.monotonic()))
+        time.sleep(delay)
+
+
+def abort(response: requests.Response) -> None:
+    """从其他线程中断流式响应：关闭底层连接的读写，阻塞在读取上的线程立即出错返回
+
+    response.close() 需要等读取线程释放缓冲区锁，慢速持续到达的数据会让它一直等下去
+    """
+    sock = getattr(getattr(response.raw, "connection", None), "sock", None)
+    if sock is None:
+        # 不保持连接的响应（HTTP/1.0、Connection: close）已把套接字交给响应的读取流
+        reader = getattr(getattr(response.raw, "_fp", None), "fp", None)
+        sock = getattr(getattr(reader, "raw", None), "_sock", None)
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+async def _asend(method: str, url: str, stream: bool, idempotent: Optional[bool] = None, **kwargs) -> httpx.Response:
+    client = get_async_client()
+    retry_all = _is_idempotent(method, idempotent)
+    attempt = 0
+    while True:
+        _count("requests")
+        try:
+            response = await client.send(client.build_request(method, url, **kwargs), stream=stream)
+        except (httpx.TransportError, httpx.TimeoutException) as e:
+            connect_error = isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+            if attempt >= HTTP_MAX_RETRIES or not (retry_all or connect_error):
+                _count("failures")
+                raise
+            print(f"请求 {url} 失败，准备重试: {e}")
+        else:
+            if response.status_code not in HTTP_RETRY_STATUSES or attempt >= HTTP_MAX_RETRIES or not retry_all:
+                return response
+            print(f"请求 {url} 返回 {response.status_code}，准备重试")
+            await response.aclose()
+        attempt += 1
+        _count("retries")
+        await asyncio.sleep(_backoff_delay(attempt))
+
+
+async def arequest(method: str, url: str, idempotent: Optional[bool] = None, **kwargs) -> httpx.Response:
+    """request 的异步版本"""
+    return await _asend(method, url, stream=False, idempotent=idempotent, **kwargs)
+
+
+@asynccontextmanager
+async def astream(method: str, url: str, **kwargs):
+    """流式异步请求：响应体按需读取，退出上下文时释放连接"""
+    response = await _asend(method, url, stream=True, **kwargs)
+    try:
+        yield response
+    finally:
+        await response.aclose()
+
+
+def pool_stats() -> Dict[str, Any]:
+    """连接池使用统计"""
+    with _stats_lock:
+        stats: Dict[str, Any] = dict(_stats)
+
+    hosts = []
+    if _session is not None:
+        adapter = _session.get_adapter("http://")
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            hosts.append({
+                "host": f"{pool.scheme}://{pool.host}:{pool.port}",
+                "connectionsCreated": pool.num_connections,
+                "requests": pool.num_requests,
+                # 连接池队列中 None 为尚未建立的占位槽位
+                "idleConnections": sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool else 0,
+                "maxSize": HTTP_POOL_MAXSIZE,
+            })
+    stats["syncPools"] = hosts
+
+    if _async_client is not None and not _async_client.is_closed:
+        try:
+            connections = _async_client._transport._pool.connections
+            stats["asyncPool"] = {
+                "connections": len(connections),
+                "idleConnections": sum(1 for conn in connections if conn.is_idle()),
+                "maxSize": HTTP_POOL_MAXSIZE,
+            }
+        except AttributeError:
+            pass
+    return stats
@@ -0,0 +1,117 @@
+"""webhook幂等处理：同一个幂等键只执行一次，重复投递直接返回已保存的结果
+
+执行完成的结果在 ttl 内保留；原请求仍在执行时，重复的请求等待原请求的结果而不是再执行一次。
+原请求执行失败时不保存结果，重复请求收到同样的异常，之后的重试会重新执行。
+已保存的结果之后才确定失败时（如异步模式下入队成功、后台任务失败），由 discard 判断后丢弃并重新执行。
+"""
+import asyncio
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from caching import TTLCache
+
+
+class IdempotencyPending(Exception):
+    """等待原请求的结果超时"""
+
+
+class IdempotencyStore:
+    """幂等键 -> 结果（TTLCache），以及执行中的幂等键 -> Future"""
+
+    def __init__(self, ttl: float = 600, max_entries: int = 10000, wait_timeout: float = 60):
+        self.wait_timeout = wait_timeout
+        self._results = TTLCache("idempotency", max_entries=max_entries, ttl=ttl)
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._stats = {"executions": 0, "replays": 0, "waits": 0, "waitTimeouts": 0, "failures": 0, "discards": 0}
+
+    def run(self, key: str, func: Callable[[], Any],
+            keep: Optional[Callable[[Any], bool]] = None,
+            discard: Optional[Callable[[Any], bool]] = None) -> Tuple[Any, bool]:
+        """执行 func 或复用已有结果，返回 (结果, 是否为重复请求)
+
+        keep 返回False的结果只交给正在等待的重复请求，不保存（之后的重试会重新执行）；
+        discard 返回True的已保存结果被丢弃，本次请求重新执行
+        """
+        owner, found = self._claim(key, discard)
+        if not owner:
+            if not isinstance(found, Future):
+                return found, True
+            try:
+                return found.result(timeout=self.wait_timeout), True
+            except FutureTimeoutError:
+                raise self._wait_timed_out(key)
+        try:
+            result = func()
+        except BaseException as e:
+            self._fail(key, found, e)
+            raise
+        self._complete(key, found, result, keep is None or keep(result))
+        return result, False
+
+    async def arun(self, key: str, func: Callable[[], Awaitable[Any]],
+                   keep: Optional[Callable[[Any], bool]] = None,
+                   discard: Optional[Callable[[Any], bool]] = None) -> Tuple[Any, bool]:
+        """run 的异步版本，等待原请求期间不占用事件循环"""
+        owner, found = self._claim(key, discard)
+        if not owner:
+            if not isinstance(found, Future):
+                return found, True
+            try:
+                return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(found)), self.wait_timeout), True
+            except asyncio.TimeoutError:
+                raise self._wait_timed_out(key)
+        try:
+            result = await func()
+        except BaseException as e:
+            self._fail(key, found, e)
+            raise
+        self._complete(key, found, result, keep is None or keep(result))
+        return result, False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+            stats["inflight"] = len(self._inflight)
+        stats["results"] = self._results.stats()
+        return stats
+
+    def _claim(self, key: str, discard: Optional[Callable[[Any], bool]] = None) -> Tuple[bool, Any]:
+        """返回 (是否由本次请求执行, 本次执行的Future / 已有结果 / 原请求的Future)"""
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self._stats["waits"] += 1
+                return False, future
+            result = self._results.get(key)
+            if result is not None and discard is not None and discard(result):
+                self._results.delete(key)
+                self._stats["discards"] += 1
+                result = None
+            if result is not None:
+                self._stats["replays"] += 1
+                return False, result
+            future = Future()
+            self._inflight[key] = future
+            self._stats["executions"] += 1
+            return True, future
+
+    def _complete(self, key: str, future: Future, result: Any, keep: bool):
+        # 先写入结果再移出执行中列表，期间到达的重复请求总能拿到结果
+        if keep:
+            self._results.set(key, result)
+        with self._lock:
+            self._inflight.pop(key, None)
+        future.set_result(result)
+
+    def _fail(self, key: str, future: Future, error: BaseException):
+        with self._lock:
+            self._inflight.pop(key, None)
+            self._stats["failures"] += 1
+        future.set_exception(error)
+
+    def _wait_timed_out(self, key: str) -> IdempotencyPending:
+        with self._lock:
+            self._stats["waitTimeouts"] += 1
+        return IdempotencyPending(f"相同的请求 {key[:12]} 仍在处理中")
@@ -0,0 +1,137 @@
+"""视觉模型调用前的图片预处理：一次解码、按最长边缩放、重新编码为紧凑格式"""
+import base64
+import io
+import os
+from typing import NamedTuple, Optional, Union
+
+from PIL import Image, ImageOps
+
+from phash_index import dhash
+
+from config.config import (
+    VISION_IMAGE_MAX_EDGE,
+    VISION_IMAGE_FORMAT,
+    VISION_IMAGE_QUALITY,
+    VISION_IMAGE_PASSTHROUGH_BYTES,
+    PHASH_ENABLED,
+)
+
+# 可以原样发送给视觉模型的格式
+PASSTHROUGH_FORMATS = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif"}
+
+OUTPUT_MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+# 支持 quality 参数的输出格式
+LOSSY_FORMATS = {"JPEG", "WEBP"}
+
+EXIF_ORIENTATION = 0x0112
+# 需要旋转90度的EXIF方向值（宽高互换）
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+def format_basic_info(width: int, height: int, format_name: str, mode: str) -> str:
+    return f"图片基本信息：{width}x{height}像素，格式：{format_name}，颜色模式：{mode}"
+
+
+class PreparedImage(NamedTuple):
+    """预处理后的图片：原图基本信息、感知哈希（未开启近似重复识别时为None）与可直接发送的 data URL
+
+    data URL 写到文件时（在进程池中执行）为None，由调用方从文件读回
+    """
+    width: int
+    height: int
+    format: str
+    mode: str
+    data_url: Optional[str]
+    phash: Optional[int]
+
+    @property
+    def basic_info(self) -> str:
+        return format_basic_info(self.width, self.height, self.format, self.mode)
+
+
+def _orientation(img: Image.Image) -> int:
+    return img.getexif().get(EXIF_ORIENTATION, 1)
+
+
+def read_basic_info(image_path: str) -> str:
+    """只读取图片头部获取基本信息（不解码像素，宽高按EXIF方向校正）"""
+    with Image.open(image_path) as img:
+        width, height = img.size
+        if _orientation(img) in TRANSPOSED_ORIENTATIONS:
+            width, height = height, width
+        return format_basic_info(width, height, img.format, img.mode)
+
+
+def _to_data_url(mime_type: str, raw, output_path: Optional[str]) -> Optional[str]:
+    """生成 data URL；指定 output_path 时写入该文件并返回None，避免经 pickle 回传大字符串"""
+    # 直接对缓冲区做base64编码，只在最后解码一次为str
+    data_url = f"data:{mime_type};base64,".encode("ascii") + base64.b64encode(raw)
+    if output_path is None:
+        return data_url.decode("ascii")
+    with open(output_path, "wb") as f:
+        f.write(data_url)
+    return None
+
+
+def _phash(img: Image.Image) -> Optional[int]:
+    return dhash(img) if PHASH_ENABLED else None
+
+
+def prepare_image(image_source: Union[str, bytes],
+                  max_edge: int = VISION_IMAGE_MAX_EDGE,
+                  output_format: str = VISION_IMAGE_FORMAT,
+                  quality: int = VISION_IMAGE_QUALITY,
+                  output_path: Optional[str] = None) -> PreparedImage:
+    """解码图片（文件路径或内存数据）并生成视觉模型输入，图片损坏时抛出异常
+
+    指定 output_path 时 data URL 写入该文件，返回值中的 data_url 为None
+    """
+    if isinstance(image_source, (bytes, bytearray)):
+        source_size = len(image_source)
+        fp = io.BytesIO(image_source)
+    else:
+        source_size = os.path.getsize(image_source)
+        fp = image_source
+
+    with Image.open(fp) as img:
+        width, height = img.size
+        format_name = img.format
+        mode = img.mode
+        orientation = _orientation(img)
+        if orientation in TRANSPOSED_ORIENTATIONS:
+            width, height = height, width
+
+        # 小图且格式受支持时直接发送原始字节，省去重新编码（带旋转方向的照片需要先转正）
+        if (max(width, height) <= max_edge and format_name in PASSTHROUGH_FORMATS
+                and source_size <= VISION_IMAGE_PASSTHROUGH_BYTES and orientation == 1):
+            img.load()  # 完整解码一次以校验图片完整性
+            if fp is image_source:
+                with open(image_source, "rb") as f:
+                    raw = f.read()
+            else:
+                raw = image_source
+            return PreparedImage(width, height, format_name, mode,
+                                 _to_data_url(PASSTHROUGH_FORMATS[format_name], raw, output_path), _phash(img))
+
+        # JPEG 可在解码阶段直接按比例缩小（DCT 缩放），显著减少解码开销
+        if format_name == "JPEG":
+            img.draft("RGB", (max_edge, max_edge))
+        img.load()
+        # 重新编码会丢失EXIF，先按方向标记把像素转正（手机竖拍的照片）
+        frame = ImageOps.exif_transpose(img)
+        phash = _phash(frame)
+
+        if output_format == "JPEG" and frame.mode != "RGB":
+            frame = frame.convert("RGB")
+        elif frame.mode not in ("RGB", "RGBA", "L"):
+            frame = frame.convert("RGBA")
+        frame.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+        buffer = io.BytesIO()
+        save_options = {"quality": quality} if output_format in LOSSY_FORMATS else {}
+        frame.save(buffer, format=output_format, optimize=True, **save_options)
+
+    return PreparedImage(width, height, format_name, mode,
+                         _to_data_url(OUTPUT_MIME_TYPES.get(output_format, "image/jpeg"), buffer.getbuffer(), output_path),
+                         phash)
@@ -0,0 +1,179 @@
+import asyncio
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+
+class JobQueueFull(Exception):
+    """任务队列已满，无法继续接收新任务"""
+
+
+def job_outcome(result: Any) -> Dict[str, Any]:
+    """根据任务返回值确定任务状态：返回 success 为False的结果（如回复未送达）同样记为失败"""
+    if isinstance(result, dict) and result.get("success") is False:
+        return {"status": "failed", "result": result, "error": result.get("error") or "任务返回失败结果"}
+    return {"status": "succeeded", "result": result}
+
+
+class JobQueue:
+    """有界后台任务队列：webhook 入队后立即返回，由固定数量的工作线程执行"""
+
+    def __init__(self, worker_count: int = 4, max_queue_size: int = 100, result_ttl: int = 3600):
+        self.worker_count = worker_count
+        self.result_ttl = result_ttl
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._workers = []
+        self._started = False
+
+    def start(self):
+        """启动工作线程（首次提交任务时自动调用）"""
+        with self._lock:
+            if self._started:
+                return
+            for i in range(self.worker_count):
+                worker = threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+            self._started = True
+        print(f"后台任务队列已启动，工作线程数: {self.worker_count}")
+
+    def submit(self, func: Callable, *args, meta: Optional[Dict[str, Any]] = None, **kwargs) -> str:
+        """提交任务并返回任务ID，队列已满时抛出 JobQueueFull"""
+        self.start()
+        job_id = self._create_job(meta)
+        try:
+            self._queue.put_nowait((job_id, func, args, kwargs))
+        except queue.Full:
+            with self._lock:
+                self._jobs.pop(job_id, None)
+            raise JobQueueFull(f"任务队列已满（{self._queue.maxsize}）")
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """查询任务状态"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job:
+                return None
+            return {key: value for key, value in job.items() if not key.startswith("_")}
+
+    def stats(self) -> Dict[str, Any]:
+        """任务队列统计信息"""
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for job in self._jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+        return {
+            "workers": self.worker_count,
+            "queueDepth": self._queue.qsize(),
+            "queueCapacity": self._queue.maxsize,
+            "jobs": counts,
+        }
+
+    def _worker_loop(self):
+        while True:
+            job_id, func, args, kwargs = self._queue.get()
+            self._update(job_id, status="running", startedAt=datetime.now().isoformat())
+            try:
+                result = func(*args, **kwargs)
+                self._update(job_id, **job_outcome(result))
+            except Exception as e:
+                print(f"后台任务 {job_id} 执行失败: {e}")
+                self._update(job_id, status="failed", error=str(e))
+            finally:
+                self._update(job_id, finishedAt=datetime.now().isoformat(), _finished=time.time())
+                self._queue.task_done()
+
+    def _create_job(self, meta: Optional[Dict[str, Any]]) -> str:
+        self._prune()
+        job_id = uuid.uuid4().hex
+        job = {
+            "jobId": job_id,
+            "status": "queued",
+            "createdAt": datetime.now().isoformat(),
+            "startedAt": None,
+            "finishedAt": None,
+            "result": None,
+            "error": None,
+            **(meta or {}),
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+        return job_id
+
+    def _update(self, job_id: str, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields)
+
+    def _prune(self):
+        """清理超过保留时间的已完成任务"""
+        deadline = time.time() - self.result_ttl
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.get("_finished") and job["_finished"] < deadline]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+
+class AsyncJobQueue(JobQueue):
+    """asyncio 版本的任务队列：任务以协程在事件循环中执行，并发数受 worker_count 限制"""
+
+    def __init__(self, worker_count: int = 4, max_queue_size: int = 100, result_ttl: int = 3600):
+        super().__init__(worker_count, max_queue_size, result_ttl)
+        self.max_queue_size = max_queue_size
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._tasks = set()
+        self._waiting = 0
+
+    def start(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.worker_count)
+            self._started = True
+
+    def submit(self, func: Callable, *args, meta: Optional[Dict[str, Any]] = None, **kwargs) -> str:
+        """提交协程任务（需在事件循环内调用），排队任务过多时抛出 JobQueueFull"""
+        self.start()
+        if self._waiting >= self.max_queue_size:
+            raise JobQueueFull(f"任务队列已满（{self.max_queue_size}）")
+        job_id = self._create_job(meta)
+        self._waiting += 1
+        task = asyncio.get_running_loop().create_task(self._run(job_id, func, args, kwargs))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job_id
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats["queueDepth"] = self._waiting
+        stats["queueCapacity"] = self.max_queue_size
+        return stats
+
+    async def _run(self, job_id: str, func: Callable, args, kwargs):
+        # 排队计数在获取信号量结束时减少，排队期间被取消（如关闭服务）也不会残留
+        try:
+            await self._semaphore.acquire()
+        except asyncio.CancelledError:
+            self._update(job_id, status="failed", error="任务在排队时被取消",
+                         finishedAt=datetime.now().isoformat(), _finished=time.time())
+            raise
+        finally:
+            self._waiting -= 1
+        try:
+            self._update(job_id, status="running", startedAt=datetime.now().isoformat())
+            try:
+                result = await func(*args, **kwargs)
+                self._update(job_id, **job_outcome(result))
+            except Exception as e:
+                print(f"后台任务 {job_id} 执行失败: {e}")
+                self._update(job_id, status="failed", error=str(e))
+            finally:
+                self._update(job_id, finishedAt=datetime.now().isoformat(), _finished=time.time())
+        finally:
+            self._semaphore.release()
@@ -0,0 +1,10 @@
+"""服务启动入口：python3 main.py
+
+进程池（offload）以 forkserver 启动工作进程时，会以 __mp_main__ 的名义在每个工作进程中重新导入启动脚本。
+本文件在导入时没有任何副作用，工作进程只加载预先导入的 imaging、archive_inspect，
+不会重复初始化大模型与视觉模型客户端、工具模块（下载缓存清理、各类缓存和线程池）以及 Flask 应用。
+"""
+
+if __name__ == '__main__':
+    from app import main
+    main()
@@ -0,0 +1,128 @@
+"""CPU密集型任务的进程池：解压、图片解码缩放和base64编码不再占用Web进程的GIL
+
+任务函数必须定义在无副作用的模块中（如 imaging、archive_inspect）。工作进程会以 __mp_main__
+重新导入启动脚本，因此服务需从导入时没有副作用的入口启动（main.py），不能直接运行 app.py。
+大块数据通过文件路径交接（包括图片的 data URL），只有路径和较小的结果经过 pickle 传递。
+OFFLOAD_PROCESSES 为 0 时在当前进程中直接执行。
+"""
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+
+from config.config import OFFLOAD_PROCESSES, OFFLOAD_TASK_TIMEOUT
+
+# 进程池预先导入的模块，工作进程从 forkserver 派生时无需重复导入
+PRELOAD_MODULES = ["imaging", "archive_inspect"]
+
+
+class OffloadTimeout(Exception):
+    """任务在进程池中超时"""
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+_lock = threading.Lock()
+_inflight = 0
+_stats = {"submitted": 0, "completed": 0, "failed": 0, "timeouts": 0, "restarts": 0}
+
+
+def get_executor() -> ProcessPoolExecutor:
+    """获取进程池（首次使用时创建）"""
+    global _executor
+    with _lock:
+        if _executor is None:
+            # Web进程中有其他线程，fork 不安全，使用 forkserver 启动工作进程
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload(PRELOAD_MODULES)
+            _executor = ProcessPoolExecutor(max_workers=OFFLOAD_PROCESSES, mp_context=context)
+        return _executor
+
+
+def _reset_executor(broken: ProcessPoolExecutor):
+    """工作进程异常退出后丢弃进程池，下次使用时重新创建"""
+    global _executor
+    with _lock:
+        if _executor is broken:
+            _executor = None
+            _stats["restarts"] += 1
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def _on_done(future: Future):
+    global _inflight
+    with _lock:
+        _inflight -= 1
+        if future.cancelled() or future.exception() is not None:
+            _stats["failed"] += 1
+        else:
+            _stats["completed"] += 1
+
+
+def _submit(func: Callable, args: tuple, kwargs: Dict[str, Any]) -> Future:
+    global _inflight
+    executor = get_executor()
+    try:
+        future = executor.submit(func, *args, **kwargs)
+    except BrokenProcessPool:
+        _reset_executor(executor)
+        executor = get_executor()
+        future = executor.submit(func, *args, **kwargs)
+    future.executor = executor
+    with _lock:
+        _inflight += 1
+        _stats["submitted"] += 1
+    future.add_done_callback(_on_done)
+    return future
+
+
+def _handle_failure(future: Future, error: BaseException):
+    if isinstance(error, BrokenProcessPool):
+        _reset_executor(future.executor)
+
+
+def run(func: Callable, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+    """在进程池中执行 func(*args, **kwargs) 并等待结果，超时抛出 OffloadTimeout"""
+    if OFFLOAD_PROCESSES <= 0:
+        return func(*args, **kwargs)
+    future = _submit(func, args, kwargs)
+    try:
+        return future.result(timeout=OFFLOAD_TASK_TIMEOUT if timeout is None else timeout)
+    except FutureTimeoutError:
+        # 排队中的任务直接取消；已在运行的任务由其自身的资源限制结束
+        future.cancel()
+        with _lock:
+            _stats["timeouts"] += 1
+        raise OffloadTimeout(f"{getattr(func, '__name__', func)} 执行超时")
+    except BrokenProcessPool as e:
+        _handle_failure(future, e)
+        raise
+
+
+async def arun(func: Callable, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+    """run 的异步版本：等待期间不占用事件循环"""
+    if OFFLOAD_PROCESSES <= 0:
+        return await asyncio.to_thread(func, *args, **kwargs)
+    future = _submit(func, args, kwargs)
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future),
+                                      OFFLOAD_TASK_TIMEOUT if timeout is None else timeout)
+    except asyncio.TimeoutError:
+        with _lock:
+            _stats["timeouts"] += 1
+        raise OffloadTimeout(f"{getattr(func, '__name__', func)} 执行超时")
+    except BrokenProcessPool as e:
+        _handle_failure(future, e)
+        raise
+
+
+def stats() -> Dict[str, Any]:
+    """进程池指标：queueDepth 为已提交但尚未开始执行的任务数"""
+    with _lock:
+        stats: Dict[str, Any] = dict(_stats)
+        stats["inflight"] = _inflight
+    stats["maxWorkers"] = OFFLOAD_PROCESSES
+    stats["queueDepth"] = max(0, stats["inflight"] - OFFLOAD_PROCESSES)
+    stats["enabled"] = OFFLOAD_PROCESSES > 0
+    return stats
@@ -0,0 +1,134 @@
+"""感知哈希索引：用 dHash 识别重新压缩或缩放过的近似重复图片
+
+索引采用多索引哈希（multi-index hashing）：64位哈希切分为若干段分别建倒排表。
+若两个哈希的汉明距离不超过 d，则按鸽巢原理至少有一段的距离不超过 d // 段数，
+因此只需在每段内枚举该半径内的取值即可找到全部候选，查询代价与索引规模基本无关。
+条目按 scope（如用户ID）隔离：倒排表以 (scope, 段取值) 为键，查询只探查调用方 scope 内的条目，
+同一张热门图片被许多用户上传也不会增加单次查询的候选数。
+"""
+import threading
+from collections import OrderedDict
+from itertools import combinations
+from typing import Any, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+from PIL import Image
+
+HASH_BITS = 64
+
+
+def dhash(img: Image.Image, hash_size: int = 8) -> int:
+    """计算图片的差值哈希（dHash），返回 hash_size * hash_size 位整数"""
+    small = img.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def is_informative(hash_value: int, min_bits: int) -> bool:
+    """纯色、大面积留白等细节很少的图片，哈希几乎全为0或全为1，彼此很容易相近，不能用于近似匹配"""
+    ones = hash_value.bit_count()
+    return min(ones, HASH_BITS - ones) >= min_bits
+
+
+class PerceptualHashIndex:
+    """有界的近似重复查找索引：(scope, hash) -> 值，超出容量时按LRU淘汰"""
+
+    def __init__(self, max_entries: int = 100000, max_distance: int = 6, chunks: int = 4):
+        if HASH_BITS % chunks:
+            raise ValueError("chunks 必须能整除哈希位数")
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.chunks = chunks
+        self.chunk_bits = HASH_BITS // chunks
+        self._chunk_mask = (1 << self.chunk_bits) - 1
+        self._entries: "OrderedDict[Tuple[Hashable, int], Any]" = OrderedDict()
+        # 每段一个倒排表：(scope, 段取值) -> 条目键
+        self._buckets: List[Dict[Tuple[Hashable, int], Set[Tuple[Hashable, int]]]] = [dict() for _ in range(chunks)]
+        self._probe_masks = self._build_probe_masks(max_distance // chunks)
+        self._lock = threading.Lock()
+        self._stats = {"lookups": 0, "hits": 0, "exactHits": 0, "evictions": 0}
+
+    def add(self, hash_value: int, value: Any, scope: Hashable = None):
+        key = (scope, hash_value)
+        with self._lock:
+            if key in self._entries:
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = value
+            for i, part in enumerate(self._split(hash_value)):
+                self._buckets[i].setdefault((scope, part), set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest, _ = self._entries.popitem(last=False)
+                self._unlink(oldest)
+                self._stats["evictions"] += 1
+
+    def lookup(self, hash_value: int, scope: Hashable = None,
+               accept: Optional[Callable[[Any], bool]] = None) -> Optional[Tuple[Any, int]]:
+        """返回同一 scope 内阈值内距离最近、且 accept 接受的 (值, 汉明距离)，没有时返回None"""
+        key = (scope, hash_value)
+        with self._lock:
+            self._stats["lookups"] += 1
+            if key in self._entries and (accept is None or accept(self._entries[key])):
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                self._stats["exactHits"] += 1
+                return self._entries[key], 0
+
+            best = None
+            best_distance = self.max_distance + 1
+            seen = set()
+            for i, part in enumerate(self._split(hash_value)):
+                bucket = self._buckets[i]
+                for mask in self._probe_masks:
+                    for candidate in bucket.get((scope, part ^ mask), ()):
+                        if candidate in seen:
+                            continue
+                        seen.add(candidate)
+                        distance = hamming_distance(hash_value, candidate[1])
+                        if distance < best_distance and (accept is None or accept(self._entries[candidate])):
+                            best, best_distance = candidate, distance
+            if best is None:
+                return None
+            self._entries.move_to_end(best)
+            self._stats["hits"] += 1
+            return self._entries[best], best_distance
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        stats["maxEntries"] = self.max_entries
+        stats["maxDistance"] = self.max_distance
+        return stats
+
+    def _split(self, hash_value: int) -> List[int]:
+        return [(hash_value >> (i * self.chunk_bits)) & self._chunk_mask for i in range(self.chunks)]
+
+    def _unlink(self, key: Tuple[Hashable, int]):
+        scope, hash_value = key
+        for i, part in enumerate(self._split(hash_value)):
+            bucket = self._buckets[i].get((scope, part))
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[i][(scope, part)]
+
+    def _build_probe_masks(self, radius: int) -> List[int]:
+        """枚举段内汉明距离不超过 radius 的全部翻转掩码"""
+        masks = [0]
+        for flips in range(1, radius + 1):
+            for bits in combinations(range(self.chunk_bits), flips):
+                mask = 0
+                for bit in bits:
+                    mask |= 1 << bit
+                masks.append(mask)
+        return masks
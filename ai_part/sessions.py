@@ -0,0 +1,173 @@
+"""按用户保存对话历史的会话存储，支撑webhook的增量协议
+
+server.js 每次只发送会话ID、起始序号（上次确认的位置）和新增的消息；
+序号或会话ID对不上时返回 SessionMismatch，由 server.js 发送完整历史重新同步。
+内存中按LRU保留最近活跃的会话，超出容量或空闲过久的会话在配置了 persist_path 时
+写入SQLite，下次访问时再加载。
+"""
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class SessionMismatch(Exception):
+    """增量消息与服务端保存的会话对不上，需要完整重新同步"""
+
+    def __init__(self, conversation_id: str, expected_index: int):
+        super().__init__(f"会话 {conversation_id} 需要从序号 {expected_index} 开始同步")
+        self.conversation_id = conversation_id
+        self.expected_index = expected_index
+
+
+class Session:
+    """单个用户的会话：messages[0] 对应 server.js 中序号为 base_index 的消息"""
+
+    __slots__ = ("conversation_id", "base_index", "messages", "last_access")
+
+    def __init__(self, conversation_id: str, base_index: int, messages: List[Dict[str, Any]],
+                 last_access: Optional[float] = None):
+        self.conversation_id = conversation_id
+        self.base_index = base_index
+        self.messages = messages
+        self.last_access = time.time() if last_access is None else last_access
+
+    @property
+    def end_index(self) -> int:
+        return self.base_index + len(self.messages)
+
+
+class SessionStore:
+    """线程安全的会话存储：内存LRU + 可选SQLite溢出 + 空闲淘汰"""
+
+    def __init__(self, max_sessions: int = 1000, idle_ttl: float = 1800, max_messages: int = 200,
+                 persist_path: Optional[str] = None, spill_ttl: float = 7 * 24 * 3600):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_messages = max_messages
+        self.spill_ttl = spill_ttl
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"deltas": 0, "resyncs": 0, "mismatches": 0, "evictions": 0,
+                       "spilled": 0, "loaded": 0, "messagesReceived": 0}
+        self._db = None
+        if persist_path:
+            self._open_db(persist_path)
+
+    def apply(self, user_id: str, conversation_id: str, base_index: int,
+              messages: List[Dict[str, Any]], resync: bool = False) -> Tuple[List[Dict[str, Any]], int]:
+        """合并 server.js 发来的消息，返回 (完整历史, 已确认序号)；对不上时抛出 SessionMismatch"""
+        with self._lock:
+            self._evict_idle()
+            session = self._get(user_id)
+            if resync or session is None or session.conversation_id != conversation_id:
+                # 完整同步可以从任意位置开始；新会话的增量只能从0开始
+                if not resync and base_index != 0:
+                    self._stats["mismatches"] += 1
+                    raise SessionMismatch(conversation_id, 0)
+                session = Session(conversation_id, base_index, list(messages))
+                self._stats["resyncs"] += 1
+            elif session.base_index <= base_index <= session.end_index:
+                # 与已有消息重叠时（重复投递）以新发来的为准
+                del session.messages[base_index - session.base_index:]
+                session.messages.extend(messages)
+                session.last_access = time.time()
+                self._stats["deltas"] += 1
+            else:
+                self._stats["mismatches"] += 1
+                raise SessionMismatch(conversation_id, session.end_index)
+
+            self._stats["messagesReceived"] += len(messages)
+            if len(session.messages) > self.max_messages:
+                # 一次裁掉多于上限的1/4，避免每条消息都改变历史开头；base_index 随之后移，对话摘要按绝对序号继续使用
+                drop = len(session.messages) - self.max_messages + self.max_messages // 4
+                del session.messages[:drop]
+                session.base_index += drop
+            self._put(user_id, session)
+            return list(session.messages), session.end_index
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+            stats["sessions"] = len(self._sessions)
+            stats["messages"] = sum(len(session.messages) for session in self._sessions.values())
+        stats["maxSessions"] = self.max_sessions
+        stats["persistent"] = self._db is not None
+        return stats
+
+    def _get(self, user_id: str) -> Optional[Session]:
+        session = self._sessions.get(user_id)
+        if session is not None:
+            self._sessions.move_to_end(user_id)
+            return session
+        return self._load(user_id)
+
+    def _put(self, user_id: str, session: Session):
+        self._sessions[user_id] = session
+        self._sessions.move_to_end(user_id)
+        while len(self._sessions) > self.max_sessions:
+            oldest_id, oldest = self._sessions.popitem(last=False)
+            self._spill(oldest_id, oldest)
+            self._stats["evictions"] += 1
+
+    def _evict_idle(self):
+        """从最久未访问的会话开始，移出空闲超过 idle_ttl 的会话（调用方持有锁）"""
+        deadline = time.time() - self.idle_ttl
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if session.last_access >= deadline:
+                break
+            del self._sessions[user_id]
+            self._spill(user_id, session)
+            self._stats["evictions"] += 1
+
+    def _spill(self, user_id: str, session: Session):
+        if self._db is None:
+            return
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions (user_id, conversation_id, base_index, messages, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (user_id, session.conversation_id, session.base_index,
+                 json.dumps(session.messages, ensure_ascii=False), session.last_access),
+            )
+            self._db.commit()
+            self._stats["spilled"] += 1
+        except sqlite3.Error as e:
+            print(f"会话 {user_id} 写入SQLite失败: {e}")
+
+    def _load(self, user_id: str) -> Optional[Session]:
+        if self._db is None:
+            return None
+        try:
+            row = self._db.execute(
+                "SELECT conversation_id, base_index, messages, last_access FROM sessions WHERE user_id = ?",
+                (user_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+            self._db.commit()
+        except sqlite3.Error as e:
+            print(f"会话 {user_id} 从SQLite读取失败: {e}")
+            return None
+        conversation_id, base_index, raw, last_access = row
+        if last_access < time.time() - self.spill_ttl:
+            return None
+        self._stats["loaded"] += 1
+        return Session(conversation_id, base_index, json.loads(raw))
+
+    def _open_db(self, persist_path: str):
+        try:
+            self._db = sqlite3.connect(persist_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (user_id TEXT PRIMARY KEY, conversation_id TEXT, "
+                "base_index INTEGER, messages TEXT, last_access REAL)"
+            )
+            self._db.execute("DELETE FROM sessions WHERE last_access < ?", (time.time() - self.spill_ttl,))
+            self._db.commit()
+        except sqlite3.Error as e:
+            print(f"会话存储 SQLite 文件打开失败，仅使用内存: {e}")
+            self._db = None
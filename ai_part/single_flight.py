@@ -0,0 +1,117 @@
+"""按用户串行处理消息：同一用户同时只有一条消息在调用大模型
+
+新消息到达时较早的处理被标记为过期：异步模式下直接取消其任务，
+线程模式下无法中断正在进行的调用，由处理流程在检查点（流式推送每段、发送回复前）放弃结果。
+新消息在较早的处理退出后才开始，其历史中已包含较早的消息，因此以合并后的上下文统一回复。
+"""
+import asyncio
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, Optional
+
+
+class RunSuperseded(Exception):
+    """处理因同一用户有更新的消息而中止"""
+
+
+class UserRun:
+    """一次消息处理；superseded 为True表示同一用户已有更新的消息"""
+
+    __slots__ = ("user_id", "generation", "superseded", "task")
+
+    def __init__(self, user_id: str, generation: int, task: Optional["asyncio.Task"] = None):
+        self.user_id = user_id
+        self.generation = generation
+        self.superseded = False
+        self.task = task
+
+
+class _UserState:
+    __slots__ = ("generation", "latest", "lock", "alock", "refs")
+
+    def __init__(self):
+        self.generation = 0
+        self.latest: Optional[UserRun] = None
+        self.lock = threading.Lock()
+        self.alock = asyncio.Lock()
+        self.refs = 0
+
+
+class SingleFlight:
+    """按用户串行执行，新的处理到达时让较早的处理作废"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users: Dict[str, _UserState] = {}
+        self._stats = {"runs": 0, "superseded": 0, "cancelled": 0, "skipped": 0, "dropped": 0}
+
+    @contextmanager
+    def run(self, user_id: str) -> Iterator[UserRun]:
+        """线程模式：作废较早的处理，等待其退出后开始本次处理"""
+        state, run = self._begin(user_id)
+        try:
+            with state.lock:
+                yield run
+        finally:
+            self._end(user_id, state)
+
+    @asynccontextmanager
+    async def arun(self, user_id: str) -> AsyncIterator[UserRun]:
+        """异步模式：取消较早的处理任务，等待其退出后开始本次处理
+
+        本次处理被更新的消息取消时抛出 RunSuperseded（其他原因的取消照常传播）
+        """
+        task = asyncio.current_task()
+        state, run = self._begin(user_id, task)
+        try:
+            async with state.alock:
+                yield run
+        except asyncio.CancelledError:
+            if not run.superseded:
+                raise
+            if hasattr(task, "uncancel"):
+                task.uncancel()
+            raise RunSuperseded(user_id) from None
+        finally:
+            self._end(user_id, state)
+
+    def skipped(self):
+        """开始前就已过期，没有调用大模型"""
+        with self._lock:
+            self._stats["skipped"] += 1
+
+    def dropped(self):
+        """调用完成后才发现过期，结果被丢弃"""
+        with self._lock:
+            self._stats["dropped"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+            stats["activeUsers"] = len(self._users)
+        return stats
+
+    def _begin(self, user_id: str, task: Optional["asyncio.Task"] = None):
+        with self._lock:
+            state = self._users.get(user_id)
+            if state is None:
+                state = self._users[user_id] = _UserState()
+            state.refs += 1
+            state.generation += 1
+            previous = state.latest
+            run = UserRun(user_id, state.generation, task)
+            state.latest = run
+            self._stats["runs"] += 1
+            if previous is not None and not previous.superseded:
+                previous.superseded = True
+                self._stats["superseded"] += 1
+                if previous.task is not None and not previous.task.done():
+                    previous.task.cancel()
+                    self._stats["cancelled"] += 1
+        return state, run
+
+    def _end(self, user_id: str, state: _UserState):
+        with self._lock:
+            state.refs -= 1
+            if state.refs == 0 and self._users.get(user_id) is state:
+                del self._users[user_id]
@@ -0,0 +1,201 @@
+"""流式回复：把大模型的流式输出按句切分，每凑满一句立即推送到server.js
+
+用户看到第一句话的时间（首段耗时）不再取决于整段回复的生成时间。
+"""
+import threading
+import time
+import unicodedata
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+SENTENCE_ENDINGS = "。！？!?\n"
+# 句末标点之后仍属于本句的字符（引号、括号、波浪号等，emoji另行判断）
+SENTENCE_CLOSERS = "」』”’)）~～"
+# 超长且没有句末标点时优先在这些位置断开
+SOFT_BREAKS = "，,；;、"
+
+# 一次回复的送达情况：全部送达 / 部分分段送达（用户已看到部分回复，不能重新生成） / 没有任何内容送达
+DELIVERED = "delivered"
+PARTIAL = "partial"
+UNDELIVERED = "none"
+
+
+def _is_closer(ch: str) -> bool:
+    return ch in SENTENCE_ENDINGS or ch in SENTENCE_CLOSERS or ch == "\ufe0f" or unicodedata.category(ch) == "So"
+
+
+class SentenceChunker:
+    """累积流式文本，按句末标点切出完整的句子，单段不超过 max_chars"""
+
+    def __init__(self, max_chars: int = 150):
+        self.max_chars = max_chars
+        self._buffer = ""
+
+    def feed(self, text: str) -> List[str]:
+        """追加文本，返回已经完整的段落"""
+        self._buffer += text
+        segments = []
+        while True:
+            cut = self._find_cut()
+            if cut is None:
+                break
+            segment, self._buffer = self._buffer[:cut].strip(), self._buffer[cut:]
+            if segment:
+                segments.append(segment)
+        return segments
+
+    def flush(self) -> List[str]:
+        """输出结束时返回剩余内容"""
+        segments = []
+        while self._buffer:
+            cut = self._find_cut(final=True) or len(self._buffer)
+            segment, self._buffer = self._buffer[:cut].strip(), self._buffer[cut:]
+            if segment:
+                segments.append(segment)
+        return segments
+
+    def _find_cut(self, final: bool = False) -> Optional[int]:
+        buffer = self._buffer
+        for i, ch in enumerate(buffer[:self.max_chars]):
+            if ch not in SENTENCE_ENDINGS:
+                continue
+            end = i + 1
+            while end < len(buffer) and _is_closer(buffer[end]):
+                end += 1
+            # 句末标点后面可能还有引号或emoji没有到达，等下一段文本再决定
+            if end < len(buffer) or final:
+                return min(end, self.max_chars)
+            return None
+        if len(buffer) <= self.max_chars:
+            return None
+        soft = max(buffer.rfind(ch, 0, self.max_chars) for ch in SOFT_BREAKS)
+        return soft + 1 if soft > 0 else self.max_chars
+
+
+class StreamMetrics:
+    """流式回复指标：首段耗时与完整回复耗时"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {"streams": 0, "segments": 0, "sendFailures": 0}
+        # 只保留最近1000次回复的耗时
+        self._first_ms: "deque[float]" = deque(maxlen=1000)
+        self._total_ms: "deque[float]" = deque(maxlen=1000)
+
+    def record(self, segments: int, first_segment_s: Optional[float], total_s: float, failures: int):
+        with self._lock:
+            self._stats["streams"] += 1
+            self._stats["segments"] += segments
+            self._stats["sendFailures"] += failures
+            if first_segment_s is not None:
+                self._first_ms.append(first_segment_s * 1000)
+            self._total_ms.append(total_s * 1000)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+            first_ms, total_ms = list(self._first_ms), list(self._total_ms)
+        stats["timeToFirstSegment"] = _summarize(first_ms)
+        stats["timeToComplete"] = _summarize(total_ms)
+        return stats
+
+
+def _summarize(samples: List[float]) -> Dict[str, float]:
+    """最近1000次的平均值和p95（毫秒）"""
+    if not samples:
+        return {"avgMs": 0.0, "p95Ms": 0.0}
+    ordered = sorted(samples)
+    return {
+        "avgMs": round(sum(ordered) / len(ordered), 2),
+        "p95Ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 2),
+    }
+
+
+class ReplyStream:
+    """一次回复的流式发送：逐段推送，结束时发送 final 标记并记录耗时
+
+    send / asend 签名为 (文本, 是否最后一段, 序号, 是否已取消) -> 是否发送成功，序号从0开始逐段递增（含 final），
+    接收方据此丢弃重试造成的重复分段；cancelled 返回True时调用方应停止生成
+    """
+
+    def __init__(self, metrics: StreamMetrics, max_chars: int = 150,
+                 send: Optional[Callable[[str, bool, int, bool], bool]] = None,
+                 asend: Optional[Callable[[str, bool, int, bool], Awaitable[bool]]] = None,
+                 cancelled: Optional[Callable[[], bool]] = None):
+        self.metrics = metrics
+        self.cancelled = cancelled or (lambda: False)
+        self.chunker = SentenceChunker(max_chars)
+        self.send = send
+        self.asend = asend
+        self.started = time.perf_counter()
+        self.first_segment: Optional[float] = None
+        self.segments = 0
+        self.failures = 0
+        self.delivered = 0  # 成功送达的分段数
+        self.seq = 0  # 下一段的序号
+        self.completed = False  # 大模型输出已完整推送
+
+    def push(self, text: str):
+        for segment in self.chunker.feed(text):
+            self._sent(self.send(segment, False, self._next_seq(), False))
+
+    def close(self):
+        """大模型输出结束，推送剩余内容"""
+        for segment in self.chunker.flush():
+            self._sent(self.send(segment, False, self._next_seq(), False))
+        self.completed = True
+
+    def finish(self, tail: str = "") -> str:
+        """发送 final 标记（可附带最后一段文本），返回送达情况 DELIVERED / PARTIAL / UNDELIVERED"""
+        ok = self.send(tail, True, self._next_seq(), False)
+        self._record(ok)
+        return self._delivery(ok, tail)
+
+    def abort(self) -> bool:
+        """回复被放弃（如有更新的消息）：发送带取消标记的 final，让接收方结束已开始的回复"""
+        ok = self.send("", True, self._next_seq(), True)
+        self._record(ok)
+        return ok
+
+    async def apush(self, text: str):
+        for segment in self.chunker.feed(text):
+            self._sent(await self.asend(segment, False, self._next_seq(), False))
+
+    async def aclose(self):
+        for segment in self.chunker.flush():
+            self._sent(await self.asend(segment, False, self._next_seq(), False))
+        self.completed = True
+
+    async def afinish(self, tail: str = "") -> str:
+        ok = await self.asend(tail, True, self._next_seq(), False)
+        self._record(ok)
+        return self._delivery(ok, tail)
+
+    async def aabort(self) -> bool:
+        ok = await self.asend("", True, self._next_seq(), True)
+        self._record(ok)
+        return ok
+
+    def _next_seq(self) -> int:
+        seq, self.seq = self.seq, self.seq + 1
+        return seq
+
+    def _sent(self, ok: bool):
+        self.segments += 1
+        if ok:
+            self.delivered += 1
+        else:
+            self.failures += 1
+        if self.first_segment is None:
+            self.first_segment = time.perf_counter() - self.started
+            print(f"首段回复已发送，耗时 {self.first_segment * 1000:.0f}ms")
+
+    def _delivery(self, final_ok: bool, tail: str) -> str:
+        if final_ok and not self.failures:
+            return DELIVERED
+        delivered = self.delivered + (1 if final_ok and tail else 0)
+        return PARTIAL if delivered else UNDELIVERED
+
+    def _record(self, ok: bool):
+        self.metrics.record(self.segments, self.first_segment, time.perf_counter() - self.started,
+                            self.failures + (0 if ok else 1))
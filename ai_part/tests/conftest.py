@@ -0,0 +1,5 @@
+"""测试从 ai_part 目录导入各模块（与服务运行时的工作目录一致）"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,94 @@
+import random
+import zipfile
+
+import py7zr
+import pytest
+
+import archive_inspect
+from archive_inspect import (
+    ArchiveBudget,
+    ArchiveLimitExceeded,
+    ArchiveLimits,
+    inspect_archive,
+    open_archive,
+    safe_member_path,
+)
+
+MB = 1024 * 1024
+LIMITS = ArchiveLimits(max_total_bytes=8 * MB, max_members=20, max_member_bytes=4 * MB, max_ratio=100, timeout=30)
+
+
+@pytest.fixture(autouse=True)
+def limits(monkeypatch):
+    monkeypatch.setattr(archive_inspect, "ARCHIVE_LIMITS", LIMITS)
+
+
+def make_zip(path, members):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return str(path)
+
+
+def test_zip_bomb_is_rejected_before_extraction(tmp_path):
+    bomb = make_zip(tmp_path / "bomb.zip", {"zeros.bin": b"\0" * (3 * MB)})
+    work_dir = tmp_path / "work"
+    with pytest.raises(ArchiveLimitExceeded, match="压缩比"):
+        inspect_archive(bomb, ".zip", str(work_dir), 0)
+    assert not work_dir.exists() or not any(work_dir.iterdir())
+
+
+def test_7z_bomb_is_rejected(tmp_path):
+    bomb = tmp_path / "bomb.7z"
+    with py7zr.SevenZipFile(bomb, "w") as archive:
+        archive.writestr(b"\0" * (3 * MB), "zeros.bin")
+    with pytest.raises(ArchiveLimitExceeded):
+        inspect_archive(str(bomb), ".7z", str(tmp_path / "work"), 0)
+
+
+def test_member_count_and_sizes_are_checked_from_metadata(tmp_path):
+    many = make_zip(tmp_path / "many.zip", {f"{i}.txt": b"x" for i in range(LIMITS.max_members + 1)})
+    with pytest.raises(ArchiveLimitExceeded, match="文件数量"):
+        inspect_archive(many, ".zip", str(tmp_path / "w1"), 0)
+
+    budget = ArchiveBudget(LIMITS)
+    with pytest.raises(ArchiveLimitExceeded, match="单个文件上限"):
+        budget.check_members([archive_inspect.ArchiveMember("big.bin", 5 * MB, 5 * MB)])
+    with pytest.raises(ArchiveLimitExceeded, match="总大小"):
+        budget.check_members([archive_inspect.ArchiveMember(f"{i}.bin", 3 * MB, 3 * MB) for i in range(3)])
+
+
+def test_streamed_bytes_are_counted_when_metadata_lies(tmp_path):
+    """元数据可能被伪造：不经元数据检查直接读取时，实际解压的字节同样逐块计入预算"""
+    archive = make_zip(tmp_path / "a.zip", {"a.bin": random.Random(0).randbytes(2 * MB)})  # 不可压缩
+    strict = ArchiveLimits(max_total_bytes=8 * MB, max_members=20, max_member_bytes=MB, max_ratio=100, timeout=30)
+    with open_archive(archive, ".zip", ArchiveBudget(strict)) as reader:
+        with pytest.raises(ArchiveLimitExceeded, match="单个文件上限"):
+            reader.read_prefixes(["a.bin"], None)
+
+    budget = ArchiveBudget(LIMITS)
+    budget.consume("a.bin", 3 * MB, 3 * MB)
+    budget.consume("b.bin", 3 * MB, 3 * MB)
+    with pytest.raises(ArchiveLimitExceeded, match="解压数据量"):
+        budget.consume("c.bin", 3 * MB, 3 * MB)
+
+
+def test_small_repetitive_text_is_allowed(tmp_path):
+    archive = make_zip(tmp_path / "notes.zip", {"notes.txt": "重复的说明文字\n".encode() * 2000})
+    inspection = inspect_archive(archive, ".zip", str(tmp_path / "work"), 0)
+    assert inspection.file_count == 1
+    assert inspection.text_files_content
+
+
+def test_time_budget(tmp_path):
+    budget = ArchiveBudget(LIMITS._replace(timeout=0))
+    with pytest.raises(ArchiveLimitExceeded, match="处理时间"):
+        budget.check_time()
+
+
+def test_member_paths_stay_inside_root(tmp_path):
+    assert safe_member_path(tmp_path, "../../etc/passwd") == tmp_path / "etc" / "passwd"
+    assert safe_member_path(tmp_path, "/abs/file.txt") == tmp_path / "abs" / "file.txt"
+    assert safe_member_path(tmp_path, "dir\\..\\x.txt") == tmp_path / "dir" / "x.txt"
+    with pytest.raises(ValueError):
+        safe_member_path(tmp_path, "../")
@@ -0,0 +1,87 @@
+import time
+from pathlib import Path
+
+from download_cache import DownloadCache
+
+URL = "http://part1:3000/uploads/a.txt"
+
+
+def store(cache, url, data, **headers):
+    writer = cache.open_writer(url, 1024 * 1024)
+    writer.write(data)
+    return writer.commit(headers)
+
+
+def expire(cache, url):
+    cache._entries[url]["fetchedAt"] = time.time() - cache.fresh_seconds - 1
+
+
+def test_fresh_entry_is_served_without_revalidation(tmp_path):
+    cache = DownloadCache(tmp_path, max_bytes=1024 * 1024, fresh_seconds=60)
+    path = store(cache, URL, b"hello world", ETag='"v1"')
+    cache.release(path)
+    fresh = cache.get_fresh(URL)
+    assert fresh == path
+    assert Path(fresh).read_bytes() == b"hello world"
+    cache.release(fresh)
+
+
+def test_stale_entry_sends_validators_and_304_refreshes(tmp_path):
+    cache = DownloadCache(tmp_path, max_bytes=1024 * 1024, fresh_seconds=60)
+    cache.release(store(cache, URL, b"hello world", ETag='"v1"', **{"Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"}))
+    expire(cache, URL)
+
+    assert cache.get_fresh(URL) is None
+    assert cache.validation_headers(URL) == {
+        "If-None-Match": '"v1"',
+        "If-Modified-Since": "Mon, 01 Jan 2024 00:00:00 GMT",
+    }
+    path = cache.revalidated(URL)
+    assert Path(path).read_bytes() == b"hello world"
+    cache.release(path)
+    # 304 之后重新进入新鲜期
+    fresh = cache.get_fresh(URL)
+    assert fresh == path
+    cache.release(fresh)
+    assert cache.stats()["revalidated"] == 1
+
+
+def test_changed_content_replaces_old_file(tmp_path):
+    cache = DownloadCache(tmp_path, max_bytes=1024 * 1024, fresh_seconds=60)
+    old = store(cache, URL, b"version one", ETag='"v1"')
+    cache.release(old)
+    expire(cache, URL)
+    new = store(cache, URL, b"version two", ETag='"v2"')
+    cache.release(new)
+    assert new != old
+    assert not Path(old).exists()
+    assert cache.validation_headers(URL) == {"If-None-Match": '"v2"'}
+
+
+def test_missing_file_is_not_revalidated(tmp_path):
+    cache = DownloadCache(tmp_path, max_bytes=1024 * 1024, fresh_seconds=60)
+    path = store(cache, URL, b"hello world", ETag='"v1"')
+    cache.release(path)
+    Path(path).unlink()
+    assert cache.validation_headers(URL) == {}
+    assert cache.revalidated(URL) is None
+
+
+def test_pinned_file_survives_eviction_until_released(tmp_path):
+    cache = DownloadCache(tmp_path, max_bytes=15, fresh_seconds=60)
+    first = store(cache, URL, b"0123456789")
+    second = store(cache, "http://part1:3000/uploads/b.txt", b"abcdefghij")
+    # 第一个文件已被淘汰出索引，但仍在使用中
+    assert cache.lookup(URL) is None
+    assert Path(first).exists()
+    cache.release(first)
+    assert not Path(first).exists()
+    cache.release(second)
+    assert Path(second).exists()
+
+
+def test_index_survives_restart(tmp_path):
+    cache = DownloadCache(tmp_path, max_bytes=1024 * 1024, fresh_seconds=60)
+    cache.release(store(cache, URL, b"hello world", ETag='"v1"'))
+    reopened = DownloadCache(tmp_path, max_bytes=1024 * 1024, fresh_seconds=60)
+    assert reopened.validation_headers(URL) == {"If-None-Match": '"v1"'}
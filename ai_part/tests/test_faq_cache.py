@@ -0,0 +1,70 @@
+import time
+
+from faq_cache import FAQCache, normalize_text, tokenize
+
+
+def test_normalization_folds_width_case_and_punctuation():
+    assert normalize_text("ＩＰｈｏｎｅ　15  Pro？！") == "iphone 15 pro"
+    assert tokenize("怎么退货") == frozenset({"怎么", "么退", "退货"})
+    assert tokenize("iphone 15 pro") == frozenset({"iphone", "15", "pro"})
+
+
+def test_exact_hit_after_normalization():
+    cache = FAQCache(threshold=0.8)
+    cache.store("怎么退货？", "7天内可以无理由退货")
+    assert cache.lookup("怎么退货!") == ("7天内可以无理由退货", "exact", 1.0)
+
+
+def test_similar_wording_hits_above_threshold():
+    cache = FAQCache(threshold=0.6)
+    cache.store("你们支持七天无理由退货吗", "支持七天无理由退货")
+    reply, kind, score = cache.lookup("请问支持七天无理由退货吗")
+    assert (reply, kind) == ("支持七天无理由退货", "similar")
+    assert 0.6 <= score < 1.0
+    assert cache.lookup("你们的运费怎么算") is None
+
+
+def test_model_numbers_must_match_exactly():
+    cache = FAQCache(threshold=0.5)
+    cache.store("iPhone 15 Pro 多少钱", "iPhone 15 Pro 售价7999元")
+    assert cache.lookup("iphone 15 pro多少钱")[0] == "iPhone 15 Pro 售价7999元"
+    assert cache.lookup("iPhone 15 Pro Max 多少钱") is None
+    assert cache.lookup("iPhone 14 Pro 多少钱") is None
+
+
+def test_long_messages_are_not_cached():
+    cache = FAQCache(max_message_chars=10)
+    cache.store("这是一条超过长度上限的很长很长的消息", "回复")
+    assert cache.stats()["entries"] == 0
+    assert cache.lookup("这是一条超过长度上限的很长很长的消息") is None
+
+
+def test_version_change_invalidates_entries():
+    cache = FAQCache()
+    cache.set_version("v1")
+    cache.store("怎么退货", "7天内可以退货")
+    cache.set_version("v1")
+    assert cache.lookup("怎么退货") is not None
+    cache.set_version("v2")
+    assert cache.lookup("怎么退货") is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_expired_entries_do_not_match(monkeypatch):
+    cache = FAQCache(ttl=60)
+    cache.store("怎么退货", "7天内可以退货")
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    assert cache.lookup("怎么退货") is None
+
+
+def test_eviction_keeps_index_consistent():
+    cache = FAQCache(max_entries=2)
+    cache.store("怎么退货", "退货")
+    cache.store("怎么换货", "换货")
+    cache.lookup("怎么退货")
+    cache.store("运费多少", "运费")
+    assert cache.lookup("怎么换货") is None
+    assert cache.lookup("怎么退货")[0] == "退货"
+    indexed = set().union(*cache._index.values())
+    assert indexed == set(cache._entries)
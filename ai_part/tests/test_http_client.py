@@ -0,0 +1,123 @@
+import asyncio
+import io
+import time
+
+import httpx
+import pytest
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+import http_client
+
+
+class FakeSession:
+    """按顺序返回预设结果（异常或状态码）的 requests.Session 替身"""
+
+    def __init__(self, *outcomes, delay=0.0):
+        self.outcomes = list(outcomes)
+        self.delay = delay
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        self.calls.append(kwargs)
+        time.sleep(self.delay)
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        response = requests.Response()
+        response.status_code = outcome
+        response.raw = io.BytesIO(b"")
+        return response
+
+
+@pytest.fixture
+def session(monkeypatch):
+    monkeypatch.setattr(http_client, "_backoff_delay", lambda attempt: 0)
+
+    def install(*outcomes, delay=0.0):
+        fake = FakeSession(*outcomes, delay=delay)
+        monkeypatch.setattr(http_client, "get_session", lambda: fake)
+        return fake
+
+    return install
+
+
+def connect_error():
+    # requests 抛出的连接错误包装着 urllib3 的 MaxRetryError，reason 为建立连接时的错误
+    return requests.ConnectionError(MaxRetryError(None, "/", NewConnectionError(None, "拒绝连接")))
+
+
+def test_get_retries_read_timeout_and_5xx(session):
+    fake = session(requests.ReadTimeout("读取超时"), 503, 200)
+    assert http_client.request("GET", "http://part1/file").status_code == 200
+    assert len(fake.calls) == 3
+
+
+def test_post_is_not_retried_after_it_may_have_been_processed(session):
+    fake = session(requests.ReadTimeout("读取超时"), 200)
+    with pytest.raises(requests.ReadTimeout):
+        http_client.request("POST", "http://part1/api/ai/reply", json={})
+    assert len(fake.calls) == 1
+
+    fake = session(502, 200)
+    assert http_client.request("POST", "http://part1/api/ai/reply", json={}).status_code == 502
+    assert len(fake.calls) == 1
+
+
+def test_post_is_retried_when_connection_was_never_made(session):
+    fake = session(connect_error(), requests.ConnectTimeout("连接超时"), 200)
+    assert http_client.request("POST", "http://part1/api/ai/reply", json={}).status_code == 200
+    assert len(fake.calls) == 3
+
+
+def test_idempotent_post_is_retried(session):
+    fake = session(requests.ReadTimeout("读取超时"), 200)
+    response = http_client.request("POST", "http://part1/api/ai/reply", idempotent=True, json={})
+    assert response.status_code == 200
+    assert len(fake.calls) == 2
+
+
+def test_retries_stop_at_limit(session, monkeypatch):
+    monkeypatch.setattr(http_client, "HTTP_MAX_RETRIES", 2)
+    fake = session(503, 503, 503, 200)
+    assert http_client.request("GET", "http://part1/file").status_code == 503
+    assert len(fake.calls) == 3
+
+
+def test_deadline_clamps_timeout_and_stops_retrying(session):
+    # 第一次请求耗尽了剩余时间，读取超时后不再重试
+    fake = session(requests.ReadTimeout("读取超时"), 200, delay=0.2)
+    with pytest.raises(requests.Timeout):
+        http_client.request("GET", "http://part1/file", deadline=time.monotonic() + 0.1, timeout=(3, 10))
+    assert len(fake.calls) == 1
+    connect_timeout, read_timeout = fake.calls[0]["timeout"]
+    assert connect_timeout <= 0.1 and read_timeout <= 0.1
+
+    fake = session(200)
+    with pytest.raises(requests.Timeout):
+        http_client.request("GET", "http://part1/file", deadline=time.monotonic() - 1)
+    assert fake.calls == []
+
+
+def test_async_post_is_not_retried_after_read_timeout(monkeypatch):
+    monkeypatch.setattr(http_client, "_backoff_delay", lambda attempt: 0)
+    calls = []
+
+    def handler(request):
+        calls.append(request.method)
+        if len(calls) == 1:
+            raise httpx.ReadTimeout("读取超时", request=request)
+        return httpx.Response(200)
+
+    async def scenario():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        monkeypatch.setattr(http_client, "get_async_client", lambda: client)
+        with pytest.raises(httpx.ReadTimeout):
+            await http_client.arequest("POST", "http://part1/api/ai/reply", json={})
+        calls.clear()
+        response = await http_client.arequest("GET", "http://part1/file")
+        await client.aclose()
+        return response.status_code
+
+    assert asyncio.run(scenario()) == 200
+    assert calls == ["GET", "GET"]
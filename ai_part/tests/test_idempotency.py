@@ -0,0 +1,102 @@
+import asyncio
+import threading
+
+import pytest
+
+from idempotency import IdempotencyPending, IdempotencyStore
+
+
+def test_duplicate_replays_saved_result():
+    store = IdempotencyStore()
+    calls = []
+    result, duplicate = store.run("k", lambda: calls.append(1) or {"success": True, "reply": "好的"})
+    assert not duplicate
+    replay, duplicate = store.run("k", lambda: calls.append(1) or {"success": True, "reply": "另一份"})
+    assert duplicate and replay == result
+    assert len(calls) == 1
+
+
+def test_result_not_kept_is_executed_again():
+    store = IdempotencyStore()
+    keep = lambda result: result["success"]
+    store.run("k", lambda: {"success": False}, keep=keep)
+    result, duplicate = store.run("k", lambda: {"success": True}, keep=keep)
+    assert not duplicate and result == {"success": True}
+    assert store.run("k", lambda: {"success": False}, keep=keep) == ({"success": True}, True)
+
+
+def test_discarded_result_is_executed_again():
+    """异步模式：入队结果已保存，后台任务随后失败时，重复投递重新入队"""
+    store = IdempotencyStore()
+    failed_jobs = set()
+    discard = lambda saved: saved["jobId"] in failed_jobs
+
+    store.run("k", lambda: {"jobId": "job-1"}, discard=discard)
+    assert store.run("k", lambda: {"jobId": "job-2"}, discard=discard) == ({"jobId": "job-1"}, True)
+    failed_jobs.add("job-1")
+    assert store.run("k", lambda: {"jobId": "job-2"}, discard=discard) == ({"jobId": "job-2"}, False)
+    assert store.stats()["discards"] == 1
+
+
+def test_exception_is_not_saved():
+    store = IdempotencyStore()
+
+    def boom():
+        raise RuntimeError("发送失败")
+
+    with pytest.raises(RuntimeError):
+        store.run("k", boom)
+    assert store.run("k", lambda: "ok") == ("ok", False)
+    assert store.stats()["failures"] == 1
+
+
+def test_concurrent_duplicate_waits_for_original():
+    store = IdempotencyStore(wait_timeout=2)
+    started, release = threading.Event(), threading.Event()
+    results = []
+
+    def original():
+        started.set()
+        release.wait()
+        return "回复"
+
+    thread = threading.Thread(target=lambda: results.append(store.run("k", original)))
+    thread.start()
+    started.wait()
+    waiter = threading.Thread(target=lambda: results.append(store.run("k", lambda: "重复执行")))
+    waiter.start()
+    release.set()
+    thread.join()
+    waiter.join()
+    assert sorted(results) == [("回复", False), ("回复", True)]
+
+
+def test_duplicate_wait_times_out():
+    store = IdempotencyStore(wait_timeout=0.05)
+    started, release = threading.Event(), threading.Event()
+    thread = threading.Thread(target=lambda: store.run("k", lambda: started.set() or release.wait()))
+    thread.start()
+    started.wait()
+    with pytest.raises(IdempotencyPending):
+        store.run("k", lambda: "重复执行")
+    release.set()
+    thread.join()
+
+
+def test_async_keep_and_discard():
+    async def scenario():
+        store = IdempotencyStore()
+
+        async def failed():
+            return {"success": False}
+
+        async def succeeded():
+            return {"success": True}
+
+        keep = lambda result: result["success"]
+        await store.arun("k", failed, keep=keep)
+        assert await store.arun("k", succeeded, keep=keep) == ({"success": True}, False)
+        assert await store.arun("k", failed, keep=keep) == ({"success": True}, True)
+        assert await store.arun("k", failed, discard=lambda saved: True) == ({"success": False}, False)
+
+    asyncio.run(scenario())
@@ -0,0 +1,91 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from jobs import AsyncJobQueue, JobQueue, JobQueueFull, job_outcome
+
+
+def wait_for_status(queue, job_id, status, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job["status"] == status:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"任务状态 {queue.get(job_id)['status']}，预期 {status}")
+
+
+def test_job_outcome_marks_unsuccessful_result_failed():
+    assert job_outcome({"success": True})["status"] == "succeeded"
+    assert job_outcome("ok")["status"] == "succeeded"
+    outcome = job_outcome({"success": False, "error": "回复未送达"})
+    assert outcome["status"] == "failed"
+    assert outcome["error"] == "回复未送达"
+
+
+def test_job_moves_from_queued_to_running_to_succeeded():
+    queue = JobQueue(worker_count=1)
+    release = threading.Event()
+    job_id = queue.submit(release.wait, meta={"userId": "u1"})
+    job = wait_for_status(queue, job_id, "running")
+    assert job["userId"] == "u1"
+    assert job["startedAt"] is not None
+    release.set()
+    job = wait_for_status(queue, job_id, "succeeded")
+    assert job["result"] is True
+    assert job["finishedAt"] is not None
+
+
+def test_job_failures_are_recorded():
+    queue = JobQueue(worker_count=1)
+
+    def boom():
+        raise RuntimeError("模型不可用")
+
+    failed = queue.submit(boom)
+    unsent = queue.submit(lambda: {"success": False})
+    assert wait_for_status(queue, failed, "failed")["error"] == "模型不可用"
+    assert wait_for_status(queue, unsent, "failed")["result"] == {"success": False}
+
+
+def test_full_queue_rejects_and_forgets_job():
+    queue = JobQueue(worker_count=1, max_queue_size=1)
+    release = threading.Event()
+    running = queue.submit(release.wait)
+    wait_for_status(queue, running, "running")
+    queue.submit(release.wait)
+    with pytest.raises(JobQueueFull):
+        queue.submit(release.wait)
+    assert sum(queue.stats()["jobs"].values()) == 2
+    release.set()
+
+
+def test_async_queue_cancel_while_waiting_releases_counter():
+    async def scenario():
+        queue = AsyncJobQueue(worker_count=1)
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return {"success": True}
+
+        queue.submit(work)
+        queued = queue.submit(work)
+        await asyncio.sleep(0)
+        assert queue.stats()["queueDepth"] == 1
+        tasks = list(queue._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        assert queue.stats()["queueDepth"] == 0
+        assert queue.get(queued)["status"] == "failed"
+
+        # 取消后信号量已归还，新任务可以正常执行
+        release.set()
+        third = queue.submit(work)
+        await asyncio.gather(*queue._tasks)
+        assert queue.get(third)["status"] == "succeeded"
+
+    asyncio.run(scenario())
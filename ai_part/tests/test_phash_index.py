@@ -0,0 +1,100 @@
+import io
+import random
+
+from PIL import Image, ImageDraw
+
+from phash_index import PerceptualHashIndex, dhash, hamming_distance, is_informative
+
+
+def flip_bits(value, bits):
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+
+def sample_image():
+    img = Image.new("RGB", (320, 240), "white")
+    draw = ImageDraw.Draw(img)
+    for i in range(8):
+        draw.rectangle((i * 40, i * 20, i * 40 + 30, i * 20 + 60), fill=(i * 30, 255 - i * 30, 120))
+    draw.ellipse((60, 40, 220, 200), outline="black", width=6)
+    return img
+
+
+def test_dhash_is_stable_across_resize_and_recompression():
+    img = sample_image()
+    buffer = io.BytesIO()
+    img.resize((160, 120)).save(buffer, "JPEG", quality=60)
+    recompressed = Image.open(io.BytesIO(buffer.getvalue()))
+    assert hamming_distance(dhash(img), dhash(recompressed)) <= 6
+    assert is_informative(dhash(img), 8)
+    assert not is_informative(dhash(Image.new("RGB", (64, 64), "white")), 8)
+
+
+def test_lookup_finds_hashes_within_distance():
+    index = PerceptualHashIndex(max_distance=6)
+    base = random.Random(1).getrandbits(64)
+    index.add(base, "原图分析", scope="u1")
+
+    assert index.lookup(base, scope="u1") == ("原图分析", 0)
+    # 6 位差异集中在同一段内也能找到
+    assert index.lookup(flip_bits(base, range(6)), scope="u1") == ("原图分析", 6)
+    assert index.lookup(flip_bits(base, [0, 17, 33, 50]), scope="u1") == ("原图分析", 4)
+    assert index.lookup(flip_bits(base, range(0, 63, 9)), scope="u1") is None
+
+
+def test_lookup_matches_brute_force_nearest():
+    rng = random.Random(7)
+    index = PerceptualHashIndex(max_distance=6)
+    stored = {}
+    for i in range(300):
+        value = rng.getrandbits(64)
+        stored[value] = i
+        index.add(value, i)
+        # 制造近似重复的条目
+        near = flip_bits(value, rng.sample(range(64), rng.randint(1, 8)))
+        stored[near] = f"{i}-near"
+        index.add(near, f"{i}-near")
+
+    for _ in range(300):
+        query = flip_bits(rng.choice(list(stored)), rng.sample(range(64), rng.randint(0, 8)))
+        best = min(stored, key=lambda value: hamming_distance(query, value))
+        expected = hamming_distance(query, best)
+        found = index.lookup(query)
+        if expected > 6:
+            assert found is None
+        else:
+            assert found is not None and found[1] == expected
+
+
+def test_scopes_are_isolated():
+    index = PerceptualHashIndex(max_distance=6)
+    value = random.Random(2).getrandbits(64)
+    index.add(value, "用户1的订单截图", scope="u1")
+    assert index.lookup(value, scope="u2") is None
+    assert index.lookup(flip_bits(value, [3]), scope="u2") is None
+    assert index.lookup(flip_bits(value, [3]), scope="u1") == ("用户1的订单截图", 1)
+
+
+def test_accept_filters_candidates():
+    index = PerceptualHashIndex(max_distance=6)
+    value = random.Random(3).getrandbits(64)
+    index.add(value, (100, 100, "方图"))
+    index.add(flip_bits(value, [1, 2]), (400, 100, "宽图"))
+    found = index.lookup(flip_bits(value, [1]), accept=lambda entry: entry[0] == 400)
+    assert found == ((400, 100, "宽图"), 1)
+
+
+def test_eviction_removes_bucket_entries():
+    index = PerceptualHashIndex(max_entries=2, max_distance=6)
+    rng = random.Random(4)
+    first, second, third = (rng.getrandbits(64) for _ in range(3))
+    index.add(first, 1, scope="u1")
+    index.add(second, 2, scope="u1")
+    index.lookup(first, scope="u1")  # first 最近使用过，淘汰 second
+    index.add(third, 3, scope="u1")
+    assert index.lookup(second, scope="u1") is None
+    assert index.lookup(first, scope="u1") == (1, 0)
+    keys = set().union(*(key_set for bucket in index._buckets for key_set in bucket.values()))
+    assert keys == {("u1", first), ("u1", third)}
+    assert index.stats()["evictions"] == 1
@@ -0,0 +1,91 @@
+import pytest
+
+from sessions import SessionMismatch, SessionStore
+
+
+def msgs(*texts):
+    return [{"userType": "customer", "message": text} for text in texts]
+
+
+def texts(history):
+    return [message["message"] for message in history]
+
+
+def test_deltas_append_to_session():
+    store = SessionStore()
+    history, ack = store.apply("u1", "c1", 0, msgs("你好", "在吗"))
+    assert texts(history) == ["你好", "在吗"] and ack == 2
+    history, ack = store.apply("u1", "c1", 2, msgs("耳机多少钱"))
+    assert texts(history) == ["你好", "在吗", "耳机多少钱"] and ack == 3
+
+
+def test_redelivered_delta_replaces_overlap():
+    store = SessionStore()
+    store.apply("u1", "c1", 0, msgs("a", "b"))
+    store.apply("u1", "c1", 2, msgs("c"))
+    history, ack = store.apply("u1", "c1", 2, msgs("c", "d"))
+    assert texts(history) == ["a", "b", "c", "d"] and ack == 4
+
+
+def test_gap_requires_resync_from_end():
+    store = SessionStore()
+    store.apply("u1", "c1", 0, msgs("a", "b"))
+    with pytest.raises(SessionMismatch) as error:
+        store.apply("u1", "c1", 5, msgs("f"))
+    assert error.value.conversation_id == "c1"
+    assert error.value.expected_index == 2
+    assert store.stats()["mismatches"] == 1
+
+
+def test_unknown_session_requires_full_resync():
+    """AI服务重启后丢失会话：增量请求返回 409，server.js 随后发送完整历史"""
+    store = SessionStore()
+    with pytest.raises(SessionMismatch) as error:
+        store.apply("u1", "c1", 3, msgs("d"))
+    assert error.value.expected_index == 0
+
+    history, ack = store.apply("u1", "c1", 0, msgs("a", "b", "c", "d"), resync=True)
+    assert texts(history) == ["a", "b", "c", "d"] and ack == 4
+    history, ack = store.apply("u1", "c1", 4, msgs("e"))
+    assert ack == 5
+
+
+def test_new_conversation_id_starts_over():
+    store = SessionStore()
+    store.apply("u1", "c1", 0, msgs("a", "b"))
+    with pytest.raises(SessionMismatch):
+        store.apply("u1", "c2", 2, msgs("c"))
+    history, ack = store.apply("u1", "c2", 0, msgs("x"))
+    assert texts(history) == ["x"] and ack == 1
+
+
+def test_trimmed_session_keeps_absolute_indices():
+    store = SessionStore(max_messages=8)
+    history, ack = store.apply("u1", "c1", 0, msgs(*map(str, range(10))))
+    # 超出上限时多裁掉 1/4，序号仍按 server.js 的绝对位置确认
+    assert ack == 10
+    assert texts(history) == [str(i) for i in range(4, 10)]
+    history, ack = store.apply("u1", "c1", 10, msgs("10"))
+    assert ack == 11 and texts(history)[-1] == "10"
+    with pytest.raises(SessionMismatch) as error:
+        store.apply("u1", "c1", 1, msgs("1"))
+    assert error.value.expected_index == 11
+
+
+def test_evicted_sessions_reload_from_sqlite(tmp_path):
+    store = SessionStore(max_sessions=1, persist_path=str(tmp_path / "sessions.db"))
+    store.apply("u1", "c1", 0, msgs("a", "b"))
+    store.apply("u2", "c9", 0, msgs("x"))
+    assert store.stats()["sessions"] == 1
+    history, ack = store.apply("u1", "c1", 2, msgs("c"))
+    assert texts(history) == ["a", "b", "c"] and ack == 3
+    assert store.stats()["loaded"] == 1
+
+
+def test_evicted_sessions_without_persistence_need_resync():
+    store = SessionStore(max_sessions=1)
+    store.apply("u1", "c1", 0, msgs("a", "b"))
+    store.apply("u2", "c9", 0, msgs("x"))
+    with pytest.raises(SessionMismatch) as error:
+        store.apply("u1", "c1", 2, msgs("c"))
+    assert error.value.expected_index == 0
@@ -0,0 +1,127 @@
+import asyncio
+
+from streaming import DELIVERED, PARTIAL, UNDELIVERED, ReplyStream, SentenceChunker, StreamMetrics
+
+
+class Receiver:
+    """模拟 server.js：按 (replyId, seq) 丢弃重复的分段，可指定某些序号发送失败"""
+
+    def __init__(self, fail_seqs=()):
+        self.fail_seqs = set(fail_seqs)
+        self.calls = []
+        self.shown = []
+        self.last_seq = -1
+        self.closed = False
+        self.cancelled = False
+
+    def send(self, text, final, seq, cancelled):
+        self.calls.append((text, final, seq, cancelled))
+        if seq in self.fail_seqs:
+            return False
+        if seq <= self.last_seq:
+            return True
+        self.last_seq = seq
+        if text:
+            self.shown.append(text)
+        if final:
+            self.closed = True
+            self.cancelled = cancelled
+        return True
+
+
+def new_stream(receiver, max_chars=20):
+    return ReplyStream(StreamMetrics(), max_chars=max_chars, send=receiver.send)
+
+
+def test_chunker_splits_on_sentence_end_and_keeps_closers():
+    chunker = SentenceChunker(max_chars=50)
+    assert chunker.feed("您好！这款耳机") == ["您好！"]
+    assert chunker.feed("售价299元。」好") == ["这款耳机售价299元。」"]
+    assert chunker.flush() == ["好"]
+
+
+def test_segments_carry_increasing_seq_including_final():
+    receiver = Receiver()
+    stream = new_stream(receiver)
+    stream.push("第一句。第二句。")
+    stream.close()
+    assert stream.finish() == DELIVERED
+    assert [call[2] for call in receiver.calls] == [0, 1, 2]
+    assert receiver.calls[-1] == ("", True, 2, False)
+    assert receiver.shown == ["第一句。", "第二句。"]
+
+
+def test_retried_segment_is_deduplicated_by_seq():
+    receiver = Receiver()
+    stream = new_stream(receiver)
+    stream.push("第一句。第二")
+    # 读超时后重试同一分段：序号相同，接收方只显示一次
+    receiver.send("第一句。", False, 0, False)
+    stream.close()
+    stream.finish()
+    assert receiver.shown == ["第一句。", "第二"]
+
+
+def test_delivery_states():
+    receiver = Receiver(fail_seqs={1})
+    stream = new_stream(receiver)
+    stream.push("第一句。第二句。")
+    stream.close()
+    assert stream.finish() == PARTIAL
+
+    receiver = Receiver(fail_seqs={0, 1})
+    stream = new_stream(receiver)
+    stream.push("第一句。第二句。")
+    stream.close()
+    assert stream.finish() == UNDELIVERED
+
+    # 分段都失败但结束标记附带的兜底回复送达，用户已看到内容
+    receiver = Receiver(fail_seqs={0})
+    stream = new_stream(receiver)
+    stream.push("第一句。第二")
+    assert stream.finish("完整回复") == PARTIAL
+
+    receiver = Receiver(fail_seqs={2})
+    stream = new_stream(receiver)
+    stream.push("第一句。第二句。")
+    stream.close()
+    assert stream.finish() == PARTIAL
+    assert not receiver.closed
+
+
+def test_abort_sends_cancelled_final():
+    receiver = Receiver()
+    stream = new_stream(receiver)
+    stream.push("第一句。第二")
+    assert stream.abort()
+    assert receiver.calls[-1] == ("", True, 1, True)
+    assert receiver.closed and receiver.cancelled
+
+
+def test_async_stream_matches_sync():
+    receiver = Receiver()
+
+    async def asend(text, final, seq, cancelled):
+        return receiver.send(text, final, seq, cancelled)
+
+    async def scenario():
+        stream = ReplyStream(StreamMetrics(), max_chars=20, asend=asend)
+        await stream.apush("第一句。第二句。")
+        await stream.aclose()
+        return await stream.afinish()
+
+    assert asyncio.run(scenario()) == DELIVERED
+    assert [call[2] for call in receiver.calls] == [0, 1, 2]
+
+
+def test_metrics_count_failures():
+    metrics = StreamMetrics()
+    receiver = Receiver(fail_seqs={1})
+    stream = ReplyStream(metrics, max_chars=20, send=receiver.send)
+    stream.push("第一句。第二句。")
+    stream.close()
+    stream.finish()
+    stats = metrics.stats()
+    assert stats["streams"] == 1
+    assert stats["segments"] == 2
+    assert stats["sendFailures"] == 1
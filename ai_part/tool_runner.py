@@ -0,0 +1,145 @@
+"""工具调用循环：同一步中的多个工具调用并行执行
+
+与 AgentExecutor 接口一致（invoke/ainvoke 接收 input、chat_history，返回 {"output": ...}）。
+大模型一次返回多个工具调用时（如历史中有两张图片和一个压缩包），按每轮并发上限同时执行，
+单个工具超时后返回超时说明，结果按原始调用顺序作为 ToolMessage 交回大模型。
+"""
+import asyncio
+import contextvars
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.messages import AIMessage, ToolMessage
+
+
+def tool_timeout_message(name: str, timeout: float) -> str:
+    return f"工具 {name} 执行超过 {timeout} 秒，已放弃本次调用"
+
+
+def unknown_tool_message(name: str) -> str:
+    return f"工具 {name} 不存在"
+
+
+class ParallelToolAgent:
+    """bind_tools 的大模型 + 并行工具执行的调用循环"""
+
+    def __init__(self, llm, tools: List[Any], prompt, max_concurrency: int = 3,
+                 tool_timeout: float = 90, max_iterations: int = 15,
+                 deadline_var: Optional[contextvars.ContextVar] = None):
+        self.llm = llm.bind_tools(tools)
+        self.tools = {tool.name: tool for tool in tools}
+        self.prompt = prompt
+        self.max_concurrency = max(1, max_concurrency)
+        self.tool_timeout = tool_timeout
+        self.max_iterations = max_iterations
+        # 设置后在工具的上下文中写入截止时间（time.monotonic()），由工具内部据此结束超时的调用
+        self.deadline_var = deadline_var
+
+    def invoke(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        scratchpad: List[Any] = []
+        for _ in range(self.max_iterations):
+            message = self.llm.invoke(self._messages(inputs, scratchpad))
+            if not message.tool_calls:
+                return {"output": message.content}
+            scratchpad.append(message)
+            scratchpad.extend(self._run_tool_calls(message))
+        return {"output": self._stopped_output()}
+
+    async def ainvoke(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        scratchpad: List[Any] = []
+        for _ in range(self.max_iterations):
+            message = await self.llm.ainvoke(self._messages(inputs, scratchpad))
+            if not message.tool_calls:
+                return {"output": message.content}
+            scratchpad.append(message)
+            scratchpad.extend(await self._arun_tool_calls(message))
+        return {"output": self._stopped_output()}
+
+    def _messages(self, inputs: Dict[str, Any], scratchpad: List[Any]):
+        return self.prompt.invoke({**inputs, "agent_scratchpad": scratchpad}).to_messages()
+
+    def _run_tool_calls(self, message: AIMessage) -> List[ToolMessage]:
+        calls = message.tool_calls
+        if len(calls) > 1:
+            print(f"并行执行 {len(calls)} 个工具调用: {[call['name'] for call in calls]}")
+        # 超时的工具线程无法强制结束，因此不等待线程池关闭；放弃的调用仍占用线程，
+        # 每个调用各用一个线程，并发上限由下面的调度控制
+        executor = ThreadPoolExecutor(max_workers=len(calls), thread_name_prefix="tool-call")
+        results: List[Any] = [None] * len(calls)
+        queued = list(range(len(calls)))
+        running: Dict[Future, Tuple[int, float]] = {}  # Future -> (调用序号, 截止时间)
+        try:
+            while queued or running:
+                # 超出并发上限的调用排队，有调用完成或超时后再开始，每个调用从开始执行时计时
+                while queued and len(running) < self.max_concurrency:
+                    i = queued.pop(0)
+                    # 工具在线程池中执行，沿用调用方的上下文变量（如当前用户）
+                    deadline = time.monotonic() + self.tool_timeout
+                    context = contextvars.copy_context()
+                    if self.deadline_var is not None:
+                        context.run(self.deadline_var.set, deadline)
+                    future = executor.submit(context.run, self._call_tool, calls[i])
+                    running[future] = (i, deadline)
+                next_deadline = min(deadline for _, deadline in running.values())
+                done, _ = wait(running, timeout=max(0.0, next_deadline - time.monotonic()),
+                               return_when=FIRST_COMPLETED)
+                now = time.monotonic()
+                for future, (i, deadline) in list(running.items()):
+                    if future in done:
+                        results[i] = future.result()
+                    elif deadline <= now:
+                        print(tool_timeout_message(calls[i]["name"], self.tool_timeout))
+                        results[i] = tool_timeout_message(calls[i]["name"], self.tool_timeout)
+                    else:
+                        continue
+                    del running[future]
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        return [ToolMessage(content=str(result), tool_call_id=call["id"], name=call["name"])
+                for call, result in zip(calls, results)]
+
+    async def _arun_tool_calls(self, message: AIMessage) -> List[ToolMessage]:
+        calls = message.tool_calls
+        if len(calls) > 1:
+            print(f"并行执行 {len(calls)} 个工具调用: {[call['name'] for call in calls]}")
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def run(call):
+            async with semaphore:
+                if self.deadline_var is not None:
+                    self.deadline_var.set(time.monotonic() + self.tool_timeout)
+                try:
+                    return await asyncio.wait_for(self._acall_tool(call), self.tool_timeout)
+                except asyncio.TimeoutError:
+                    print(tool_timeout_message(call["name"], self.tool_timeout))
+                    return tool_timeout_message(call["name"], self.tool_timeout)
+
+        # gather 按传入顺序返回结果
+        results = await asyncio.gather(*(run(call) for call in calls))
+        return [ToolMessage(content=str(result), tool_call_id=call["id"], name=call["name"])
+                for call, result in zip(calls, results)]
+
+    def _call_tool(self, call: Dict[str, Any]) -> Any:
+        tool = self.tools.get(call["name"])
+        if tool is None:
+            return unknown_tool_message(call["name"])
+        try:
+            return tool.invoke(call["args"])
+        except Exception as e:
+            print(f"工具 {call['name']} 执行失败: {e}")
+            return f"工具执行失败：{e}"
+
+    async def _acall_tool(self, call: Dict[str, Any]) -> Any:
+        tool = self.tools.get(call["name"])
+        if tool is None:
+            return unknown_tool_message(call["name"])
+        try:
+            return await tool.ainvoke(call["args"])
+        except Exception as e:
+            print(f"工具 {call['name']} 执行失败: {e}")
+            return f"工具执行失败：{e}"
+
+    def _stopped_output(self) -> str:
+        print(f"工具调用超过 {self.max_iterations} 轮，停止执行")
+        return "Agent stopped due to max iterations."
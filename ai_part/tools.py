@@ -1,29 +1,123 @@
 import os
-import zipfile
-import rarfile
-import py7zr
+import asyncio
 import tempfile
-import shutil
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from pathlib import Path
-from typing import Dict, List, Any, Optional
-import requests
-from PIL import Image
-from langchain.tools import tool
+from typing import List, Any, Optional, Tuple
+from langchain.tools import StructuredTool
 from langchain.chat_models import init_chat_model
 from langchain.schema import HumanMessage
-from config.config import VISION_API_KEY, VISION_API_BASE, VISION_API_MODEL
-import base64
-import mimetypes
+from config.config import VISION_API_KEY, VISION_API_BASE, VISION_API_MODEL, VISION_REQUEST_TIMEOUT
+from config.config import DOWNLOAD_CACHE_MAX_BYTES, DOWNLOAD_CACHE_FRESH_SECONDS, DOWNLOAD_CACHE_ORPHAN_GRACE
+from config.config import MAX_DOWNLOAD_BYTES, DOWNLOAD_CHUNK_SIZE
+from config.config import VISION_CACHE_MAX_ENTRIES, VISION_CACHE_TTL, VISION_CACHE_PERSIST_PATH
+from config.config import PHASH_ENABLED, PHASH_MAX_DISTANCE, PHASH_MIN_BITS, PHASH_MAX_ASPECT_DIFF, PHASH_INDEX_MAX_ENTRIES
+from config.config import ARCHIVE_VISION_MAX_IMAGES, ARCHIVE_VISION_CONCURRENCY, ARCHIVE_VISION_TIMEOUT
+from config.config import ARCHIVE_ANALYSIS_TIMEOUT, OFFLOAD_TASK_TIMEOUT
+from config.config import WORKSPACE_ROOT, WORKSPACE_MAX_AGE, WORKSPACE_QUOTA_BYTES, WORKSPACE_JANITOR_INTERVAL
+from config.config import ARCHIVE_CACHE_MAX_ENTRIES, ARCHIVE_CACHE_MAX_BYTES, ARCHIVE_CACHE_TTL, ARCHIVE_CACHE_PERSIST_PATH
+from archive_inspect import ArchiveReader, ArchiveInspection, ArchiveLimitExceeded, DirectoryReader
+from archive_inspect import inspect_archive, inspect_members
+from caching import TTLCache, file_sha256, make_key
+from phash_index import PerceptualHashIndex, is_informative
+from download_cache import DownloadCache, DownloadTooLarge
+from filetypes import sniff_file_extension, is_executable_header
+from filetypes import SUPPORTED_IMAGE_FORMATS, SUPPORTED_ARCHIVE_FORMATS
+from imaging import PreparedImage, prepare_image, read_basic_info
+import http_client
+import offload
+from workspace import WorkspaceManager, WorkspaceQuotaExceeded, resolve_workspace_root
 
 # 创建临时文件目录
 TEMP_DIR = Path(tempfile.gettempdir()) / "ai_customer_service"
 TEMP_DIR.mkdir(exist_ok=True)
 
-# 支持的图片格式
-SUPPORTED_IMAGE_FORMATS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tiff'}
+# 工具调用的临时工作目录（可配置到tmpfs），遗留目录由后台线程清理
+workspaces = WorkspaceManager(
+    resolve_workspace_root(WORKSPACE_ROOT, TEMP_DIR / "workspaces"),
+    max_age=WORKSPACE_MAX_AGE,
+    quota_bytes=WORKSPACE_QUOTA_BYTES,
+    janitor_interval=WORKSPACE_JANITOR_INTERVAL,
+)
 
-# 支持的压缩包格式
-SUPPORTED_ARCHIVE_FORMATS = {'.zip', '.rar', '.7z'}
+# 下载缓存（缓存文件由缓存自身管理，调用方不要删除，用完后调用 download_cache.release）
+download_cache = DownloadCache(
+    TEMP_DIR / "download_cache",
+    max_bytes=DOWNLOAD_CACHE_MAX_BYTES,
+    fresh_seconds=DOWNLOAD_CACHE_FRESH_SECONDS,
+    orphan_grace=DOWNLOAD_CACHE_ORPHAN_GRACE,
+)
+
+# 视觉分析结果缓存，键为 (图片内容sha256, 提示词, 模型名)
+vision_cache = TTLCache(
+    "vision",
+    max_entries=VISION_CACHE_MAX_ENTRIES,
+    ttl=VISION_CACHE_TTL,
+    persist_path=VISION_CACHE_PERSIST_PATH,
+)
+
+# 压缩包分析报告缓存，键为 (压缩包内容sha256, 分析器版本)
+archive_cache = TTLCache(
+    "archive",
+    max_entries=ARCHIVE_CACHE_MAX_ENTRIES,
+    ttl=ARCHIVE_CACHE_TTL,
+    max_bytes=ARCHIVE_CACHE_MAX_BYTES,
+    sizeof=lambda report: len(report.encode("utf-8")),
+    persist_path=ARCHIVE_CACHE_PERSIST_PATH,
+)
+
+# 压缩包分析逻辑或报告格式变化时递增，使旧的缓存报告失效
+ARCHIVE_ANALYZER_VERSION = 4
+
+# 近似重复图片索引：(用户ID, 感知哈希) -> (宽, 高, analyze_image_content 的视觉分析结果)
+phash_index = PerceptualHashIndex(
+    max_entries=PHASH_INDEX_MAX_ENTRIES,
+    max_distance=PHASH_MAX_DISTANCE,
+)
+
+# 当前处理的用户ID：分析结果可能包含识别出的订单号、地址等文字，近似重复图片只在同一用户内复用，未设置时不复用
+vision_scope: ContextVar[Optional[str]] = ContextVar("vision_scope", default=None)
+
+# 当前工具调用的截止时间（time.monotonic()），提交工具时设置；下载、进程池任务和视觉模型请求的超时都不超过剩余时间，
+# 调用方超时放弃后工具线程也会在截止时间前后自行结束，不会长期占用线程池
+tool_deadline: ContextVar[Optional[float]] = ContextVar("tool_deadline", default=None)
+
+class ToolDeadlineExceeded(TimeoutError):
+    """工具调用已超过截止时间"""
+
+def time_left(limit: float) -> float:
+    """返回本次操作可用的超时：不超过 limit 和截止前的剩余时间；已超过截止时间时抛出 ToolDeadlineExceeded"""
+    deadline = tool_deadline.get()
+    if deadline is None:
+        return limit
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise ToolDeadlineExceeded("工具调用超过截止时间")
+    return min(limit, remaining)
+
+def check_deadline() -> None:
+    """已超过工具调用截止时间时抛出 ToolDeadlineExceeded"""
+    time_left(0.0)
+
+@contextmanager
+def close_at_deadline(response):
+    """到达工具调用截止时间时中断响应：持续慢速到达的数据不会触发读取超时，中断后下载循环随即出错退出"""
+    deadline = tool_deadline.get()
+    if deadline is None:
+        yield
+        return
+    timer = threading.Timer(max(0.0, deadline - time.monotonic()), http_client.abort, (response,))
+    timer.daemon = True
+    timer.start()
+    try:
+        yield
+    finally:
+        timer.cancel()
 
 # 导入视觉模型配置
 
@@ -34,6 +128,7 @@ try:
         model=VISION_API_MODEL,
         model_provider="openai",
         max_retries=3,
+        timeout=VISION_REQUEST_TIMEOUT,
     )
     VISION_MODEL_AVAILABLE = True
     print(f"✅ 视觉模型初始化成功: {VISION_API_MODEL}")
@@ -42,111 +137,293 @@ except Exception as e:
     vision_llm = None
     VISION_MODEL_AVAILABLE = False
 
+def resolve_file_url(file_url: str, base_url: str) -> str:
+    """将相对路径补全为完整URL"""
+    if file_url.startswith('/'):
+        return base_url + file_url
+    return file_url
+
+def check_content_length(headers) -> None:
+    """根据Content-Length提前拒绝超过大小上限的文件"""
+    content_length = headers.get("Content-Length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_DOWNLOAD_BYTES:
+        raise DownloadTooLarge(f"文件大小 {content_length} 字节超过上限 {MAX_DOWNLOAD_BYTES} 字节")
+
 def download_file_from_url(file_url: str, base_url: str = "http://part1:3000") -> Optional[str]:
-    """从URL下载文件到临时目录"""
+    """从URL流式下载文件到下载缓存，返回本地缓存文件路径（用完后调用 download_cache.release）"""
     try:
         # 构建完整URL
-        if file_url.startswith('/'):
-            full_url = base_url + file_url
-        else:
-            full_url = file_url
+        full_url = resolve_file_url(file_url, base_url)
+        
+        cached_path = download_cache.get_fresh(full_url)
+        if cached_path:
+            print(f"命中下载缓存: {full_url}")
+            return cached_path
         
         print(f"下载文件: {full_url}")
         
-        # 下载文件
-        response = requests.get(full_url, timeout=10)
-        response.raise_for_status()
+        # 下载文件（已有缓存时带上验证头）
+        headers = download_cache.validation_headers(full_url)
+        with http_client.request("GET", full_url, headers=headers, stream=True,
+                                 deadline=tool_deadline.get()) as response:
+            if response.status_code == 304:
+                cached_path = download_cache.revalidated(full_url)
+                if cached_path:
+                    print(f"缓存验证有效: {cached_path}")
+                    return cached_path
+                return download_file_from_url(file_url, base_url) if headers else None
+            response.raise_for_status()
+            check_content_length(response.headers)
+            
+            # 分块写入磁盘，超过大小上限时立即放弃
+            writer = download_cache.open_writer(full_url, MAX_DOWNLOAD_BYTES)
+            try:
+                with close_at_deadline(response):
+                    for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        writer.write(chunk)
+                    check_deadline()
+                temp_file_path = writer.commit(response.headers)
+            except BaseException:
+                writer.abort()
+                raise
         
-        # 获取文件扩展名
-        file_name = os.path.basename(file_url)
-        if not file_name or '.' not in file_name:
-            file_name = f"downloaded_file_{os.getpid()}.tmp"
+        print(f"文件下载成功: {temp_file_path}")
+        return temp_file_path
         
-        # 保存到临时目录
-        temp_file_path = TEMP_DIR / file_name
-        with open(temp_file_path, 'wb') as f:
-            f.write(response.content)
+    except Exception as e:
+        print(f"文件下载失败: {e}")
+        return None
+
+async def adownload_file_from_url(file_url: str, base_url: str = "http://part1:3000") -> Optional[str]:
+    """从URL流式下载文件到下载缓存（异步版本）"""
+    try:
+        full_url = resolve_file_url(file_url, base_url)
+        
+        cached_path = download_cache.get_fresh(full_url)
+        if cached_path:
+            print(f"命中下载缓存: {full_url}")
+            return cached_path
+        
+        print(f"下载文件: {full_url}")
+        
+        headers = download_cache.validation_headers(full_url)
+        async with http_client.astream("GET", full_url, headers=headers) as response:
+            if response.status_code == 304:
+                cached_path = download_cache.revalidated(full_url)
+                if cached_path:
+                    print(f"缓存验证有效: {cached_path}")
+                    return cached_path
+                return await adownload_file_from_url(file_url, base_url) if headers else None
+            response.raise_for_status()
+            check_content_length(response.headers)
+            
+            writer = download_cache.open_writer(full_url, MAX_DOWNLOAD_BYTES)
+            try:
+                async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    writer.write(chunk)
+                temp_file_path = await asyncio.to_thread(writer.commit, response.headers)
+            except BaseException:
+                writer.abort()
+                raise
         
         print(f"文件下载成功: {temp_file_path}")
-        return str(temp_file_path)
+        return temp_file_path
         
     except Exception as e:
         print(f"文件下载失败: {e}")
         return None
 
-def get_image_mime_type(file_path: str) -> str:
-    """获取图片的MIME类型"""
-    mime_type, _ = mimetypes.guess_type(file_path)
-    return mime_type or "image/jpeg"
+def get_file_extension(file_path: str) -> str:
+    """获取文件类型扩展名：本地文件优先根据文件头识别，否则使用路径后缀"""
+    if os.path.isfile(file_path):
+        sniffed = sniff_file_extension(file_path)
+        if sniffed:
+            return sniffed
+    return Path(file_path).suffix.lower()
 
 def is_image_file(file_path: str) -> bool:
     """检查文件是否为图片格式"""
-    file_ext = Path(file_path).suffix.lower()
-    return file_ext in SUPPORTED_IMAGE_FORMATS
+    return get_file_extension(file_path) in SUPPORTED_IMAGE_FORMATS
 
 def is_archive_file(file_path: str) -> bool:
     """检查文件是否为压缩包格式"""
-    file_ext = Path(file_path).suffix.lower()
-    return file_ext in SUPPORTED_ARCHIVE_FORMATS
+    return get_file_extension(file_path) in SUPPORTED_ARCHIVE_FORMATS
+
+def build_vision_message(data_url: str, text_prompt: str) -> HumanMessage:
+    """构建视觉模型的多模态消息"""
+    return HumanMessage(
+        content=[
+            {
+                "type": "text", 
+                "text": text_prompt
+            },
+            {
+                "type": "image_url",
+                "image_url": {
+                    "url": data_url
+                }
+            }
+        ]
+    )
+
+# 配置思考模式
+VISION_INVOKE_CONFIG = {
+    "extra_body": {
+        "thinking": {
+            "type": "disable",
+        }
+    }
+}
 
-def analyze_image_with_vision_model(image_path: str, text_prompt: str = "请详细分析这张图片的内容，包括图片中的物体、文字、场景等信息") -> str:
-    """使用视觉模型分析图片"""
+DEFAULT_VISION_PROMPT = "请详细分析这张图片的内容，包括图片中的物体、文字、场景等信息"
+
+def vision_cache_key(image_digest: str, text_prompt: str) -> str:
+    return make_key(image_digest, text_prompt, VISION_API_MODEL)
+
+def analyze_prepared_image(prepared: PreparedImage, text_prompt: str = DEFAULT_VISION_PROMPT,
+                           image_digest: Optional[str] = None) -> str:
+    """使用视觉模型分析已预处理的图片，提供图片摘要时缓存成功的分析结果"""
     if not VISION_MODEL_AVAILABLE:
         return "视觉模型不可用，无法分析图片内容"
     
     try:
-        # 读取图片并转换为base64
-        with open(image_path, "rb") as image_file:
-            base64_image = base64.b64encode(image_file.read()).decode('utf-8')
-
-        mime_type = get_image_mime_type(image_path)
-
-        message = HumanMessage(
-            content=[
-                {
-                    "type": "text", 
-                    "text": text_prompt
-                },
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:{mime_type};base64,{base64_image}"
-                    }
-                }
-            ]
-        )
-        
-        # 配置思考模式
-        thinking_config = {
-            "thinking": {
-                "type": "disable",
-            }
-        }
-        
-        response = vision_llm.invoke([message], config={
-            "extra_body": thinking_config
-        })
+        message = build_vision_message(prepared.data_url, text_prompt)
+        response = vision_llm.invoke([message], config=VISION_INVOKE_CONFIG,
+                                     timeout=time_left(VISION_REQUEST_TIMEOUT))
+        if image_digest:
+            vision_cache.set(vision_cache_key(image_digest, text_prompt), response.content)
+        return response.content
         
+    except Exception as e:
+        print(f"视觉模型分析失败: {e}")
+        return f"视觉模型分析过程中出现错误：{str(e)}"
+
+async def aanalyze_prepared_image(prepared: PreparedImage, text_prompt: str = DEFAULT_VISION_PROMPT,
+                                  image_digest: Optional[str] = None) -> str:
+    """使用视觉模型分析已预处理的图片（异步版本）"""
+    if not VISION_MODEL_AVAILABLE:
+        return "视觉模型不可用，无法分析图片内容"
+    
+    try:
+        message = build_vision_message(prepared.data_url, text_prompt)
+        response = await vision_llm.ainvoke([message], config=VISION_INVOKE_CONFIG,
+                                            timeout=time_left(VISION_REQUEST_TIMEOUT))
+        if image_digest:
+            vision_cache.set(vision_cache_key(image_digest, text_prompt), response.content)
         return response.content
         
     except Exception as e:
         print(f"视觉模型分析失败: {e}")
         return f"视觉模型分析过程中出现错误：{str(e)}"
+
+def get_cached_vision_result(image_digest: str, text_prompt: str) -> Optional[str]:
+    """查询视觉分析结果缓存"""
+    cached = vision_cache.get(vision_cache_key(image_digest, text_prompt))
+    if cached is not None:
+        print(f"命中视觉分析缓存: {image_digest[:12]}")
+    return cached
+
+def analyze_image_with_vision_model(image_path: str, text_prompt: str = DEFAULT_VISION_PROMPT) -> str:
+    """使用视觉模型分析图片（相同图片与提示词直接返回缓存结果）"""
+    if not VISION_MODEL_AVAILABLE:
+        return "视觉模型不可用，无法分析图片内容"
+    
+    try:
+        image_digest = file_sha256(image_path)
+        cached = get_cached_vision_result(image_digest, text_prompt)
+        if cached is not None:
+            return cached
+        prepared = load_image_for_analysis(image_path)
+        if prepared is None:
+            return "视觉模型分析过程中出现错误：图片文件损坏或格式不正确"
+    except Exception as e:
+        print(f"图片预处理失败: {e}")
+        return f"视觉模型分析过程中出现错误：{str(e)}"
+    return analyze_prepared_image(prepared, text_prompt, image_digest)
     
 
 def is_executable_binary(file_path: Path) -> bool:
     """判断文件是否为可执行的二进制文件"""
     try:
         with open(file_path, 'rb') as f:
-            header = f.read(4)
-            # 检查常见的可执行文件头
-            return header in {b'\x7fELF', b'MZ\x90\x00', b'PK\x03\x04',b'\xca\xfe\xba\xbe',b'\xcf\xfa\xed\xfe'}
+            return is_executable_header(f.read(4))
     except Exception as e:
         print(f"检查可执行文件失败: {e}")
         return False
 
-@tool
-def analyze_image_content(file_url: str) -> str:
+IMAGE_ANALYSIS_PROMPT = """请详细分析这张图片的内容，包括：
+1. 图片中的主要物体和元素
+2. 图片中的文字内容（如有）
+3. 图片的场景和背景
+4. 图片的整体风格和特点
+5. 任何其他值得注意的细节
+6. 不超过 100 字
+
+请用简洁明了的语言描述，适合作为客服回复使用。"""
+
+def load_image_for_analysis(local_file_path: str) -> Optional[PreparedImage]:
+    """在进程池中解码并预处理图片，图片损坏时返回None
+
+    data URL 由工作进程写到临时工作目录，这里从文件读回，不经过 pickle 传递
+    """
+    try:
+        with workspaces.workspace("vision") as work_dir:
+            output_path = work_dir / "data_url"
+            prepared = offload.run(prepare_image, local_file_path, output_path=str(output_path),
+                                   timeout=time_left(OFFLOAD_TASK_TIMEOUT))
+            return prepared._replace(data_url=output_path.read_text("ascii"))
+    except Exception as e:
+        print(f"图片解码失败: {e}")
+        return None
+
+async def aload_image_for_analysis(local_file_path: str) -> Optional[PreparedImage]:
+    """load_image_for_analysis 的异步版本"""
+    try:
+        with workspaces.workspace("vision") as work_dir:
+            output_path = work_dir / "data_url"
+            prepared = await offload.arun(prepare_image, local_file_path, output_path=str(output_path),
+                                          timeout=time_left(OFFLOAD_TASK_TIMEOUT))
+            data_url = await asyncio.to_thread(output_path.read_text, "ascii")
+            return prepared._replace(data_url=data_url)
+    except Exception as e:
+        print(f"图片解码失败: {e}")
+        return None
+
+def can_reuse_by_phash(prepared: PreparedImage) -> bool:
+    return (PHASH_ENABLED and vision_scope.get() is not None and prepared.phash is not None
+            and is_informative(prepared.phash, PHASH_MIN_BITS))
+
+def same_aspect_ratio(prepared: PreparedImage, width: int, height: int) -> bool:
+    ratio = prepared.width / prepared.height
+    return abs(ratio - width / height) <= PHASH_MAX_ASPECT_DIFF * ratio
+
+def find_near_duplicate_analysis(prepared: PreparedImage) -> Optional[str]:
+    """在当前用户的感知哈希索引中查找宽高比一致的近似重复图片的分析结果"""
+    if not can_reuse_by_phash(prepared):
+        return None
+    match = phash_index.lookup(prepared.phash, scope=vision_scope.get(),
+                               accept=lambda entry: same_aspect_ratio(prepared, entry[0], entry[1]))
+    if match is None:
+        return None
+    (_, _, analysis), distance = match
+    print(f"命中近似重复图片（汉明距离 {distance}），复用已有分析结果")
+    return analysis
+
+def remember_image_analysis(prepared: PreparedImage, vision_analysis: str):
+    """记录成功的分析结果供同一用户的近似重复图片复用"""
+    if can_reuse_by_phash(prepared) and is_successful_analysis(vision_analysis):
+        phash_index.add(prepared.phash, (prepared.width, prepared.height, vision_analysis), scope=vision_scope.get())
+
+def is_successful_analysis(vision_analysis: str) -> bool:
+    return bool(vision_analysis) and "错误" not in vision_analysis and "不可用" not in vision_analysis
+
+def format_image_analysis(basic_info: str, vision_analysis: str) -> str:
+    """组合图片基本信息和视觉模型分析结果"""
+    if is_successful_analysis(vision_analysis):
+        return f"图片分析结果：\n{basic_info}\n\n内容分析：\n{vision_analysis}"
+    return f"图片基本信息：{basic_info}\n\n抱歉，视觉模型暂时不可用，无法详细分析图片内容。我看到您发送了一张图片，请您告诉我想了解图片的什么信息，我会尽力为您解答。"
+
+def _analyze_image_content(file_url: str) -> str:
     """
     识别并分析图片内容（使用视觉模型）
     
@@ -164,57 +441,93 @@ def analyze_image_content(file_url: str) -> str:
         if not local_file_path:
             return "无法下载图片文件"
         
-        # 检查是否为图片文件
-        if not is_image_file(local_file_path):
-            return "提供的文件不是支持的图片格式"
-        
-        # 验证图片完整性并获取基本信息
         try:
-            with Image.open(local_file_path) as img:
-                img.verify()
-                # 重新打开获取基本信息
-                with Image.open(local_file_path) as img:
-                    width, height = img.size
-                    format_name = img.format
-                    mode = img.mode
-                    basic_info = f"图片基本信息：{width}x{height}像素，格式：{format_name}，颜色模式：{mode}"
-        except Exception:
-            return "图片文件损坏或格式不正确"
-        
-        # 使用视觉模型分析图片内容
-        if VISION_MODEL_AVAILABLE:
-            analysis_prompt = """请详细分析这张图片的内容，包括：
-1. 图片中的主要物体和元素
-2. 图片中的文字内容（如有）
-3. 图片的场景和背景
-4. 图片的整体风格和特点
-5. 任何其他值得注意的细节
-6. 不超过 100 字
-
-请用简洁明了的语言描述，适合作为客服回复使用。"""
+            return analyze_local_image(local_file_path)
+        finally:
+            download_cache.release(local_file_path)
             
-            vision_analysis = analyze_image_with_vision_model(local_file_path, analysis_prompt)
-        else:
-            vision_analysis = "视觉模型不可用，无法进行详细分析"
+    except Exception as e:
+        print(f"图片分析失败: {e}")
+        return f"图片分析过程中出现错误：{str(e)}"
+
+async def _aanalyze_image_content(file_url: str) -> str:
+    """analyze_image_content 的异步实现：下载与视觉模型调用不占用线程"""
+    try:
+        print(f"开始使用视觉模型分析图片: {file_url}")
         
-        # 清理临时文件
-        try:
-            os.remove(local_file_path)
-        except:
-            pass
+        local_file_path = await adownload_file_from_url(file_url)
+        if not local_file_path:
+            return "无法下载图片文件"
         
-        if vision_analysis and "错误" not in vision_analysis and "不可用" not in vision_analysis:
-            result = f"图片分析结果：\n{basic_info}\n\n内容分析：\n{vision_analysis}"
-            return result
-        else:
-            return f"图片基本信息：{basic_info}\n\n抱歉，视觉模型暂时不可用，无法详细分析图片内容。我看到您发送了一张图片，请您告诉我想了解图片的什么信息，我会尽力为您解答。"
+        try:
+            return await aanalyze_local_image(local_file_path)
+        finally:
+            download_cache.release(local_file_path)
             
     except Exception as e:
         print(f"图片分析失败: {e}")
         return f"图片分析过程中出现错误：{str(e)}"
 
-@tool
-def extract_and_analyze_archive(file_url: str) -> str:
+def analyze_local_image(local_file_path: str) -> str:
+    """分析已下载到本地的图片"""
+    # 检查是否为图片文件
+    if not is_image_file(local_file_path):
+        return "提供的文件不是支持的图片格式"
+    
+    # 相同图片已分析过时只读取头部信息，跳过解码和视觉模型调用
+    image_digest = file_sha256(local_file_path)
+    cached = get_cached_vision_result(image_digest, IMAGE_ANALYSIS_PROMPT)
+    if cached is not None:
+        return format_image_analysis(read_basic_info(local_file_path), cached)
+    
+    # 一次解码完成完整性校验、基本信息获取和缩放编码
+    prepared = load_image_for_analysis(local_file_path)
+    if prepared is None:
+        return "图片文件损坏或格式不正确"
+    
+    # 使用视觉模型分析图片内容（近似重复图片直接复用已有结果）
+    vision_analysis = find_near_duplicate_analysis(prepared)
+    if vision_analysis is None:
+        if VISION_MODEL_AVAILABLE:
+            vision_analysis = analyze_prepared_image(prepared, IMAGE_ANALYSIS_PROMPT, image_digest)
+            remember_image_analysis(prepared, vision_analysis)
+        else:
+            vision_analysis = "视觉模型不可用，无法进行详细分析"
+    
+    return format_image_analysis(prepared.basic_info, vision_analysis)
+
+async def aanalyze_local_image(local_file_path: str) -> str:
+    """analyze_local_image 的异步版本"""
+    if not is_image_file(local_file_path):
+        return "提供的文件不是支持的图片格式"
+    
+    image_digest = await asyncio.to_thread(file_sha256, local_file_path)
+    cached = get_cached_vision_result(image_digest, IMAGE_ANALYSIS_PROMPT)
+    if cached is not None:
+        basic_info = await asyncio.to_thread(read_basic_info, local_file_path)
+        return format_image_analysis(basic_info, cached)
+    
+    prepared = await aload_image_for_analysis(local_file_path)
+    if prepared is None:
+        return "图片文件损坏或格式不正确"
+    
+    vision_analysis = find_near_duplicate_analysis(prepared)
+    if vision_analysis is None:
+        if VISION_MODEL_AVAILABLE:
+            vision_analysis = await aanalyze_prepared_image(prepared, IMAGE_ANALYSIS_PROMPT, image_digest)
+            remember_image_analysis(prepared, vision_analysis)
+        else:
+            vision_analysis = "视觉模型不可用，无法进行详细分析"
+    
+    return format_image_analysis(prepared.basic_info, vision_analysis)
+
+analyze_image_content = StructuredTool.from_function(
+    func=_analyze_image_content,
+    coroutine=_aanalyze_image_content,
+    name="analyze_image_content",
+)
+
+def _extract_and_analyze_archive(file_url: str) -> str:
     """
     解压并分析压缩包内容
     
@@ -232,164 +545,197 @@ def extract_and_analyze_archive(file_url: str) -> str:
         if not local_file_path:
             return "无法下载压缩包文件"
         
-        # 检查是否为压缩包文件
-        if not is_archive_file(local_file_path):
-            return "提供的文件不是支持的压缩包格式（支持zip、rar、7z）"
-        
-        # 创建解压目录
-        extract_dir = TEMP_DIR / f"extracted_{os.getpid()}_{Path(local_file_path).stem}"
-        extract_dir.mkdir(exist_ok=True)
-        
         try:
-            # 根据文件类型进行解压
-            file_ext = Path(local_file_path).suffix.lower()
-            
-            if file_ext == '.zip':
-                with zipfile.ZipFile(local_file_path, 'r') as zip_ref:
-                    zip_ref.extractall(extract_dir)
-            elif file_ext == '.rar':
-                with rarfile.RarFile(local_file_path, 'r') as rar_ref:
-                    rar_ref.extractall(extract_dir)
-            elif file_ext == '.7z':
-                with py7zr.SevenZipFile(local_file_path, 'r') as sevenz_ref:
-                    sevenz_ref.extractall(extract_dir)
-            else:
-                return f"不支持的压缩包格式: {file_ext}"
-            
-            print(f"压缩包解压到: {extract_dir}")
-            
-            # 分析解压后的内容
-            analysis_result = analyze_extracted_files(extract_dir)
-            
-            # 清理临时文件
-            try:
-                os.remove(local_file_path)
-                shutil.rmtree(extract_dir)
-            except:
-                pass
-            
-            return analysis_result
-            
-        except Exception as e:
-            # 清理临时文件
-            try:
-                os.remove(local_file_path)
-                if extract_dir.exists():
-                    shutil.rmtree(extract_dir)
-            except:
-                pass
-            
-            return f"解压缩失败：{str(e)}"
+            return analyze_local_archive(local_file_path)
+        finally:
+            download_cache.release(local_file_path)
             
     except Exception as e:
         print(f"压缩包处理失败: {e}")
         return f"压缩包处理过程中出现错误：{str(e)}"
 
-def analyze_extracted_files(extract_dir: Path) -> str:
-    """分析解压后的文件内容"""
+async def _aextract_and_analyze_archive(file_url: str) -> str:
+    """extract_and_analyze_archive 的异步实现：异步下载后在线程中解压分析"""
     try:
-        analysis_parts = []
-        file_count = 0
-        text_files_content = []
-        image_files_info = []
-        other_files_info = []
-        
-        # 遍历解压后的文件
-        for root, dirs, files in os.walk(extract_dir):
-            for file in files:
-                file_path = Path(root) / file
-                file_count += 1
-                
-                try:
-                    # 获取文件基本信息
-                    file_size = file_path.stat().st_size
-                    file_ext = file_path.suffix.lower()
-                    
-                    print(f"处理文件: {file_path.name} ({file_size} 字节)")
-                    
-                    # 根据文件类型进行处理
-                    if file_ext in {'.txt', '.md', '.py', '.js', '.html', '.css', '.json', '.xml', '.csv'}:
-                        # 文本文件 - 读取内容
-                        try:
-                            with open(file_path, 'r', encoding='utf-8') as f:
-                                content = f.read()
-                                if len(content) > 1000:
-                                    content = content[:1000] + "...(内容过长，已截取前1000字符)"
-                                text_files_content.append(f"📄 {file_path.name}:\n{content}")
-                        except UnicodeDecodeError:
-                            try:
-                                with open(file_path, 'r', encoding='gbk') as f:
-                                    content = f.read()
-                                    if len(content) > 1000:
-                                        content = content[:1000] + "...(内容过长，已截取前1000字符)"
-                                    text_files_content.append(f"📄 {file_path.name}:\n{content}")
-                            except:
-                                other_files_info.append(f"📄 {file_path.name} ({file_size} 字节) - 无法读取文本内容")
-                    
-                    elif file_ext in SUPPORTED_IMAGE_FORMATS:
-                        # 图片文件 - 使用视觉模型分析（限制数量以避免过多调用）
-                        try:
-                            if VISION_MODEL_AVAILABLE and len(image_files_info) < 3:  # 只分析前3张图片
-                                vision_result = analyze_image_with_vision_model(
-                                    str(file_path), 
-                                    f"请简要描述这张图片 {file_path.name} 的内容"
-                                )
-                                image_files_info.append(f"🖼️ {file_path.name}: {vision_result[:200]}...")
-                            else:
-                                with Image.open(file_path) as img:
-                                    width, height = img.size
-                                    format_name = img.format
-                                    image_files_info.append(f"🖼️ {file_path.name}: {width}x{height}像素, {format_name}格式 ({file_size} 字节)")
-                        except:
-                            image_files_info.append(f"🖼️ {file_path.name} ({file_size} 字节) - 图片信息读取失败")
-
-                    # 判断文件是否为可执行的二进制文件,不要通过后缀名判断
-                    elif is_executable_binary(file_path):
-                        # 执行文件
-                        os.chmod(file_path, 0o755)  # 设置为可执行
-                        try:
-                            output = os.popen(str(file_path)).read()
-                            other_files_info.append(f"💻 {file_path.name} ({file_size} 字节) - 执行输出: {output[:100]}..."
-                                                    if len(output) > 100 else output)
-                        except Exception as e:
-                            other_files_info.append(f"💻 {file_path.name} ({file_size} 字节) - 执行失败: {str(e)}")
-
-                    else:
-                        # 其他文件类型
-                        other_files_info.append(f"📎 {file_path.name} ({file_size} 字节, {file_ext}格式)")
-                        
-                except Exception as e:
-                    other_files_info.append(f"❌ {file_path.name} - 处理失败: {str(e)}")
-        
-        # 构建分析结果
-        analysis_parts.append(f"📦 压缩包分析结果：")
-        analysis_parts.append(f"总文件数: {file_count}")
-        
-        if text_files_content:
-            analysis_parts.append(f"\n📄 文本文件内容 ({len(text_files_content)}个):")
-            analysis_parts.extend(text_files_content[:5])  # 最多显示5个文本文件
-            if len(text_files_content) > 5:
-                analysis_parts.append(f"... 还有{len(text_files_content) - 5}个文本文件未显示")
-        
-        if image_files_info:
-            analysis_parts.append(f"\n🖼️ 图片文件 ({len(image_files_info)}个):")
-            analysis_parts.extend(image_files_info[:10])  # 最多显示10个图片
-            if len(image_files_info) > 10:
-                analysis_parts.append(f"... 还有{len(image_files_info) - 10}个图片文件未显示")
-        
-        if other_files_info:
-            analysis_parts.append(f"\n📎 其他文件 ({len(other_files_info)}个):")
-            analysis_parts.extend(other_files_info[:10])  # 最多显示10个其他文件
-            if len(other_files_info) > 10:
-                analysis_parts.append(f"... 还有{len(other_files_info) - 10}个文件未显示")
+        print(f"开始处理压缩包: {file_url}")
         
-        if file_count == 0:
-            return "压缩包是空的，没有找到任何文件"
+        local_file_path = await adownload_file_from_url(file_url)
+        if not local_file_path:
+            return "无法下载压缩包文件"
         
-        return "\n".join(analysis_parts)
+        try:
+            return await asyncio.to_thread(analyze_local_archive, local_file_path)
+        finally:
+            download_cache.release(local_file_path)
+            
+    except Exception as e:
+        print(f"压缩包处理失败: {e}")
+        return f"压缩包处理过程中出现错误：{str(e)}"
+
+extract_and_analyze_archive = StructuredTool.from_function(
+    func=_extract_and_analyze_archive,
+    coroutine=_aextract_and_analyze_archive,
+    name="extract_and_analyze_archive",
+)
+
+def analyze_local_archive(local_file_path: str) -> str:
+    """分析已下载到本地的压缩包（相同内容的压缩包直接返回缓存的报告）"""
+    # 检查是否为压缩包文件（只识别一次文件头）
+    file_ext = get_file_extension(local_file_path)
+    if file_ext not in SUPPORTED_ARCHIVE_FORMATS:
+        return "提供的文件不是支持的压缩包格式（支持zip、rar、7z）"
+    
+    archive_digest = file_sha256(local_file_path)
+    cache_key = make_key(archive_digest, ARCHIVE_ANALYZER_VERSION)
+    cached = archive_cache.get(cache_key)
+    if cached is not None:
+        print(f"命中压缩包分析缓存: {archive_digest[:12]}")
+        return cached
+    
+    report, cacheable = analyze_archive_file(local_file_path, file_ext)
+    # 视觉分析超时或失败的报告不完整、包含执行输出的报告不可复现，都不缓存，下次重新分析
+    if cacheable:
+        archive_cache.set(cache_key, report)
+    return report
+
+def analyze_archive_file(local_file_path: str, file_ext: str) -> Tuple[str, bool]:
+    """解析压缩包并生成报告，返回 (报告, 是否可缓存)
+
+    解压和成员检查在进程池中完成，只通过文件路径交接数据；视觉模型调用在当前进程并发进行。
+    """
+    try:
+        # 每次调用使用独立的工作目录，退出时删除（下载文件由下载缓存管理）
+        with workspaces.workspace("archive") as work_dir:
+            inspection = offload.run(inspect_archive, local_file_path, file_ext, str(work_dir),
+                                     archive_vision_limit(), timeout=time_left(ARCHIVE_ANALYSIS_TIMEOUT + 5))
+            return finish_archive_analysis(inspection, work_dir)
         
+    except ArchiveLimitExceeded as e:
+        print(f"压缩包超出处理限制: {e}")
+        return archive_limit_message(e), False
+    except offload.OffloadTimeout:
+        return f"压缩包处理超时（超过{ARCHIVE_ANALYSIS_TIMEOUT}秒），已停止分析。", False
+    except ToolDeadlineExceeded:
+        return "压缩包处理超过工具调用时间上限，已停止分析。", False
+    except WorkspaceQuotaExceeded as e:
+        print(f"无法创建工作目录: {e}")
+        return "服务器临时空间不足，暂时无法分析压缩包，请稍后再试。", False
     except Exception as e:
-        return f"文件分析过程中出现错误：{str(e)}"
+        return f"解压缩失败：{str(e)}", False
+
+def archive_limit_message(error: ArchiveLimitExceeded) -> str:
+    return f"压缩包超出处理限制（{error}），已停止分析。请让用户拆分或精简压缩包后重新发送。"
+
+def resolve_vision_results(image_files_info: List[Optional[str]], pending: List[tuple]) -> bool:
+    """按原始顺序填入并发视觉分析的结果，超时的调用以提示信息代替；全部成功时返回True"""
+    complete = True
+    tool_end = tool_deadline.get()
+    for slot, (index, file_name, future, submitted_at) in enumerate(pending):
+        # 每批最多 ARCHIVE_VISION_CONCURRENCY 个调用同时进行，排队时间按批次计入截止时间
+        deadline = submitted_at + ARCHIVE_VISION_TIMEOUT * (slot // ARCHIVE_VISION_CONCURRENCY + 1)
+        if tool_end is not None:
+            deadline = min(deadline, tool_end)
+        try:
+            vision_result = future.result(timeout=max(0, deadline - time.monotonic()))
+            image_files_info[index] = f"🖼️ {file_name}: {vision_result[:200]}..."
+            complete = complete and is_successful_analysis(vision_result)
+        except FutureTimeoutError:
+            future.cancel()
+            print(f"图片 {file_name} 视觉分析超时")
+            image_files_info[index] = f"🖼️ {file_name} - 图片分析超时"
+            complete = False
+        except Exception as e:
+            print(f"图片 {file_name} 视觉分析失败: {e}")
+            image_files_info[index] = f"🖼️ {file_name} - 图片信息读取失败"
+            complete = False
+    return complete
+
+def build_archive_report(file_count: int, text_files_content: List[str],
+                         image_files_info: List[str], other_files_info: List[str]) -> str:
+    """汇总压缩包分析结果"""
+    if file_count == 0:
+        return "压缩包是空的，没有找到任何文件"
+    
+    analysis_parts = []
+    analysis_parts.append(f"📦 压缩包分析结果：")
+    analysis_parts.append(f"总文件数: {file_count}")
+    
+    if text_files_content:
+        analysis_parts.append(f"\n📄 文本文件内容 ({len(text_files_content)}个):")
+        analysis_parts.extend(text_files_content[:5])  # 最多显示5个文本文件
+        if len(text_files_content) > 5:
+            analysis_parts.append(f"... 还有{len(text_files_content) - 5}个文本文件未显示")
+    
+    if image_files_info:
+        analysis_parts.append(f"\n🖼️ 图片文件 ({len(image_files_info)}个):")
+        analysis_parts.extend(image_files_info[:10])  # 最多显示10个图片
+        if len(image_files_info) > 10:
+            analysis_parts.append(f"... 还有{len(image_files_info) - 10}个图片文件未显示")
+    
+    if other_files_info:
+        analysis_parts.append(f"\n📎 其他文件 ({len(other_files_info)}个):")
+        analysis_parts.extend(other_files_info[:10])  # 最多显示10个其他文件
+        if len(other_files_info) > 10:
+            analysis_parts.append(f"... 还有{len(other_files_info) - 10}个文件未显示")
+    
+    return "\n".join(analysis_parts)
+
+def analyze_archive_members(reader: ArchiveReader, work_dir: Path) -> Tuple[str, bool]:
+    """在当前进程中检查压缩包成员并完成视觉分析，返回 (报告, 是否可缓存)"""
+    try:
+        inspection = inspect_members(reader, work_dir, archive_vision_limit())
+        return finish_archive_analysis(inspection, work_dir)
+    except ArchiveLimitExceeded as e:
+        print(f"压缩包超出处理限制: {e}")
+        return archive_limit_message(e), False
+    except Exception as e:
+        return f"文件分析过程中出现错误：{str(e)}", False
+
+def archive_vision_limit() -> int:
+    return ARCHIVE_VISION_MAX_IMAGES if VISION_MODEL_AVAILABLE else 0
+
+def finish_archive_analysis(inspection: ArchiveInspection, work_dir: Optional[Path] = None) -> Tuple[str, bool]:
+    """并发分析检查阶段挑出的图片并生成报告，返回 (报告, 是否可缓存)
+
+    视觉分析超时或失败、报告包含成员的执行输出时不可缓存。
+    超时的视觉分析无法中断，work_dir 在这些调用结束后才删除（调用本身受视觉模型请求超时限制）
+    """
+    image_files_info = list(inspection.image_files_info)
+    # 并发进行的视觉分析：(在image_files_info中的位置, 文件名, future, 提交时间)
+    pending_vision = []
+    vision_executor = None
+    try:
+        if inspection.vision_images:
+            vision_executor = ThreadPoolExecutor(
+                max_workers=ARCHIVE_VISION_CONCURRENCY,
+                thread_name_prefix="archive-vision",
+            )
+            for index, file_name, image_path in inspection.vision_images:
+                # 沿用当前上下文，视觉模型请求同样受工具截止时间限制
+                future = vision_executor.submit(
+                    contextvars.copy_context().run,
+                    analyze_image_with_vision_model,
+                    image_path,
+                    f"请简要描述这张图片 {file_name} 的内容"
+                )
+                pending_vision.append((index, file_name, future, time.monotonic()))
+        
+        # 等待并发的视觉分析完成
+        complete = resolve_vision_results(image_files_info, pending_vision)
+    finally:
+        if vision_executor is not None:
+            vision_executor.shutdown(wait=False, cancel_futures=True)
+            if work_dir is not None:
+                workspaces.hold_until_done(work_dir, [future for _, _, future, _ in pending_vision])
+    
+    report = build_archive_report(inspection.file_count, inspection.text_files_content,
+                                  image_files_info, inspection.other_files_info)
+    return report, complete and not inspection.executed
+
+def analyze_extracted_files(extract_dir: Path) -> str:
+    """分析解压后的文件内容"""
+    report, _ = analyze_archive_members(DirectoryReader(extract_dir), extract_dir)
+    return report
 
 # 工具列表 - 供大模型调用
 AVAILABLE_TOOLS = [
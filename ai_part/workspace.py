@@ -0,0 +1,204 @@
+"""每次工具调用独立的临时工作目录，以及清理遗留目录、控制磁盘占用的后台清理线程
+
+工作目录名为 <前缀>-<进程ID>-<随机串>，同一进程内的并发调用不会冲突。
+根目录可以配置到 tmpfs（如 /dev/shm）上，小文件的解压和读写不落盘。
+"""
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from concurrent.futures import Future
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _dir_size(path: Path) -> int:
+    total = 0
+    for current, _, files in os.walk(path):
+        for file in files:
+            try:
+                total += os.lstat(os.path.join(current, file)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _make_writable_and_retry(func, path, exc_info):
+    """rmtree 遇到只读文件或目录时修改权限后重试"""
+    try:
+        os.chmod(os.path.dirname(path), stat.S_IRWXU)
+        os.chmod(path, stat.S_IRWXU)
+    except OSError:
+        pass
+    func(path)
+
+
+class WorkspaceQuotaExceeded(Exception):
+    """工作目录总占用超过配额，暂时不能创建新的工作目录"""
+
+
+class WorkspaceManager:
+    """创建、清理工作目录；后台线程定期删除遗留目录并统计占用，超过配额时拒绝创建新目录"""
+
+    def __init__(self, root: Path, max_age: float = 600, quota_bytes: int = 500 * 1024 * 1024,
+                 janitor_interval: float = 60):
+        self.root = Path(root)
+        self.max_age = max_age
+        self.quota_bytes = quota_bytes
+        self.janitor_interval = janitor_interval
+        self._active: Set[Path] = set()
+        self._holds: Dict[Path, List[Future]] = {}  # 工作目录 -> 退出后仍需等待的后台任务
+        self._lock = threading.Lock()
+        self._janitor: Optional[threading.Thread] = None
+        self._usage = 0
+        self._stats = {"created": 0, "cleaned": 0, "cleanupFailures": 0,
+                       "orphansRemoved": 0, "quotaRejections": 0, "deferred": 0}
+
+    @contextmanager
+    def workspace(self, prefix: str = "ws") -> Iterator[Path]:
+        """创建唯一的工作目录，退出时删除（删除失败的目录由清理线程稍后处理）"""
+        self.start_janitor()
+        if self._usage > self.quota_bytes:
+            # 占用数据可能已过时，重新统计一次再决定
+            self.sweep()
+            if self._usage > self.quota_bytes:
+                with self._lock:
+                    self._stats["quotaRejections"] += 1
+                raise WorkspaceQuotaExceeded(f"临时工作目录占用超过配额 {self.quota_bytes} 字节")
+        self.root.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            # 创建与登记在同一把锁内完成，清理线程不会把刚创建的目录当作遗留目录
+            path = Path(tempfile.mkdtemp(prefix=f"{prefix}-{os.getpid()}-", dir=self.root))
+            self._active.add(path)
+            self._stats["created"] += 1
+        try:
+            yield path
+        finally:
+            with self._lock:
+                pending = [future for future in self._holds.pop(path, []) if not future.done()]
+            if pending:
+                self._release_when_done(path, pending)
+            else:
+                self._release(path)
+
+    def hold_until_done(self, path: Path, futures: Iterable[Future]):
+        """工作目录退出时若这些任务仍在执行（如超时后仍在读取文件的视觉模型调用），等任务结束后再删除"""
+        with self._lock:
+            if path in self._active:
+                self._holds.setdefault(path, []).extend(futures)
+
+    def start_janitor(self):
+        """启动后台清理线程（首次创建工作目录时自动调用）"""
+        with self._lock:
+            if self._janitor is not None:
+                return
+            self._janitor = threading.Thread(target=self._janitor_loop, name="workspace-janitor", daemon=True)
+            self._janitor.start()
+
+    def sweep(self):
+        """删除遗留目录（所属进程已退出、本进程已不再使用或超过 max_age），并重新统计总占用"""
+        if not self.root.exists():
+            return
+        paths = [path for path in self.root.iterdir() if path.is_dir()]
+        now = time.time()
+        with self._lock:
+            active = set(self._active)
+
+        total = 0
+        for path in paths:
+            if path not in active:
+                try:
+                    expired = now - path.stat().st_mtime > self.max_age
+                except OSError:
+                    continue
+                if (expired or self._is_orphan(path)) and self._remove(path, "orphansRemoved"):
+                    continue
+            total += _dir_size(path)
+        self._usage = total
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+            stats["active"] = len(self._active)
+        stats["usageBytes"] = self._usage
+        stats["quotaBytes"] = self.quota_bytes
+        stats["root"] = str(self.root)
+        return stats
+
+    def _release(self, path: Path):
+        with self._lock:
+            self._active.discard(path)
+        self._remove(path, "cleaned")
+
+    def _release_when_done(self, path: Path, futures: List[Future]):
+        """延迟删除：目录保持登记为使用中，清理线程不会删除，最后一个任务结束时再删除"""
+        with self._lock:
+            self._stats["deferred"] += 1
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def on_done(_):
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                self._release(path)
+
+        for future in futures:
+            future.add_done_callback(on_done)
+
+    def _is_orphan(self, path: Path) -> bool:
+        """目录所属进程已退出，或是本进程已不再使用的目录"""
+        parts = path.name.split("-")
+        if len(parts) != 3 or not parts[1].isdigit():
+            return False
+        pid = int(parts[1])
+        return pid == os.getpid() or not _pid_alive(pid)
+
+    def _remove(self, path: Path, counter: str) -> bool:
+        try:
+            shutil.rmtree(path, onerror=_make_writable_and_retry)
+        except FileNotFoundError:
+            return True
+        except OSError as e:
+            print(f"删除工作目录 {path} 失败: {e}")
+            with self._lock:
+                self._stats["cleanupFailures"] += 1
+            return False
+        with self._lock:
+            self._stats[counter] += 1
+        return True
+
+    def _janitor_loop(self):
+        while True:
+            time.sleep(self.janitor_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"工作目录清理失败: {e}")
+
+
+def resolve_workspace_root(configured: Optional[str], fallback: Path) -> Path:
+    """使用配置的根目录（如tmpfs），不可用时退回到 fallback"""
+    if configured:
+        root = Path(configured)
+        try:
+            root.mkdir(parents=True, exist_ok=True)
+            if os.access(root, os.W_OK):
+                return root
+        except OSError as e:
+            print(f"工作目录根路径 {root} 不可用: {e}")
+    return fallback
@@ -53,6 +53,9 @@ const users = new Map();
 const conversations = new Map();
 const webhookTimers = new Map(); // 用于防抖动的定时器
 const aiResponseStatus = new Map(); // 记录AI回复状态
+const aiProcessingTimers = new Map(); // AI处理状态的超时定时器
+const replySegmentSeqs = new Map(); // 流式回复ID -> 已处理的最大分段序号（去重AI服务重试的分段）
+const aiSessions = new Map(); // 与AI服务的增量同步状态（会话ID、已确认序号）
 const serviceReplyQueue = new Map(); // 客服回复队列
 
 const products = [
@@ -173,58 +176,142 @@ function handleCustomerMessageWithDebounce(userId, messageObj) {
   webhookTimers.set(userId, timer);
 }
 
+// AI处理状态的最长保持时间，AI服务既没有回复也没有通知失败时自动清除
+const AI_PROCESSING_TIMEOUT = parseInt(process.env.AI_PROCESSING_TIMEOUT || '180000', 10);
+
+function markAIProcessing(userId) {
+  aiResponseStatus.set(userId, 'processing');
+  clearTimeout(aiProcessingTimers.get(userId));
+  aiProcessingTimers.set(userId, setTimeout(() => {
+    aiProcessingTimers.delete(userId);
+    if (aiResponseStatus.get(userId) === 'processing') {
+      console.log(`用户 ${userId} 的AI处理超时，清除处理状态`);
+      aiResponseStatus.delete(userId);
+    }
+  }, AI_PROCESSING_TIMEOUT));
+}
+
+function clearAIProcessing(userId) {
+  aiResponseStatus.delete(userId);
+  clearTimeout(aiProcessingTimers.get(userId));
+  aiProcessingTimers.delete(userId);
+}
+
+// 流式回复分段序号的保留时间，AI服务重试同一分段时据此去重
+const REPLY_SEGMENT_DEDUP_TTL = parseInt(process.env.REPLY_SEGMENT_DEDUP_TTL || '600000', 10);
+
+// 记录分段序号，已处理过的分段（重试导致的重复请求）返回false
+function acceptReplySegment(replyId, seq) {
+  if (!replyId || !Number.isInteger(seq)) {
+    return true;
+  }
+  const seen = replySegmentSeqs.get(replyId);
+  if (seen && seq <= seen.seq) {
+    return false;
+  }
+  if (seen) {
+    clearTimeout(seen.timer);
+  }
+  const timer = setTimeout(() => replySegmentSeqs.delete(replyId), REPLY_SEGMENT_DEDUP_TTL);
+  replySegmentSeqs.set(replyId, { seq, timer });
+  return true;
+}
+
+// 获取用户与AI服务之间的增量同步状态
+function getAISession(userId) {
+  let session = aiSessions.get(userId);
+  if (!session) {
+    session = { conversationId: uuidv4(), ackIndex: 0 };
+    aiSessions.set(userId, session);
+  }
+  return session;
+}
+
+function toWebhookMessage(msg) {
+  return {
+    role: msg.userType === 'customer' ? 'user' : 'assistant',
+    content: msg.message,
+    timestamp: msg.timestamp,
+    type: msg.type,
+    fileUrl: msg.fileUrl
+  };
+}
+
+function postWebhook(webhookUrl, webhookData) {
+  return axios.post(webhookUrl, webhookData, {
+    headers: {
+      'Content-Type': 'application/json',
+      'Authorization': `Bearer ${process.env.AI_WEBHOOK_TOKEN || 'default-token'}`
+    },
+    timeout: 10000 // 增加超时时间到10秒
+  });
+}
+
 // 发送包含上下文的Webhook到AI服务
 async function sendWebhookToAIWithContext(userId) {
   const webhookUrl = process.env.AI_WEBHOOK_URL || 'http://ai_part:3001/ai-webhook';
   
   try {
     // 标记AI正在处理
-    aiResponseStatus.set(userId, 'processing');
+    markAIProcessing(userId);
 
     // 获取该用户的对话历史
     const conversation = conversations.get(userId) || [];
     
-    // 过滤出最近的消息（最多10条，包含用户和客服的消息）
-    const recentMessages = conversation.slice(-10);
-    
     // 获取最新的用户消息
     const latestUserMessage = conversation
       .filter(msg => msg.userType === 'customer')
       .slice(-1)[0];
 
     if (!latestUserMessage) {
-      aiResponseStatus.delete(userId);
+      clearAIProcessing(userId);
       return;
     }
 
     const webhookData = {
+      messageId: latestUserMessage.id, // 幂等键：超时重试时AI服务不会重复回复
       message: latestUserMessage.message,
       userId: userId,
       timestamp: latestUserMessage.timestamp,
       type: latestUserMessage.type,
-      fileUrl: latestUserMessage.fileUrl,
-      conversationHistory: recentMessages.map(msg => ({
-        role: msg.userType === 'customer' ? 'user' : 'assistant',
-        content: msg.message,
-        timestamp: msg.timestamp,
-        type: msg.type,
-        fileUrl: msg.fileUrl
-      }))
+      fileUrl: latestUserMessage.fileUrl
     };
 
-    await axios.post(webhookUrl, webhookData, {
-      headers: {
-        'Content-Type': 'application/json',
-        'Authorization': `Bearer ${process.env.AI_WEBHOOK_TOKEN || 'default-token'}`
-      },
-      timeout: 10000 // 增加超时时间到10秒
-    });
+    // 增量协议：只发送AI服务上次确认之后的新消息
+    const session = getAISession(userId);
+    const baseIndex = Math.min(session.ackIndex, conversation.length);
+    let response;
+    try {
+      response = await postWebhook(webhookUrl, {
+        ...webhookData,
+        conversationId: session.conversationId,
+        baseIndex: baseIndex,
+        messages: conversation.slice(baseIndex).map(toWebhookMessage)
+      });
+    } catch (error) {
+      if (!error.response || error.response.status !== 409) {
+        throw error;
+      }
+      // AI服务的会话与本地对不上（如AI服务重启），发送完整历史重新同步
+      console.log(`会话需要重新同步，用户: ${userId}`);
+      response = await postWebhook(webhookUrl, {
+        ...webhookData,
+        conversationId: session.conversationId,
+        baseIndex: 0,
+        messages: conversation.map(toWebhookMessage),
+        resync: true
+      });
+    }
+
+    if (response.data && Number.isInteger(response.data.ackIndex)) {
+      session.ackIndex = response.data.ackIndex;
+    }
     
-    console.log(`Webhook发送成功，用户: ${userId}, 历史消息数: ${recentMessages.length}`);
+    console.log(`Webhook发送成功，用户: ${userId}, 新增消息数: ${conversation.length - baseIndex}`);
   } catch (error) {
     console.error('Webhook发送失败:', error.message);
     // 发送失败时清除状态
-    aiResponseStatus.delete(userId);
+    clearAIProcessing(userId);
   }
 }
 
@@ -327,13 +414,62 @@ function flushServiceReplyQueue(userId) {
 
 // AI回复接口（由AI服务调用）
 app.post('/api/ai/reply', async (req, res) => {
-  const { userId, message, type = 'text', fileUrl } = req.body;
-  
-  if (!userId || !message) {
+  const { userId, message, type = 'text', fileUrl, stream = false, final = true, failed = false, cancelled = false, replyId, seq } = req.body;
+
+  // AI服务后台处理失败：只结束处理状态，之后的消息可以正常发送webhook
+  if (userId && failed) {
+    console.log(`用户 ${userId} 的AI处理失败，清除处理状态`);
+    clearAIProcessing(userId);
+    return res.json({ success: true, message: '处理状态已清除', messageCount: 0 });
+  }
+
+  // 流式回复的结束标记可以不带内容
+  if (!userId || (!message && !stream)) {
     return res.status(400).json({ error: '缺少必要参数' });
   }
 
   try {
+    // 流式回复：AI服务已按句切分，每段到达后立即推送
+    if (stream) {
+      // 同一分段重试时（AI服务没有收到上次的响应）不再重复推送
+      if (!acceptReplySegment(replyId, seq)) {
+        console.log(`重复的分段回复 ${replyId}#${seq}，已忽略`);
+        return res.json({ success: true, message: '分段回复已处理', messageCount: 0 });
+      }
+
+      if (message) {
+        const messageObj = {
+          id: uuidv4(),
+          userId: 'ai-service',
+          userType: 'service',
+          message,
+          type,
+          fileUrl: fileUrl || null,
+          timestamp: new Date().toISOString()
+        };
+
+        if (!conversations.has(userId)) {
+          conversations.set(userId, []);
+        }
+        conversations.get(userId).push(messageObj);
+        io.to('customer-room').to('service-room').emit('new-message', messageObj);
+      }
+
+      // 最后一段到达后AI处理完成；被更新消息取代的回复以带 cancelled 的结束标记收尾
+      if (final) {
+        if (cancelled) {
+          console.log(`用户 ${userId} 的流式回复 ${replyId} 已被更新的消息取代`);
+        }
+        clearAIProcessing(userId);
+      }
+
+      return res.json({
+        success: true,
+        message: '分段回复发送成功',
+        messageCount: message ? 1 : 0
+      });
+    }
+
     // 检查是否需要分段发送长回复
     const messages = splitLongMessage(message);
     
@@ -361,7 +497,7 @@ app.post('/api/ai/reply', async (req, res) => {
     }
 
     // AI处理完成，清除状态
-    aiResponseStatus.delete(userId);
+    clearAIProcessing(userId);
     
     res.json({ 
       success: true, 
@@ -370,7 +506,7 @@ app.post('/api/ai/reply', async (req, res) => {
     });
   } catch (error) {
     console.error('AI回复处理失败:', error);
-    aiResponseStatus.delete(userId);
+    clearAIProcessing(userId);
     res.status(500).json({ error: '回复处理失败' });
   }
 });